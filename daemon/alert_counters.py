@@ -0,0 +1,105 @@
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+# Dimensions alerts are counted by, in key order
+DIMENSIONS = ("severity", "status", "source", "rule")
+
+
+def _key(rec: Dict) -> Tuple[str, str, str, str]:
+    return (
+        str(rec.get("severity") or "unknown").lower(),
+        str(rec.get("status") or "open").lower(),
+        str(rec.get("source") or "daemon").lower(),
+        str(rec.get("rule") or ""),
+    )
+
+
+def is_countable(rec: Dict) -> bool:
+    """Alerts with an id; audit lines (alert_id / action without id) are not counted."""
+    return isinstance(rec, dict) and bool(rec.get("id")) and "alert_id" not in rec
+
+
+class AlertCounters:
+    """
+    Incrementally maintained alert counts by severity x status x source x rule.
+
+    Stores feed every alert they index through `observe` and every status
+    change through `apply`, so summaries cost O(number of distinct keys)
+    rather than a pass over the alert log.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys: Dict[str, Tuple] = {}   # alert id -> current key
+        self._counts: Counter = Counter()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._keys = {}
+            self._counts = Counter()
+
+    def _set(self, aid: str, key: Tuple) -> None:
+        old = self._keys.get(aid)
+        if old == key:
+            return
+        if old is not None:
+            self._counts[old] -= 1
+            if self._counts[old] <= 0:
+                del self._counts[old]
+        self._keys[aid] = key
+        self._counts[key] += 1
+
+    def observe(self, rec: Dict) -> None:
+        """Count a newly indexed alert; a newer record for a known id replaces the old one."""
+        if not is_countable(rec):
+            return
+        with self._lock:
+            self._set(rec["id"], _key(rec))
+
+    def apply(self, aid: str, fields: Dict) -> None:
+        """Move an alert to a new key after an in-place update (e.g. a status change)."""
+        with self._lock:
+            old = self._keys.get(aid)
+            if old is None:
+                return
+            current = dict(zip(DIMENSIONS, old))
+            current.update({k: v for k, v in fields.items() if k in DIMENSIONS})
+            self._set(aid, _key(current))
+
+    def forget(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for aid in ids:
+                old = self._keys.pop(aid, None)
+                if old is not None:
+                    self._counts[old] -= 1
+                    if self._counts[old] <= 0:
+                        del self._counts[old]
+
+    def count(self, **filters) -> int:
+        """Number of alerts matching the given dimension values (all when no filters)."""
+        wanted = [(DIMENSIONS.index(k), str(v).lower() if k != "rule" else str(v)) for k, v in filters.items() if v]
+        with self._lock:
+            if not wanted:
+                return sum(self._counts.values())
+            return sum(n for key, n in self._counts.items() if all(key[i] == v for i, v in wanted))
+
+    def summary(self, top_rules: Optional[int] = 20) -> Dict:
+        """Totals broken down by each dimension, plus the counters the dashboard cards use."""
+        by = {dim: Counter() for dim in DIMENSIONS}
+        with self._lock:
+            items = list(self._counts.items())
+        for key, n in items:
+            for dim, value in zip(DIMENSIONS, key):
+                by[dim][value] += n
+        total = sum(n for _, n in items)
+        return {
+            "total": total,
+            "critical": by["severity"].get("critical", 0),
+            "high": by["severity"].get("high", 0),
+            "unresolved": total - by["status"].get("resolved", 0),
+            "by_severity": dict(by["severity"]),
+            "by_status": dict(by["status"]),
+            "by_source": dict(by["source"]),
+            "by_rule": dict(by["rule"].most_common(top_rules)),
+        }
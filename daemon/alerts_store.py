@@ -1,44 +1,1227 @@
 import os
+import re
+import gzip
+import time
+import queue
+import base64
 import json
 import logging
-from typing import List, Dict
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import BinaryIO, List, Dict, Optional, Iterator, Iterable, Set, Tuple
+
+from alert_counters import AlertCounters
 
 log = logging.getLogger(__name__)
 
+# Status changes are appended as small delta lines instead of rewriting the
+# file. They carry this marker key so readers can tell them apart from alerts.
+DELTA_KEY = "_delta"
 
-def read_alerts(file_path: str) -> List[Dict]:
-    alerts = []
-    if not os.path.exists(file_path):
-        return alerts
+# Frontend deduplication appends -1, -2, ... to repeated IDs
+_SUFFIXED_ID_RE = re.compile(r'^(.+)-(\d+)$')
+
+DEFAULT_SETTINGS = {
+    "max_segment_mb": 64,       # rotate the active segment once it reaches this size
+    "rotate_daily": True,       # ...or when the UTC day changes
+    "compress_after_days": 0,   # gzip sealed segments older than this (0 = never)
+    "delete_after_days": 0,     # delete sealed segments older than this (0 = never)
+    "group_commit": True,       # appends go through one writer thread per store
+    "flush_interval_ms": 0,     # how long the writer waits to grow a batch (0 = take what is queued)
+    "max_batch": 500,           # records per write
+    "fsync": "none",            # "batch" = fsync after every batch, "none" = leave it to the OS
+}
+
+_SETTINGS: Dict = dict(DEFAULT_SETTINGS)
+
+# Block size for reading files backwards from the end
+REVERSE_BLOCK_SIZE = 64 * 1024
+
+# "jsonl" (default) keeps alerts in segmented JSONL files; "sqlite" uses sqlite_store
+ALERTS_BACKEND = os.environ.get("ALERTS_BACKEND", "jsonl").strip().lower()
+
+# Fields alerts can be filtered on, shared by every backend
+FILTER_FIELDS = ("severity", "status", "source", "rule", "container_id", "image")
+
+
+def is_delta(record: Dict) -> bool:
+    return isinstance(record, dict) and DELTA_KEY in record
+
+
+def is_alert(record: Dict) -> bool:
+    """False for delta records and for audit lines mixed into the alert log."""
+    if not isinstance(record, dict) or DELTA_KEY in record:
+        return False
+    return "alert_id" not in record and not ("action" in record and "id" not in record)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def alert_field(rec: Dict, name: str) -> Optional[str]:
+    """Extract a filterable field from the different alert shapes (daemon, falco, inspection)."""
+    if name == "container_id":
+        value = (rec.get("container") or {}).get("id") or (rec.get("metadata") or {}).get("id")
+    elif name == "image":
+        value = rec.get("image") or (rec.get("container") or {}).get("image")
+    elif name == "timestamp":
+        value = rec.get("timestamp") or rec.get("log_time")
+    elif name == "status":
+        value = rec.get("status") or "open"
+    else:
+        value = rec.get(name)
+    return None if value is None else str(value)
+
+
+def match_filters(rec: Dict, filters: Optional[Dict]) -> bool:
+    """
+    In-process equivalent of the SQL filters: exact match on FILTER_FIELDS
+    (prefix match for container_id), plus `since` / `until` datetimes.
+    """
+    if not filters:
+        return True
+    for name in FILTER_FIELDS:
+        wanted = filters.get(name)
+        if not wanted:
+            continue
+        value = alert_field(rec, name)
+        if value is None:
+            return False
+        if name == "container_id":
+            if not value.startswith(wanted):
+                return False
+        elif value.lower() != str(wanted).lower():
+            return False
+    since, until = filters.get("since"), filters.get("until")
+    if since or until:
+        ts = parse_timestamp(alert_field(rec, "timestamp"))
+        if ts is None or (since and ts < since) or (until and ts > until):
+            return False
+    return True
+
+
+def encode_cursor(position: Dict) -> str:
+    """Opaque, URL-safe page cursor for a store-specific position."""
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Dict]:
+    """Inverse of encode_cursor. Raises ValueError for malformed cursors."""
+    if not cursor:
+        return None
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("invalid cursor")
+    return position
+
+
+def take_page(positioned: Iterable[Tuple[Dict, Dict]], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Collect up to `limit` alerts from (position, record) pairs, skipping audit
+    lines. Returns the page and a cursor for the next one (None once the
+    stream is exhausted).
+    """
+    items: List[Dict] = []
+    for position, rec in positioned:
+        if not is_alert(rec):
+            continue
+        items.append(rec)
+        if len(items) >= limit:
+            return items, encode_cursor(position)
+    return items, None
+
+
+def _open_segment(path: str, compressed: bool, mode: str = "rb"):
+    return gzip.open(path, mode) if compressed else open(path, mode)
+
+
+def _close_segments(segs: List[Tuple[str, Optional[BinaryIO], bool, Optional[int]]]) -> None:
+    for _name, f, _compressed, _end in segs:
+        if f is not None:
+            f.close()
+
+
+def iter_reverse_lines(path: str, end: Optional[int] = None, block_size: int = REVERSE_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Yield the lines of `path` last-to-first (without trailing newlines), reading
+    fixed-size blocks backwards from `end` (default: end of file). Only the
+    blocks the caller actually consumes are read.
+    """
+    for _offset, line in iter_reverse_lines_at(path, end, block_size):
+        yield line
+
+
+def iter_reverse_lines_at(path: str, end: Optional[int] = None, block_size: int = REVERSE_BLOCK_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """Like iter_reverse_lines, but yields (byte offset of the line, line)."""
+    with open(path, "rb") as f:
+        yield from _reverse_lines_at(f, end, block_size)
+
+
+def _reverse_lines_at(f, end: Optional[int], block_size: int = REVERSE_BLOCK_SIZE) -> Iterator[Tuple[int, bytes]]:
+    if end is None:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+    pos = end
+    partial = b""
+    while pos > 0:
+        size = min(block_size, pos)
+        pos -= size
+        f.seek(pos)
+        chunk = f.read(size) + partial
+        lines = chunk.split(b"\n")
+        # The first piece may continue in the previous block
+        partial = lines[0]
+        line_end = pos + len(chunk)
+        for line in reversed(lines[1:]):
+            start = line_end - len(line)
+            if line:
+                yield start, line
+            line_end = start - 1
+    if partial:
+        yield 0, partial
+
+
+class AlertStore:
+    """
+    Append-only JSONL alert store split into time/size-rotated segments, with
+    an in-memory id -> (segment, byte offset) index.
+
+    `file_path` (e.g. alerts.jsonl) is always the active segment. When it
+    passes `max_segment_mb` or the UTC day changes it is sealed and moved to
+    `<stem>.segments/<stem>-YYYYMMDD-NNNN.jsonl`; the segment list and the
+    time span each segment covers are kept in `<stem>.segments/manifest.json`.
+    Old sealed segments can be gzipped or deleted by retention settings.
+
+    Updates to an existing alert are written as delta records
+    ({"_delta": "update", "target": <id>, "fields": {...}}) and folded into the
+    alert whenever it is read, so a status change costs one small append.
+    """
+
+    def __init__(self, file_path: str, settings: Optional[Dict] = None, read_only: bool = False):
+        self.file_path = file_path
+        self.read_only = read_only                       # only read; never create the manifest or segments dir
+        base = os.path.splitext(file_path)[0]
+        self.stem = os.path.basename(base)
+        self.segments_dir = f"{base}.segments"
+        self.manifest_path = os.path.join(self.segments_dir, "manifest.json")
+        self.settings = dict(settings or _SETTINGS)
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compacting = False
+        self.counters = AlertCounters()
+        self._writer: Optional["AlertWriter"] = None
+        self._fh = None                                  # append handle on the active segment
+        self._fh_inode = None
+        self._reset()
+
+    # ---- index maintenance (caller holds the lock) ----
+
+    def _reset(self) -> None:
+        self._loaded = False
+        self._manifest: Dict = {"active": None, "segments": []}
+        self._sealed: Dict[str, Dict] = {}               # name -> manifest entry
+        self._index: Dict[str, Tuple[str, int]] = {}     # alert id -> (segment, offset) of latest full record
+        self._overlay: Dict[str, Dict] = {}              # alert id -> folded delta fields
+        self._seg_lines: Dict[str, int] = {}             # lines per segment, including deltas and junk
+        self._seg_live: Dict[str, int] = {}              # lines per segment that compaction would keep
+        self._active_size = 0
+        self._active_inode = None
+        self._growth = 0                                 # bytes appended since load / last compaction
+        self.counters.reset()
+
+    def _index_record(self, rec: Optional[Dict], seg: str, offset: int) -> None:
+        self._seg_lines[seg] = self._seg_lines.get(seg, 0) + 1
+        if not isinstance(rec, dict):
+            return
+        if DELTA_KEY in rec:
+            target = rec.get("target")
+            if target:
+                self._overlay.setdefault(target, {}).update(rec.get("fields") or {})
+                self.counters.apply(target, rec.get("fields") or {})
+            return
+        aid = rec.get("id")
+        if aid:
+            self.counters.observe(rec)
+            prev = self._index.get(aid)
+            if prev:
+                self._seg_live[prev[0]] = self._seg_live.get(prev[0], 0) - 1
+            self._index[aid] = (seg, offset)
+            # A newer full record supersedes any earlier deltas
+            self._overlay.pop(aid, None)
+        # Records without an id (audit lines) are kept as-is
+        self._seg_live[seg] = self._seg_live.get(seg, 0) + 1
+
+    def _index_file(self, seg: str, path: str, compressed: bool = False, start: int = 0) -> int:
+        """Index complete lines of `path` from `start`; returns the offset after the last one."""
+        offset = start
+        try:
+            with _open_segment(path, compressed) as f:
+                if start:
+                    f.seek(start)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Partial trailing write; it is picked up on a later refresh
+                        break
+                    try:
+                        rec = json.loads(line)
+                    except Exception:
+                        rec = None
+                    self._index_record(rec, seg, offset)
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.exception(f"Failed to index alerts segment {path}: {e}")
+        return offset
+
+    def _new_active(self, now: Optional[datetime] = None) -> Dict:
+        now = now or _utcnow()
+        prefix = f"{self.stem}-{now.strftime('%Y%m%d')}-"
+        names = list(self._sealed)
+        if self._manifest.get("active"):
+            names.append(self._manifest["active"]["name"])
+        seq = 0
+        for name in names:
+            if name.startswith(prefix):
                 try:
-                    alerts.append(json.loads(line))
-                except Exception:
+                    seq = max(seq, int(name[len(prefix):].split(".", 1)[0]))
+                except ValueError:
+                    continue
+        return {"name": f"{prefix}{seq + 1:04d}.jsonl", "opened": now.isoformat()}
+
+    def _load_manifest(self) -> None:
+        manifest = None
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except Exception as e:
+                log.warning("Unreadable alerts manifest %s (%s); rebuilding from directory", self.manifest_path, e)
+        if manifest is None and os.path.isdir(self.segments_dir):
+            # Manifest lost: recover sealed segments from the directory listing
+            segments = []
+            for fname in sorted(os.listdir(self.segments_dir)):
+                if not fname.startswith(f"{self.stem}-") or not fname.endswith((".jsonl", ".jsonl.gz")):
                     continue
+                path = os.path.join(self.segments_dir, fname)
+                segments.append({
+                    "name": fname[:-3] if fname.endswith(".gz") else fname,
+                    "opened": None,
+                    "closed": datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).isoformat(),
+                    "size": None,
+                    "compressed": fname.endswith(".gz"),
+                })
+            manifest = {"active": None, "segments": segments}
+        manifest = manifest or {"active": None, "segments": []}
+        manifest.setdefault("segments", [])
+        self._manifest = manifest
+        self._sealed = {e["name"]: e for e in manifest["segments"]}
+        if not manifest.get("active"):
+            # First start, or a legacy single-file store: the existing file becomes the active segment
+            manifest["active"] = self._new_active()
+            if not self.read_only:
+                self._save_manifest()
+
+    def _save_manifest(self) -> None:
+        os.makedirs(self.segments_dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _load(self) -> None:
+        self._reset()
+        self._load_manifest()
+        for entry in self._manifest["segments"]:
+            path = self._segment_path(entry["name"])
+            if not os.path.exists(path):
+                log.warning("Alerts segment %s listed in manifest is missing", path)
+                continue
+            self._index_file(entry["name"], path, bool(entry.get("compressed")))
+        try:
+            self._active_inode = os.stat(self.file_path).st_ino
+        except FileNotFoundError:
+            self._active_inode = None
+        self._active_size = self._index_file(self._active_name(), self.file_path)
+        self._loaded = True
+
+    def _refresh(self) -> None:
+        """Index lines appended to the active segment since the last refresh."""
+        if not self._loaded:
+            self._load()
+            return
+        try:
+            st = os.stat(self.file_path)
+        except FileNotFoundError:
+            if self._active_size:
+                self._load()
+            return
+        if self._active_inode is not None and (st.st_ino != self._active_inode or st.st_size < self._active_size):
+            log.info("Alerts file %s was replaced externally; rebuilding index", self.file_path)
+            self._load()
+            return
+        self._active_inode = st.st_ino
+        if st.st_size == self._active_size:
+            return
+        end = self._index_file(self._active_name(), self.file_path, start=self._active_size)
+        self._growth += end - self._active_size
+        self._active_size = end
+
+    def _active_name(self) -> str:
+        return self._manifest["active"]["name"]
+
+    def _segment_path(self, name: str) -> str:
+        if self._manifest.get("active") and name == self._active_name():
+            return self.file_path
+        path = os.path.join(self.segments_dir, name)
+        return f"{path}.gz" if (self._sealed.get(name) or {}).get("compressed") else path
+
+    def _maybe_rotate(self) -> None:
+        if self._compacting:
+            return
+        now = _utcnow()
+        opened = parse_timestamp(self._manifest["active"].get("opened")) or now
+        new_day = bool(self.settings.get("rotate_daily", True)) and opened.date() != now.date()
+        max_bytes = int(float(self.settings.get("max_segment_mb") or 0) * 1024 * 1024)
+        too_big = max_bytes > 0 and self._active_size >= max_bytes
+        if not (new_day or too_big):
+            return
+        if self._active_size == 0:
+            # Nothing references an empty active segment yet; just rename it for the new day
+            self._manifest["active"] = self._new_active(now)
+            self._save_manifest()
+            return
+        self._rotate(now)
+
+    def _rotate(self, now: datetime) -> None:
+        active = self._manifest["active"]
+        name = active["name"]
+        os.makedirs(self.segments_dir, exist_ok=True)
+        os.replace(self.file_path, os.path.join(self.segments_dir, name))
+        entry = {
+            "name": name,
+            "opened": active.get("opened"),
+            "closed": now.isoformat(),
+            "size": self._active_size,
+            "compressed": False,
+        }
+        self._manifest["segments"].append(entry)
+        self._sealed[name] = entry
+        self._manifest["active"] = self._new_active(now)
+        self._save_manifest()
+        # Recreate the active file so code that checks for ALERTS_FILE keeps working
+        open(self.file_path, "ab").close()
+        self._active_inode = os.stat(self.file_path).st_ino
+        self._active_size = 0
+        log.info("Rotated alerts segment %s (%d bytes)", name, entry["size"])
+
+    def _fold(self, rec: Dict) -> Dict:
+        fields = self._overlay.get(rec.get("id")) if isinstance(rec, dict) else None
+        if fields:
+            rec = dict(rec)
+            rec.update(fields)
+        return rec
+
+    def _read_at(self, loc: Tuple[str, int]) -> Optional[Dict]:
+        seg, offset = loc
+        compressed = bool((self._sealed.get(seg) or {}).get("compressed"))
+        with _open_segment(self._segment_path(seg), compressed) as f:
+            f.seek(offset)
+            line = f.readline()
+        try:
+            return json.loads(line)
+        except Exception:
+            return None
+
+    def _handle(self):
+        """Append handle on the active segment, reopened after rotation, compaction or replacement."""
+        if self._fh is not None and self._active_inode is not None and self._fh_inode == self._active_inode:
+            return self._fh
+        if self._fh is not None:
+            self._fh.close()
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        self._fh = open(self.file_path, "ab")
+        self._fh_inode = os.fstat(self._fh.fileno()).st_ino
+        if self._active_inode is None:
+            self._active_inode = self._fh_inode
+        return self._fh
+
+    def _append_lines(self, lines: List[bytes]) -> List[Tuple[str, int]]:
+        """Write pre-serialized lines in one go; returns the (segment, offset) of each."""
+        self._maybe_rotate()
+        f = self._handle()
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        if offset != self._active_size:
+            # Terminate a partial line left behind by an interrupted writer
+            f.write(b"\n")
+            offset += 1
+        name = self._active_name()
+        locs = []
+        for data in lines:
+            locs.append((name, offset))
+            offset += len(data)
+        f.write(b"".join(lines))
+        f.flush()
+        if self.settings.get("fsync") == "batch":
+            os.fsync(f.fileno())
+        self._growth += offset - self._active_size
+        self._active_size = offset
+        return locs
+
+    def _append_line(self, rec: Dict) -> Tuple[str, int]:
+        return self._append_lines([(json.dumps(rec) + "\n").encode("utf-8")])[0]
+
+    def _write_batch(self, records: List[Dict]) -> List[Optional[BaseException]]:
+        """Append a batch for the group-commit writer; returns one error (or None) per record."""
+        errors: List[Optional[BaseException]] = [None] * len(records)
+        lines, kept = [], []
+        for i, rec in enumerate(records):
+            try:
+                lines.append((json.dumps(rec) + "\n").encode("utf-8"))
+                kept.append(rec)
+            except Exception as e:
+                errors[i] = e
+        if lines:
+            with self._lock:
+                self._refresh()
+                for rec, (seg, offset) in zip(kept, self._append_lines(lines)):
+                    self._index_record(rec, seg, offset)
+        return errors
+
+    def _segments_newest_first(self, since: Optional[datetime] = None) -> List[Tuple[str, str, bool, Optional[int]]]:
+        """Snapshot (name, path, compressed, end) for the segments a query needs to open."""
+        segs = [(self._active_name(), self.file_path, False, self._active_size)]
+        for entry in reversed(self._manifest["segments"]):
+            closed = parse_timestamp(entry.get("closed"))
+            if since and closed and closed < since:
+                # Manifest order is chronological, so every older segment is out of range too
+                break
+            segs.append((entry["name"], self._segment_path(entry["name"]), bool(entry.get("compressed")), None))
+        return segs
+
+    def _open_segments(self, segs: List[Tuple[str, str, bool, Optional[int]]]) -> List[Tuple[str, Optional[BinaryIO], bool, Optional[int]]]:
+        """
+        Open every segment of a snapshot; callers hold self._lock. An open handle
+        keeps reading the file it was opened on, so a rotation or compaction that
+        replaces the path afterwards can't shift `end` onto different bytes.
+        Segments already removed by retention come back with a None handle.
+        """
+        opened = []
+        try:
+            for name, path, compressed, end in segs:
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    f = None
+                opened.append((name, f, compressed, end))
+        except Exception:
+            _close_segments(opened)
+            raise
+        return opened
+
+    def _read_segment(self, f: Optional[BinaryIO], compressed: bool, end: Optional[int]) -> List[bytes]:
+        return [line for _offset, line in self._read_segment_at(f, compressed, end)]
+
+    def _read_segment_at(self, f: Optional[BinaryIO], compressed: bool, end: Optional[int]) -> List[Tuple[int, bytes]]:
+        lines: List[Tuple[int, bytes]] = []
+        if f is None:
+            return lines
+        f.seek(0)
+        src = gzip.GzipFile(fileobj=f, mode="rb") if compressed else f
+        pos = 0
+        for line in src:
+            start, pos = pos, pos + len(line)
+            if end is not None and pos > end:
+                break
+            lines.append((start, line))
+        return lines
+
+    def _reverse_segment(self, f: Optional[BinaryIO], compressed: bool, end: Optional[int]) -> Iterator[bytes]:
+        for _offset, line in self._reverse_segment_at(f, compressed, end):
+            yield line
+
+    def _reverse_segment_at(self, f: Optional[BinaryIO], compressed: bool, end: Optional[int]) -> Iterator[Tuple[int, bytes]]:
+        if f is None:
+            return
+        if compressed:
+            # gzip streams can't be read backwards cheaply; old segments are read whole
+            yield from reversed(self._read_segment_at(f, compressed, end))
+            return
+        yield from _reverse_lines_at(f, end)
+
+    def _records(self, lines: Iterable[bytes]) -> Iterator[Dict]:
+        for line in lines:
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if is_delta(rec):
+                continue
+            yield self._fold(rec)
+
+    # ---- public API ----
+
+    def resolve_id(self, alert_id: str) -> Optional[str]:
+        """Map an exact ID, or a frontend-suffixed ID like "<id>-1", to a stored alert ID."""
+        with self._lock:
+            self._refresh()
+            if alert_id in self._index:
+                return alert_id
+            match = _SUFFIXED_ID_RE.match(alert_id or "")
+            if match and match.group(1) in self._index:
+                return match.group(1)
+        return None
+
+    def get(self, alert_id: str) -> Optional[Dict]:
+        with self._lock:
+            aid = self.resolve_id(alert_id)
+            if aid is None:
+                return None
+            rec = self._read_at(self._index[aid])
+            return self._fold(rec) if rec else None
+
+    def append(self, alert: Dict) -> None:
+        """Append a record and wait until it is written (and fsynced, if configured)."""
+        self.append_async(alert).result()
+
+    def append_async(self, alert: Dict) -> Future:
+        """Queue a record on the group-commit writer; the future resolves once it is written."""
+        return submit_append(self, alert)
+
+    def update(self, alert_id: str, fields: Dict) -> Optional[Dict]:
+        """
+        Apply `fields` to an alert by appending a delta record.
+        Returns the updated alert, or None if the ID is unknown.
+        """
+        with self._lock:
+            aid = self.resolve_id(alert_id)
+            if aid is None:
+                return None
+            rec = self._read_at(self._index[aid])
+            if rec is None:
+                return None
+            delta = {
+                DELTA_KEY: "update",
+                "target": aid,
+                "fields": fields,
+                "ts": _utcnow().isoformat(),
+            }
+            seg, offset = self._append_line(delta)
+            self._index_record(delta, seg, offset)
+            return self._fold(rec)
+
+    def iter_newest(self, filters: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        Yield records newest-first with deltas folded in, optionally narrowed by
+        `filters` (see match_filters). Segments are opened one at a time, newest
+        first, and only those whose time span reaches back to filters["since"].
+        Plain segments are read backwards in blocks, so a caller that stops
+        after N records only touches the tail of the log.
+        """
+        with self._lock:
+            self._refresh()
+            segs = self._open_segments(self._segments_newest_first((filters or {}).get("since")))
+        try:
+            for _name, f, compressed, end in segs:
+                for rec in self._records(self._reverse_segment(f, compressed, end)):
+                    if match_filters(rec, filters):
+                        yield rec
+        finally:
+            _close_segments(segs)
+
+    def _resume_segments(self, segs: List[Tuple[str, str, bool, Optional[int]]], position: Dict) -> List[Tuple[str, str, bool, Optional[int]]]:
+        """Cut a newest-first segment snapshot down to what lies strictly before a cursor position."""
+        name, offset = position.get("s"), position.get("o")
+        if not isinstance(name, str) or not isinstance(offset, int):
+            raise ValueError("invalid cursor")
+        loc = self._index.get(position.get("i"))
+        if loc and loc[0] == name and loc[1] <= offset:
+            # Compaction only moves records towards the start of their segment
+            offset = loc[1]
+        out = []
+        for seg_name, path, compressed, end in segs:
+            if seg_name == name:
+                out.append((seg_name, path, compressed, offset if end is None else min(offset, end)))
+            elif seg_name < name:
+                # Segment names sort chronologically, so this also works if the
+                # cursor's segment has since been deleted by retention
+                out.append((seg_name, path, compressed, end))
+        return out
+
+    def iter_newest_positioned(self, filters: Optional[Dict] = None, position: Optional[Dict] = None) -> Iterator[Tuple[Dict, Dict]]:
+        """
+        Like iter_newest, but yields (position, record) pairs, starts just
+        after `position` when given, and skips records superseded by a newer
+        record with the same id, so consecutive pages never repeat an alert.
+        """
+        with self._lock:
+            self._refresh()
+            segs = self._segments_newest_first((filters or {}).get("since"))
+            if position:
+                segs = self._resume_segments(segs, position)
+            segs = self._open_segments(segs)
+        try:
+            for name, f, compressed, end in segs:
+                for offset, line in self._reverse_segment_at(f, compressed, end):
+                    try:
+                        rec = json.loads(line)
+                    except Exception:
+                        continue
+                    if is_delta(rec):
+                        continue
+                    aid = rec.get("id") if isinstance(rec, dict) else None
+                    if aid:
+                        loc = self._index.get(aid)
+                        if loc and loc > (name, offset):
+                            continue
+                    rec = self._fold(rec)
+                    if match_filters(rec, filters):
+                        yield {"s": name, "o": offset, "i": aid}, rec
+        finally:
+            _close_segments(segs)
+
+    def page(self, filters: Optional[Dict] = None, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        """One page of alerts newest-first, plus the cursor for the next page."""
+        return take_page(self.iter_newest_positioned(filters, decode_cursor(cursor)), limit)
+
+    def iter_oldest(self) -> Iterator[Dict]:
+        """Yield every record in write order with deltas folded in."""
+        with self._lock:
+            self._refresh()
+            segs = self._open_segments(list(reversed(self._segments_newest_first())))
+        try:
+            for _name, f, compressed, end in segs:
+                yield from self._records(self._read_segment(f, compressed, end))
+        finally:
+            _close_segments(segs)
+
+    def read_all(self) -> List[Dict]:
+        """Return every record in write order, with deltas folded in and removed."""
+        return list(self.iter_oldest())
+
+    def write_all(self, alerts: List[Dict]) -> None:
+        """Atomically replace the store contents with `alerts` and rebuild the index."""
+        with self._compact_lock, self._lock:
+            self._refresh()
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            tmp_path = f"{self.file_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for a in alerts:
+                    f.write(json.dumps(a) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+            for entry in self._manifest["segments"]:
+                try:
+                    os.remove(self._segment_path(entry["name"]))
+                except FileNotFoundError:
+                    pass
+            self._manifest["segments"] = []
+            self._save_manifest()
+            self._load()
+
+    def count(self, filters: Optional[Dict] = None) -> int:
+        if filters:
+            return sum(1 for _ in self.iter_newest(filters))
+        with self._lock:
+            self._refresh()
+            return len(self._index)
+
+    def summary(self) -> Dict:
+        """Alert counts by severity/status/source/rule, maintained incrementally as the log is indexed."""
+        with self._lock:
+            self._refresh()
+            return self.counters.summary()
+
+    def stats(self) -> Dict:
+        """Line and byte counters used to decide when compaction is worthwhile."""
+        with self._lock:
+            self._refresh()
+            lines = sum(self._seg_lines.values())
+            live = sum(self._seg_live.values())
+            size = self._active_size + sum(int(e.get("size") or 0) for e in self._manifest["segments"])
+            return {
+                "lines": lines,
+                "live": live,
+                "dead": max(0, lines - live),
+                "size_bytes": size,
+                "growth_bytes": self._growth,
+                "segments": len(self._manifest["segments"]) + 1,
+            }
+
+    def should_compact(self, max_dead_ratio: float, max_growth_bytes: int, min_size_bytes: int = 0) -> bool:
+        st = self.stats()
+        if st["lines"] == 0 or st["size_bytes"] < min_size_bytes:
+            return False
+        if max_dead_ratio and st["dead"] / st["lines"] >= max_dead_ratio:
+            return True
+        return bool(max_growth_bytes) and st["growth_bytes"] >= max_growth_bytes
+
+    # ---- compaction and retention ----
+
+    def _rewrite(self, seg: str, src, dst, end: Optional[int], overlay: Dict, drop_deltas: bool,
+                 folded: Iterable[str] = ()):
+        """
+        Copy the lines of `seg` that are still live from src to dst, folding
+        `overlay` into them. Deltas are dropped if `drop_deltas` is set, if a
+        newer full record superseded them, or if their alert lives in one of the
+        `folded` segments (rewritten with the overlay in this pass); any other
+        delta is kept until the segment holding its alert has been rewritten.
+        Returns (moves, kept, lines, bytes) where moves lists (alert id, old
+        offset, new offset) for every alert written and kept counts the lines
+        written that carry no alert id.
+        """
+        moves = []
+        kept = 0
+        lines = 0
+        written = 0
+        offset = 0
+        while end is None or offset < end:
+            line = src.readline()
+            if not line:
+                break
+            line_offset = offset
+            offset += len(line)
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if not isinstance(rec, dict):
+                continue
+            if DELTA_KEY in rec:
+                loc = self._index.get(rec.get("target"))
+                if drop_deltas or loc is None or loc > (seg, line_offset) or loc[0] in folded:
+                    continue
+            elif rec.get("id"):
+                aid = rec["id"]
+                if self._index.get(aid) != (seg, line_offset):
+                    continue  # superseded by a newer record
+                fields = overlay.get(aid)
+                if fields:
+                    rec.update(fields)
+                    line = (json.dumps(rec) + "\n").encode("utf-8")
+                moves.append((aid, line_offset, written))
+            else:
+                # keep alerts without id as-is (they may be processed later)
+                kept += 1
+            dst.write(line)
+            lines += 1
+            written += len(line)
+        return moves, kept, lines, written
+
+    def _apply_moves(self, seg: str, moves: List[Tuple[str, int, int]], kept: int, lines: int) -> None:
+        live = kept
+        for aid, old, new in moves:
+            # Alerts superseded while we were rewriting stay dead
+            if self._index.get(aid) == (seg, old):
+                self._index[aid] = (seg, new)
+                live += 1
+        self._seg_lines[seg] = lines
+        self._seg_live[seg] = live
+
+    def _compact_sealed(self, entry: Dict, overlay: Dict, folded: Set[str]) -> None:
+        name = entry["name"]
+        compressed = bool(entry.get("compressed"))
+        path = self._segment_path(name)
+        tmp_path = f"{path}.compact.tmp"
+        try:
+            with _open_segment(path, compressed) as src, _open_segment(tmp_path, compressed, "wb") as dst:
+                moves, kept, lines, written = self._rewrite(name, src, dst, None, overlay, False, folded | {name})
+            if lines == 0:
+                os.remove(tmp_path)
+                self._delete_segment(entry)
+                return
+            with self._lock:
+                os.replace(tmp_path, path)
+                self._apply_moves(name, moves, kept, lines)
+                entry["size"] = written
+                self._save_manifest()
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _compact_active(self, active: str, inode, end: int, overlay: Dict, drop_deltas: bool) -> bool:
+        tmp_path = f"{self.file_path}.compact.tmp"
+        try:
+            with open(self.file_path, "rb") as src, open(tmp_path, "wb") as dst:
+                moves, kept, lines, written = self._rewrite(active, src, dst, end, overlay, drop_deltas)
+
+                with self._lock:
+                    self._refresh()
+                    if self._active_inode != inode or self._active_size < end:
+                        log.warning("Alerts file %s changed during compaction; skipping swap", self.file_path)
+                        os.remove(tmp_path)
+                        return False
+                    # Carry over whatever was appended while we were rewriting
+                    src.seek(end)
+                    tail = src.read(self._active_size - end)
+                    dst.write(tail)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                    os.replace(tmp_path, self.file_path)
+
+                    self._active_inode = os.stat(self.file_path).st_ino
+                    self._apply_moves(active, moves, kept, lines)
+                    if drop_deltas:
+                        # Every pending delta has been folded; only the tail's deltas remain
+                        self._overlay = {}
+                    pos = written
+                    for tail_line in tail.splitlines(keepends=True):
+                        try:
+                            rec = json.loads(tail_line)
+                        except Exception:
+                            rec = None
+                        if isinstance(rec, dict) and rec.get("id") and DELTA_KEY not in rec:
+                            loc = self._index.get(rec["id"])
+                            if loc and loc[0] == active and loc[1] >= end:
+                                # Re-indexed below at its new offset
+                                del self._index[rec["id"]]
+                        self._index_record(rec, active, pos)
+                        pos += len(tail_line)
+                    self._active_size = pos
+                    self._growth = len(tail)
+            return True
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def compact(self) -> bool:
+        """
+        Fold deltas into their alerts and keep only the newest record per ID.
+
+        Sealed segments with dead lines (or holding alerts that have pending
+        deltas) are rewritten one at a time. The active segment is rewritten
+        into a temp file without holding the store lock, so appends continue
+        meanwhile; lines appended during the rewrite are copied over before the
+        temp file is atomically renamed into place. Readers see either the old
+        file or the new one, never a mix. Returns True if anything was replaced.
+        """
+        with self._compact_lock:
+            with self._lock:
+                self._refresh()
+                if not sum(self._seg_lines.values()):
+                    return False
+                size_before = self.stats()["size_bytes"]
+                self._compacting = True
+                overlay = {k: dict(v) for k, v in self._overlay.items()}
+                targets = {self._index[t][0] for t in overlay if t in self._index}
+                sealed = [
+                    e for e in self._manifest["segments"]
+                    if self._seg_lines.get(e["name"], 0) > self._seg_live.get(e["name"], 0) or e["name"] in targets
+                ]
+                active = self._active_name()
+                inode = self._active_inode
+                end = self._active_size
+
+            try:
+                all_sealed_ok = True
+                # Sealed segments whose alerts now carry their deltas; a delta in a later
+                # segment is only dropped once its alert's segment is in here. Deltas of
+                # alerts in the active segment stay on disk until the active swap succeeds.
+                folded: Set[str] = set()
+                for entry in sealed:
+                    try:
+                        self._compact_sealed(entry, overlay, folded)
+                        folded.add(entry["name"])
+                    except Exception:
+                        all_sealed_ok = False
+                        log.exception("Failed to compact alerts segment %s", entry["name"])
+                # Deltas can only be dropped once every alert they touch has them folded in
+                if not self._compact_active(active, inode, end, overlay, drop_deltas=all_sealed_ok):
+                    return bool(sealed)
+            finally:
+                with self._lock:
+                    self._compacting = False
+            log.info("Compacted alerts store %s: %d -> %d bytes", self.file_path, size_before, self.stats()["size_bytes"])
+            return True
+
+    def apply_retention(self, now: Optional[datetime] = None) -> None:
+        """Gzip or delete sealed segments older than the configured retention ages."""
+        now = now or _utcnow()
+        compress_days = float(self.settings.get("compress_after_days") or 0)
+        delete_days = float(self.settings.get("delete_after_days") or 0)
+        if not compress_days and not delete_days:
+            return
+        with self._compact_lock:
+            with self._lock:
+                self._refresh()
+                segments = list(self._manifest["segments"])
+            for entry in segments:
+                closed = parse_timestamp(entry.get("closed"))
+                if not closed:
+                    continue
+                age_days = (now - closed).total_seconds() / 86400
+                try:
+                    if delete_days and age_days >= delete_days:
+                        self._delete_segment(entry)
+                    elif compress_days and age_days >= compress_days and not entry.get("compressed"):
+                        self._gzip_segment(entry)
+                except Exception:
+                    log.exception("Retention failed for alerts segment %s", entry["name"])
+
+    def _delete_segment(self, entry: Dict) -> None:
+        name = entry["name"]
+        with self._lock:
+            path = self._segment_path(name)
+            self._manifest["segments"] = [e for e in self._manifest["segments"] if e["name"] != name]
+            self._sealed.pop(name, None)
+            self._save_manifest()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.counters.forget([k for k, v in self._index.items() if v[0] == name])
+            self._index = {k: v for k, v in self._index.items() if v[0] != name}
+            self._overlay = {k: v for k, v in self._overlay.items() if k in self._index}
+            self._seg_lines.pop(name, None)
+            self._seg_live.pop(name, None)
+        log.info("Deleted expired alerts segment %s", name)
+
+    def _gzip_segment(self, entry: Dict) -> None:
+        name = entry["name"]
+        path = os.path.join(self.segments_dir, name)
+        tmp_path = f"{path}.gz.tmp"
+        # Sealed segments only change under the compaction lock, which we hold
+        with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        with self._lock:
+            os.replace(tmp_path, f"{path}.gz")
+            entry["compressed"] = True
+            self._save_manifest()
+            os.remove(path)
+        log.info("Compressed alerts segment %s", name)
+
+
+class AlertWriter:
+    """
+    Group-commit writer for one store. Producers enqueue records and get a
+    Future; a single thread drains the queue and hands each batch to
+    `store._write_batch`, so concurrent producers share one write (and one
+    fsync) and lines from different threads never interleave.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._queue: "queue.Queue[Tuple[Dict, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"alerts-writer-{os.path.basename(store.file_path)}", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict) -> Future:
+        fut: Future = Future()
+        self._queue.put((record, fut))
+        return fut
+
+    def _collect(self) -> List[Tuple[Dict, Future]]:
+        batch = [self._queue.get()]
+        settings = self.store.settings
+        max_batch = max(1, int(settings.get("max_batch") or 1))
+        deadline = time.monotonic() + float(settings.get("flush_interval_ms") or 0) / 1000
+        while len(batch) < max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                errors = self.store._write_batch([rec for rec, _ in batch])
+            except Exception as e:
+                log.exception("Failed to write %d alert records to %s", len(batch), self.store.file_path)
+                errors = [e] * len(batch)
+            for (_, fut), error in zip(batch, errors):
+                if error is None:
+                    fut.set_result(None)
+                else:
+                    fut.set_exception(error)
+
+
+_WRITERS_LOCK = threading.Lock()
+
+
+def submit_append(store, record: Dict) -> Future:
+    """Queue `record` on the store's writer, or write it inline when group commit is disabled."""
+    if not store.settings.get("group_commit", True):
+        fut: Future = Future()
+        error = store._write_batch([record])[0]
+        if error is None:
+            fut.set_result(None)
+        else:
+            fut.set_exception(error)
+        return fut
+    if store._writer is None:
+        with _WRITERS_LOCK:
+            if store._writer is None:
+                store._writer = AlertWriter(store)
+    return store._writer.submit(record)
+
+
+_STORES: Dict[str, AlertStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def configure(cfg: Optional[Dict]) -> None:
+    """Apply `alerts.segments` / `alerts.retention` / `alerts.writer` from config.yml to all stores."""
+    alerts_cfg = (cfg or {}).get("alerts") or {}
+    settings = dict(DEFAULT_SETTINGS)
+    for section in ("segments", "retention", "writer"):
+        for key, value in (alerts_cfg.get(section) or {}).items():
+            if key in settings and value is not None:
+                settings[key] = value
+    _SETTINGS.clear()
+    _SETTINGS.update(settings)
+    with _STORES_LOCK:
+        for store in _STORES.values():
+            store.settings = dict(settings)
+
+
+def get_store(file_path: str):
+    """
+    Return the process-wide store for `file_path`, creating it on first use.
+    With ALERTS_BACKEND=sqlite this is a sqlite_store.SqliteAlertStore, which
+    exposes the same methods.
+    """
+    key = os.path.abspath(file_path)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            if ALERTS_BACKEND == "sqlite":
+                from sqlite_store import SqliteAlertStore
+                store = SqliteAlertStore(file_path, settings=dict(_SETTINGS))
+            else:
+                store = AlertStore(file_path)
+            _STORES[key] = store
+        return store
+
+
+class AlertCompactor:
+    """
+    Background thread that applies segment retention and compacts an alert
+    store once it has accumulated enough dead lines (superseded records and
+    folded deltas) or grown enough since the last compaction. Thresholds come
+    from `alerts.compaction` in config.yml.
+    """
+
+    def __init__(self, store, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.store = store
+        self.enabled = cfg.get("enabled", True) is not False
+        self.interval = float(cfg.get("check_interval_seconds", 60))
+        self.max_dead_ratio = float(cfg.get("max_dead_ratio", 0.3))
+        self.max_growth_bytes = int(float(cfg.get("max_growth_mb", 64)) * 1024 * 1024)
+        self.min_size_bytes = int(float(cfg.get("min_size_mb", 1)) * 1024 * 1024)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> bool:
+        self.store.apply_retention()
+        if not self.enabled:
+            return False
+        if not self.store.should_compact(self.max_dead_ratio, self.max_growth_bytes, self.min_size_bytes):
+            return False
+        return self.store.compact()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("Background maintenance of %s failed", self.store.file_path)
+
+    def start(self) -> "AlertCompactor":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="alerts-compactor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def start_compactor(file_path: str, cfg: Optional[Dict] = None) -> AlertCompactor:
+    """Start background retention and compaction for `file_path` (`alerts.compaction` config section)."""
+    compaction_cfg = ((cfg or {}).get("alerts") or {}).get("compaction") or {}
+    if compaction_cfg.get("enabled", True) is False:
+        log.info("Alert compaction disabled by config; segment retention still applies")
+    return AlertCompactor(get_store(file_path), compaction_cfg).start()
+
+
+def read_alerts(file_path: str) -> List[Dict]:
+    try:
+        return get_store(file_path).read_all()
     except Exception as e:
         log.exception(f"Failed to read alerts file {file_path}: {e}")
-    return alerts
+        return []
+
+
+def iter_alerts_newest(file_path: str, filters: Optional[Dict] = None) -> Iterator[Dict]:
+    """Newest-first records from `file_path`; stop iterating as soon as you have enough."""
+    return get_store(file_path).iter_newest(filters)
+
+
+def page_alerts(file_path: str, filters: Optional[Dict] = None, cursor: Optional[str] = None,
+                limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+    """Newest-first page of alerts matching `filters`, and the cursor for the next page."""
+    return get_store(file_path).page(filters, cursor, limit)
 
 
 def write_alerts(alerts: List[Dict], file_path: str) -> None:
     try:
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w", encoding="utf-8") as f:
-            for a in alerts:
-                f.write(json.dumps(a) + "\n")
+        get_store(file_path).write_all(alerts)
     except Exception as e:
         log.exception(f"Failed to write alerts file {file_path}: {e}")
 
 
-def append_alert(alert: Dict, file_path: str) -> None:
+def append_alert(alert: Dict, file_path: str, wait: bool = True) -> Optional[Future]:
+    """
+    Append `alert` to `file_path`. With wait=False the write is only queued and
+    the returned future reports its outcome (failures are also logged).
+    """
     try:
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(alert) + "\n")
+        fut = get_store(file_path).append_async(alert)
+        if wait:
+            fut.result()
+            return fut
     except Exception as e:
         log.exception(f"Failed to append alert to {file_path}: {e}")
+        return None
+
+    def _log_failure(done: Future) -> None:
+        if done.exception() is not None:
+            log.error("Failed to append alert to %s: %s", file_path, done.exception())
+
+    fut.add_done_callback(_log_failure)
+    return fut
 
 
 def compact_alerts_file(file_path: str) -> None:
@@ -46,27 +1229,7 @@ def compact_alerts_file(file_path: str) -> None:
     Remove duplicate alerts from the file, keeping the most recent occurrence for each ID.
     This prevents duplicate IDs from accumulating in the alerts store.
     """
-    alerts = read_alerts(file_path)
-    if not alerts:
-        return
-
-    # Keep the most recent occurrence: iterate from end (newest) to start
-    seen = set()
-    unique_newest = []
-    for alert in reversed(alerts):
-        aid = alert.get("id")
-        if not aid:
-            # keep alerts without id as-is (they may be processed later)
-            unique_newest.append(alert)
-            continue
-        if aid in seen:
-            continue
-        seen.add(aid)
-        unique_newest.append(alert)
-
-    # unique_newest currently newest-first; reverse to oldest-first for file
-    compacted = list(reversed(unique_newest))
     try:
-        write_alerts(compacted, file_path)
+        get_store(file_path).compact()
     except Exception as e:
         log.exception(f"Failed to compact alerts file {file_path}: {e}")
@@ -15,7 +15,7 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)s %(message)s"
 )
 
-from events import docker_thread
+from events import docker_thread, gate_settings
 
 
 def create_app() -> Flask:
@@ -29,11 +29,45 @@ def create_app() -> Flask:
     ALERTS_FILE = os.environ.get("ALERTS_FILE", "/app/alerts/alerts.jsonl")
     os.makedirs(os.path.dirname(ALERTS_FILE), exist_ok=True)
 
+    # Admission gate settings are read on every `create`; refuse to start with invalid
+    # ones instead of leaving containers ungated
+    from utils import load_config
+    gate_settings(load_config())
+
     # Load approvals from file into memory
     from utils import _load_approvals_from_file
     _load_approvals_from_file()
     logging.info("Approvals loaded from file")
 
+    # Segment rotation/retention settings, then background compaction
+    from alerts_store import configure as configure_alerts_store, start_compactor
+    configure_alerts_store(load_config())
+    start_compactor(ALERTS_FILE, load_config())
+
+    # Build the alert index and summary counters in the background so the first
+    # dashboard request doesn't pay for it
+    import threading
+    from alerts_store import get_store
+    threading.Thread(target=get_store(ALERTS_FILE).summary, name="alerts-warmup", daemon=True).start()
+
+    # Long-lived local trivy server (trivy.server.enabled); scans use client mode once it is up
+    from utils import get_trivy_server
+    get_trivy_server().start()
+
+    # Stream stats of running containers into memory for the container list, dashboard and metrics;
+    # then seed the container inventory (kept current by Docker events, reconciled periodically)
+    from utils import get_stats_sampler, get_container_inventory
+
+    def _start_container_views():
+        get_stats_sampler().start()
+        get_container_inventory().start()
+
+    threading.Thread(target=_start_container_views, name="container-views-seed", daemon=True).start()
+
+    # Load persisted Trivy results so the first gate check after a restart doesn't rescan
+    from utils import warm_trivy_cache
+    threading.Thread(target=warm_trivy_cache, name="trivy-cache-warmup", daemon=True).start()
+
     # Try to create a Docker client for reuse; handlers may override if needed
     docker_client = None
     try:
@@ -56,6 +90,10 @@ def create_app() -> Flask:
     app.register_blueprint(containers_bp)
     app.register_blueprint(system_bp)
 
+    # Falco worker pool (also resumes events spilled to disk before a restart)
+    from routes.alerts import get_falco_coalescer
+    get_falco_coalescer(ALERTS_FILE)
+
     # Serve UI static files
     @app.route('/')
     def serve_index():
@@ -0,0 +1,201 @@
+"""
+Bulk container actions (stop / start / restart / pause / unpause / kill).
+
+Targets are picked from the container inventory by ID, name or prefix, or by a
+label / image selector. Actions run on a bounded thread pool so dozens of
+containers are handled in a few round trips' time without flooding dockerd.
+Each Docker call carries a client-side timeout of `timeout_seconds`, so one
+hung container is reported as "timeout" instead of holding up the batch
+(unless a re-inspect shows the action took effect after all). Results are
+yielded as they complete.
+"""
+import time
+import uuid
+import fnmatch
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import docker
+import requests
+
+from container_inventory import AmbiguousContainer, ContainerInfo, ContainerInventory
+
+log = logging.getLogger(__name__)
+
+ACTIONS = ("stop", "start", "restart", "pause", "unpause", "kill")
+
+DEFAULT_SETTINGS = {
+    "max_concurrency": 8,      # containers acted on at the same time
+    "timeout_seconds": 30,     # per container; the result is "timeout" after this
+    "stop_grace_seconds": 5,   # SIGTERM -> SIGKILL grace for stop / restart
+    "max_targets": 500,        # containers one request may select
+}
+
+
+def action_settings(cfg: Optional[Dict]) -> Dict:
+    """`containers.actions` from config.yml merged over DEFAULT_SETTINGS, as positive numbers."""
+    settings = dict(DEFAULT_SETTINGS)
+    for key, value in ((((cfg or {}).get("containers") or {}).get("actions")) or {}).items():
+        if key not in settings or value is None:
+            continue
+        kind = type(DEFAULT_SETTINGS[key])
+        try:
+            value = kind(value)
+        except (TypeError, ValueError):
+            log.warning("Ignoring containers.actions.%s=%r (not a number)", key, value)
+            continue
+        if value <= 0 and key != "stop_grace_seconds":
+            log.warning("Ignoring containers.actions.%s=%r (must be positive)", key, value)
+            continue
+        settings[key] = max(0, value)
+    return settings
+
+
+def select_containers(inventory: ContainerInventory, ids: Optional[Iterable[str]] = None,
+                      label: Optional[str] = None, image: Optional[str] = None
+                      ) -> Tuple[List[ContainerInfo], List[Dict]]:
+    """
+    Containers named by `ids` (IDs, names or prefixes), or else every container
+    matching `label` ("key" or "key=value") and the `image` glob. Returns
+    (targets, unresolved) where unresolved holds a result for each id that
+    matched nothing or several containers.
+    """
+    targets: Dict[str, ContainerInfo] = {}
+    unresolved = []
+    if ids:
+        for key in ids:
+            try:
+                info = inventory.resolve(str(key))
+            except AmbiguousContainer as e:
+                unresolved.append({"id": key, "status": "ambiguous", "error": str(e),
+                                   "matches": [c.short_id for c in e.matches]})
+                continue
+            if info is None:
+                unresolved.append({"id": key, "status": "not_found", "error": "No container with this ID or name"})
+            else:
+                targets[info.id] = info
+        return list(targets.values()), unresolved
+
+    label_key, _, label_value = (label or "").partition("=")
+    for info in inventory.containers(include_all=True):
+        if label_key and (label_key not in info.labels or ("=" in label and info.labels[label_key] != label_value)):
+            continue
+        if image and not fnmatch.fnmatchcase(info.image, image):
+            continue
+        targets[info.id] = info
+    return list(targets.values()), unresolved
+
+
+def _docker_call(client, action: str, cid: str, grace: int) -> None:
+    api = client.api
+    if action == "stop":
+        api.stop(cid, timeout=grace)
+    elif action == "restart":
+        api.restart(cid, timeout=grace)
+    elif action == "start":
+        api.start(cid)
+    elif action == "pause":
+        api.pause(cid)
+    elif action == "unpause":
+        api.unpause(cid)
+    elif action == "kill":
+        api.kill(cid)
+    else:
+        raise ValueError(f"unknown action {action}")
+
+
+def _reached(client, action: str, cid: str) -> bool:
+    """Whether the container is already in the state `action` asks for (checked after a timeout)."""
+    try:
+        state = client.api.inspect_container(cid).get("State") or {}
+    except Exception:
+        return False
+    if action in ("stop", "kill"):
+        return not state.get("Running")
+    if action == "pause":
+        return bool(state.get("Paused"))
+    if action in ("start", "unpause"):
+        return bool(state.get("Running")) and not state.get("Paused")
+    return False   # a restart can't be told apart from the state before it
+
+
+def _run_one(client, action: str, info: ContainerInfo, timeout: float, grace: int) -> Dict:
+    started = time.monotonic()
+    result = {"id": info.short_id, "full_id": info.id, "name": info.name, "action": action}
+    try:
+        _docker_call(client, action, info.id, grace)
+        result["status"] = "ok"
+    except requests.exceptions.Timeout:
+        # dockerd may still finish the action; report what it actually did if we can tell
+        if _reached(client, action, info.id):
+            result["status"] = "ok"
+        else:
+            log.warning("%s of container %s got no response within %ss", action, info.short_id, timeout)
+            result.update(status="timeout",
+                          error=f"No response from Docker within {timeout}s; the action may still complete")
+    except Exception as e:
+        result.update(status="error", error=getattr(e, "explanation", None) or str(e))
+    result["duration_ms"] = round((time.monotonic() - started) * 1000.0, 1)
+    return result
+
+
+def _client(http_timeout: float, pool_size: int):
+    return docker.from_env(timeout=http_timeout, max_pool_size=pool_size)
+
+
+def run_actions(action: str, targets: List[ContainerInfo], settings: Dict,
+                concurrency: Optional[int] = None, timeout: Optional[float] = None,
+                on_result: Optional[Callable[[Dict], None]] = None,
+                client_factory: Callable = _client) -> Iterator[Dict]:
+    """
+    Apply `action` to every target; yields one result per container as it completes.
+    Each call runs on its pool thread with the timeout enforced by the Docker client
+    (for stop / restart the HTTP timeout leaves room for the grace period), so at most
+    `workers` calls are ever open against dockerd.
+    `on_result` (e.g. the audit writer) is called from the worker for every result,
+    so it runs even if the caller stops consuming (a streaming client disconnects).
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"action must be one of {', '.join(ACTIONS)}")
+    workers = max(1, min(int(concurrency or settings["max_concurrency"]), settings["max_concurrency"],
+                         len(targets) or 1))
+    timeout = max(1.0, float(timeout or settings["timeout_seconds"]))
+    grace = int(min(settings["stop_grace_seconds"], timeout))
+    # docker-py adds the stop grace to the HTTP timeout of stop / restart itself
+    http_timeout = max(1.0, timeout - grace) if action in ("stop", "restart") else timeout
+    client = client_factory(http_timeout, workers)
+
+    def job(info):
+        result = _run_one(client, action, info, timeout, grace)
+        if on_result is not None:
+            try:
+                on_result(result)
+            except Exception as e:
+                log.warning("Recording %s of %s failed: %s", action, info.short_id, e)
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="container-actions") as pool:
+            futures = [pool.submit(job, info) for info in targets]
+            for fut in as_completed(futures):
+                yield fut.result()
+    finally:
+        client.close()
+
+
+def new_batch_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def summarize(action: str, batch_id: str, results: List[Dict], started: float) -> Dict:
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    return {
+        "batch_id": batch_id,
+        "action": action,
+        "requested": len(results),
+        "counts": counts,
+        "duration_ms": round((time.monotonic() - started) * 1000.0, 1),
+    }
@@ -0,0 +1,261 @@
+"""
+In-memory container inventory.
+
+`client.containers.list(all=True)` costs a full Docker API round trip plus one
+image lookup per container, and the container endpoints used to make it on
+every request. The inventory is seeded once, then kept current from the Docker
+event stream: each container event re-inspects that one container (destroy
+drops it). A periodic reconciliation lists containers (one call, no image
+lookups) and re-inspects only those whose state differs, so missed events are
+corrected within `reconcile_seconds`.
+
+Lookups by ID prefix use a sorted list of IDs (binary search to the first
+match, so O(log n) plus the matches) and names use a dict; resolve() follows
+Docker's order: full ID, then name, then unique ID prefix.
+"""
+import time
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import docker
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "reconcile_seconds": 60,
+}
+
+# Container events that change what the inventory holds
+REFRESH_ACTIONS = ("create", "start", "restart", "die", "stop", "kill", "pause", "unpause", "rename", "update")
+
+
+class AmbiguousContainer(LookupError):
+    """An ID prefix matched more than one container."""
+
+    def __init__(self, key: str, matches: List["ContainerInfo"]):
+        super().__init__(f"Container ID prefix {key} matches more than one container")
+        self.key = key
+        self.matches = matches
+
+
+class ContainerInfo(NamedTuple):
+    id: str
+    name: str
+    image: str            # reference the container was created from ("unknown" if none)
+    image_id: str
+    status: str           # created | running | paused | restarting | exited | dead
+    running: bool
+    created: str          # ISO-8601
+    started_at: str       # ISO-8601, "" if never started
+    labels: Dict[str, str]
+
+    @property
+    def short_id(self) -> str:
+        return self.id[:12]
+
+
+def info_from_inspect(meta: Dict) -> ContainerInfo:
+    state = meta.get("State") or {}
+    config = meta.get("Config") or {}
+    started = state.get("StartedAt") or ""
+    return ContainerInfo(
+        id=meta["Id"],
+        name=(meta.get("Name") or "").lstrip("/"),
+        image=config.get("Image") or "unknown",
+        image_id=meta.get("Image") or "",
+        status=state.get("Status") or "unknown",
+        running=bool(state.get("Running")),
+        created=meta.get("Created") or "",
+        started_at="" if started.startswith("0001-") else started,
+        labels=config.get("Labels") or {},
+    )
+
+
+class ContainerInventory:
+    def __init__(self, client_factory: Callable, reconcile_seconds: float = 60,
+                 on_reconcile: Optional[Callable[[List[str]], None]] = None):
+        self.client_factory = client_factory
+        self.reconcile_seconds = max(5.0, float(reconcile_seconds))
+        self.on_reconcile = on_reconcile
+        self._lock = threading.Lock()
+        self._seed_lock = threading.Lock()
+        self._containers: Dict[str, ContainerInfo] = {}
+        self._ids: List[str] = []           # sorted, for prefix lookups
+        self._names: Dict[str, str] = {}    # name -> id
+        self._seeded = False
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {"events": 0, "inspects": 0, "reconciles": 0, "corrections": 0}
+        self._last_reconcile: Optional[float] = None
+
+    def start(self) -> None:
+        """Seed the inventory and start periodic reconciliation."""
+        self._ensure_seeded()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="container-inventory", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.reconcile_seconds)
+            try:
+                self.reconcile()
+            except Exception as e:
+                log.warning("Container inventory reconciliation failed: %s", e)
+
+    def _ensure_seeded(self) -> None:
+        if self._seeded:
+            return
+        with self._seed_lock:
+            if not self._seeded:
+                self.reconcile()
+                self._seeded = True
+
+    def reconcile(self) -> int:
+        """Bring the inventory in line with dockerd; returns how many entries had to change."""
+        summaries = self.client_factory().api.containers(all=True)
+        with self._lock:
+            known = dict(self._containers)
+        live = set()
+        changed = 0
+        for s in summaries:
+            cid = s["Id"]
+            live.add(cid)
+            info = known.get(cid)
+            if info is None or info.status != s.get("State") or info.image_id != s.get("ImageID", info.image_id):
+                self.refresh(cid)
+                changed += 1
+        with self._lock:
+            gone = [cid for cid in self._containers if cid not in live]
+            for cid in gone:
+                self._drop(cid)
+            changed += len(gone)
+            self._counters["reconciles"] += 1
+            if self._seeded:
+                self._counters["corrections"] += changed
+            self._last_reconcile = time.time()
+            running = [info.id for info in self._containers.values() if info.running]
+        if changed and self._seeded:
+            log.info("Container inventory reconciled %d missed change(s)", changed)
+        if self.on_reconcile is not None:
+            self.on_reconcile(running)
+        return changed
+
+    def refresh(self, cid: str) -> Optional[ContainerInfo]:
+        """Re-inspect one container; drops it if it no longer exists."""
+        try:
+            meta = self.client_factory().api.inspect_container(cid)
+        except docker.errors.NotFound:
+            self.remove(cid)
+            return None
+        info = info_from_inspect(meta)
+        with self._lock:
+            self._put(info)
+            self._counters["inspects"] += 1
+        return info
+
+    def remove(self, cid: str) -> None:
+        with self._lock:
+            self._drop(cid)
+
+    # Index upkeep; callers hold self._lock
+
+    def _put(self, info: ContainerInfo) -> None:
+        old = self._containers.get(info.id)
+        if old is None:
+            bisect.insort(self._ids, info.id)
+        elif old.name != info.name and self._names.get(old.name) == info.id:
+            del self._names[old.name]
+        self._containers[info.id] = info
+        self._names[info.name] = info.id
+
+    def _drop(self, cid: str) -> None:
+        info = self._containers.pop(cid, None)
+        if info is None:
+            return
+        i = bisect.bisect_left(self._ids, cid)
+        if i < len(self._ids) and self._ids[i] == cid:
+            del self._ids[i]
+        if self._names.get(info.name) == cid:
+            del self._names[info.name]
+
+    def apply_event(self, event: Dict) -> None:
+        """Update from one `container` event of client.api.events()."""
+        cid = event.get("id") or ""
+        action = (event.get("Action") or "").split(":")[0]   # e.g. "exec_start: sh" -> "exec_start"
+        if not cid or not self._seeded:
+            return
+        if action == "destroy":
+            self.remove(cid)
+        elif action in REFRESH_ACTIONS:
+            try:
+                self.refresh(cid)
+            except Exception as e:
+                # Left for the next reconciliation; never hold up the event loop
+                log.warning("Container inventory could not refresh %s: %s", cid[:12], e)
+                return
+        else:
+            return
+        with self._lock:
+            self._counters["events"] += 1
+
+    def containers(self, include_all: bool = True) -> List[ContainerInfo]:
+        """Known containers (only running ones unless include_all), newest first."""
+        self._ensure_seeded()
+        with self._lock:
+            items = [c for c in self._containers.values() if include_all or c.running]
+        return sorted(items, key=lambda c: c.created, reverse=True)
+
+    def get(self, cid: str) -> Optional[ContainerInfo]:
+        self._ensure_seeded()
+        with self._lock:
+            return self._containers.get(cid)
+
+    def find(self, id_prefix: str) -> List[ContainerInfo]:
+        """Containers whose id starts with `id_prefix`."""
+        self._ensure_seeded()
+        with self._lock:
+            return self._prefixed(id_prefix)
+
+    def _prefixed(self, id_prefix: str, limit: Optional[int] = None) -> List[ContainerInfo]:
+        out = []
+        i = bisect.bisect_left(self._ids, id_prefix)
+        while i < len(self._ids) and self._ids[i].startswith(id_prefix):
+            out.append(self._containers[self._ids[i]])
+            if limit is not None and len(out) >= limit:
+                break
+            i += 1
+        return out
+
+    def resolve(self, key: str) -> Optional[ContainerInfo]:
+        """
+        The container a user-supplied ID, name or ID prefix refers to; None if none does.
+        Raises AmbiguousContainer if a prefix matches several containers.
+        """
+        key = (key or "").strip().lstrip("/")
+        if not key:
+            return None
+        self._ensure_seeded()
+        with self._lock:
+            info = self._containers.get(key)
+            if info is None and key in self._names:
+                info = self._containers.get(self._names[key])
+            if info is not None:
+                return info
+            # A handful of matches is enough to report an ambiguous prefix
+            matches = self._prefixed(key, limit=10)
+        if len(matches) > 1:
+            raise AmbiguousContainer(key, matches)
+        return matches[0] if matches else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "containers": len(self._containers),
+                "running": sum(1 for c in self._containers.values() if c.running),
+                "seeded": self._seeded,
+                "reconcile_seconds": self.reconcile_seconds,
+                "last_reconcile": self._last_reconcile,
+                **self._counters,
+            }
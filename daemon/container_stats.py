@@ -0,0 +1,128 @@
+"""
+Concurrent container stats collection.
+
+A one-shot `docker stats` call blocks for about a second while Docker takes
+two CPU samples, so fetching it one container at a time made the container
+list and dashboard scale linearly with the number of running containers.
+StatsCollector fans the calls out over a bounded thread pool and waits at
+most `deadline_seconds` for the whole batch. Containers that miss the
+deadline come back with their last known values marked stale; their call
+keeps running in the pool and refreshes the values for the next request
+(a container never has more than one call in flight).
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Deque, Dict, Iterable
+
+from latency import LATENCY_SAMPLES, latency_summary
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "workers": 16,            # concurrent stats calls to dockerd
+    "deadline_seconds": 2.5,  # longest a request waits for stats
+}
+
+# Values reported for a container that has no sample yet
+EMPTY_SAMPLE = {"cpu_percent": 0.0, "memory_bytes": 0, "memory_limit_bytes": None,
+                "rx_bytes": 0, "tx_bytes": 0, "sampled_at": None}
+
+
+def parse_stats(stats: Dict) -> Dict:
+    """CPU %, memory and network totals of one Docker stats sample (memory_limit_bytes None if unknown)."""
+    cpu_percent = 0.0
+    cpu = stats.get("cpu_stats") or {}
+    precpu = stats.get("precpu_stats") or {}
+    if "system_cpu_usage" in cpu:
+        cpu_delta = (cpu.get("cpu_usage") or {}).get("total_usage", 0) - \
+            (precpu.get("cpu_usage") or {}).get("total_usage", 0)
+        system_delta = cpu["system_cpu_usage"] - precpu.get("system_cpu_usage", 0)
+        cpu_percent = (cpu_delta / system_delta) * 100.0 if system_delta > 0 else 0.0
+    memory = stats.get("memory_stats") or {}
+    networks = (stats.get("networks") or {}).values()
+    return {
+        "cpu_percent": cpu_percent,
+        "memory_bytes": memory.get("usage", 0),
+        "memory_limit_bytes": memory.get("limit"),
+        "rx_bytes": sum(n.get("rx_bytes", 0) for n in networks),
+        "tx_bytes": sum(n.get("tx_bytes", 0) for n in networks),
+    }
+
+
+class StatsCollector:
+    def __init__(self, client_factory, workers: int = 16, deadline_seconds: float = 2.5):
+        self.client_factory = client_factory
+        self.workers = max(1, int(workers))
+        self.deadline = max(0.1, float(deadline_seconds))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="container-stats")
+        self._lock = threading.Lock()
+        self._inflight = {}                 # container id -> Future of its stats call
+        self._last: Dict[str, Dict] = {}    # container id -> last parsed sample (+ "sampled_at")
+        self._counters = {"requests": 0, "calls": 0, "fresh": 0, "stale": 0, "errors": 0}
+        self._call_ms: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def _fetch(self, cid: str) -> Dict:
+        started = time.monotonic()
+        try:
+            sample = parse_stats(self.client_factory().api.stats(cid, stream=False))
+        except Exception as e:
+            log.debug("Could not get stats for %s: %s", cid[:12], e)
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._call_ms.append((time.monotonic() - started) * 1000.0)
+                self._inflight.pop(cid, None)
+        sample["sampled_at"] = time.time()
+        with self._lock:
+            self._last[cid] = sample
+        return sample
+
+    def collect(self, cids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Stats by container id of every running container (callers pass all of them).
+        Entries have "stale": True when their call missed the deadline; values are then
+        the last known ones, or zeros. Containers whose call failed are omitted.
+        """
+        futures = {}
+        with self._lock:
+            self._counters["requests"] += 1
+            for cid in cids:
+                fut = self._inflight.get(cid)
+                if fut is None:
+                    fut = self._pool.submit(self._fetch, cid)
+                    self._inflight[cid] = fut
+                    self._counters["calls"] += 1
+                futures[cid] = fut
+        if futures:
+            wait(futures.values(), timeout=self.deadline)
+
+        out = {}
+        with self._lock:
+            # Callers pass every running container, so anything else has stopped or gone
+            for cid in [c for c in self._last if c not in futures]:
+                del self._last[cid]
+            for cid, fut in futures.items():
+                if fut.done():
+                    if fut.exception() is None:
+                        out[cid] = dict(fut.result(), stale=False)
+                        self._counters["fresh"] += 1
+                    continue
+                self._counters["stale"] += 1
+                last = self._last.get(cid)
+                out[cid] = dict(last or EMPTY_SAMPLE, stale=True)
+        return out
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "deadline_seconds": self.deadline,
+                "in_flight": len(self._inflight),
+                **self._counters,
+                "call_ms": latency_summary(self._call_ms),
+            }
@@ -1,10 +1,11 @@
 import threading, time
+import functools
 import docker
 import json
 import subprocess
 import logging
 from datetime import datetime, timezone
-from utils import trivy_scan_image
+from utils import trivy_scan_image, trivy_image_command
 from typing import Optional
 
 from utils import retrieve_all_risks, persist_alert, generate_unique_id
@@ -14,6 +15,8 @@ YELLOW = "\033[93m"
 BLUE = "\033[94m"
 RESET = "\033[0m"
 
+_SEVERITY_ORDER = {"low": 1, "medium": 2, "high": 3, "critical": 4}
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
@@ -102,7 +105,7 @@ def run_trivy_scan(image_name: str):
 
     try:
         print(f"{BLUE}[INFO]{RESET} Running Trivy scan for image: {image_name}")
-        cmd = ["trivy", "image", "--quiet", "--format", "json", image_name]
+        cmd = trivy_image_command(image_name)
         out = subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=90)
         data = json.loads(out)
 
@@ -138,9 +141,233 @@ def run_trivy_scan(image_name: str):
 
 from utils import (
     retrieve_all_risks, persist_alert, load_config,
-    trivy_scan_image, approvals_get, approvals_set, policy_should_block
+    trivy_scan_image, approvals_get, approvals_set, evaluate_admission, get_policy,
+    scan_image_async, prescan_image, get_stats_sampler, get_container_inventory,
 )
 
+
+def _scan_result(fut):
+    try:
+        return fut.result()
+    except Exception as e:
+        logging.warning(f"[Trivy] scan failed: {e}")
+        return None
+
+
+def _record_container_risks(cid, metadata, image_ref, image_id, action):
+    """Persist the config-risk mapping for a container; the Trivy summary is added by an enrichment scan."""
+    risks_mapping = retrieve_all_risks(cid, metadata, image_ref, action)
+
+    print(f"Result from the inspect on container {cid} \n {json.dumps(risks_mapping['metadata'], indent=2)} \n")
+
+    if risks_mapping["risks"]:
+        print(f"[!] Risks found for container {cid}:")
+        for r in risks_mapping["risks"]:
+            print(f"{RED} - {r['rule']} ({r['severity']}){RESET}: {r['description']}")
+
+    if not image_ref:
+        persist_alert(risks_mapping, "/app/alerts/alerts.jsonl")
+        return risks_mapping
+
+    def _persist(fut):
+        try:
+            risks_mapping["trivy"] = _scan_result(fut) or {"count": 0}
+            persist_alert(risks_mapping, "/app/alerts/alerts.jsonl")
+        except Exception as e:
+            logging.warning(f"[Daemon] Failed to persist risk mapping for {cid}: {e}")
+
+    scan_image_async(image_ref, image_id=image_id, lane="enrichment").add_done_callback(_persist)
+    return risks_mapping
+
+
+GATE_DEFAULTS = {
+    "scan_budget_seconds": 0,            # how long admission waits for a scan (0 = until it finishes)
+    "on_budget_exceeded": "pause",       # pause | fail_open | fail_closed
+    "on_scan_error": "fail_open",        # fail_open | fail_closed when the scan gives no result
+}
+BUDGET_MODES = ("pause", "fail_open", "fail_closed")
+
+# Containers whose deferred scan is still running; they are paused as soon as they start
+_PAUSE_PENDING = set()
+_PAUSE_LOCK = threading.Lock()
+
+
+def gate_settings(cfg):
+    """`gate` from config.yml merged over GATE_DEFAULTS. Raises ValueError for invalid values."""
+    gate = dict(GATE_DEFAULTS)
+    gate.update({k: v for k, v in ((cfg or {}).get("gate") or {}).items() if v is not None})
+    try:
+        gate["scan_budget_seconds"] = float(gate["scan_budget_seconds"])
+    except (TypeError, ValueError):
+        raise ValueError("gate.scan_budget_seconds must be a number")
+    if gate["scan_budget_seconds"] < 0:
+        raise ValueError("gate.scan_budget_seconds must not be negative")
+    if gate["on_budget_exceeded"] not in BUDGET_MODES:
+        raise ValueError(f"gate.on_budget_exceeded must be one of {', '.join(BUDGET_MODES)}")
+    if gate["on_scan_error"] not in ("fail_open", "fail_closed"):
+        raise ValueError("gate.on_scan_error must be fail_open or fail_closed")
+    return gate
+
+
+def _gate_violation(rule, description):
+    return {"rule": rule, "title": description, "type": "scan", "severity": "high", "action": "block",
+            "description": description}
+
+
+def _apply_gate(fut, client, cfg, cid, metadata, image_ref, image_id, action, enforce=True):
+    """
+    Runs when a gate-lane scan finishes (fut is None when no rule needs a scan):
+    evaluate the admission policy, then block (and remove) the container or record its risks.
+    With enforce=False (scan finished after a fail-open admission) a blocking verdict
+    is only reported. Returns the decision, or None if gate handling failed.
+    """
+    trivy_summary = _scan_result(fut) if fut is not None else None
+    try:
+        decision = evaluate_admission(metadata, image_ref, image_id=image_id, trivy_summary=trivy_summary)
+        if fut is not None and trivy_summary is None and gate_settings(cfg)["on_scan_error"] == "fail_closed":
+            decision["violations"].append(_gate_violation("scan-unavailable", "No scan result for the image."))
+            decision["blocked"] = True
+        if decision["blocked"]:
+            _block_container(client, cfg, cid, image_ref, image_id, decision, trivy_summary, enforce=enforce)
+            return decision
+        _record_container_risks(cid, metadata, image_ref, image_id, action)
+        return decision
+    except Exception as e:
+        logging.warning(f"[Daemon] Gate handling failed for {cid}: {e}")
+        return None
+
+
+def _block_container(client, cfg, cid, image_ref, image_id, decision, trivy_summary=None, enforce=True):
+    blocking = [v for v in decision["violations"] if v["action"] == "block"]
+    logging.info(f"{RED}[Policy] {'Blocking' if enforce else 'Would have blocked'} container {cid}: "
+                 f"{', '.join(dict.fromkeys(v['rule'] for v in blocking))} (decided in {decision.get('total_us', 0):.0f}us)")
+
+    if enforce and cfg.get("gate", {}).get("auto_remove_blocked_container", True):
+        try:
+            client.api.remove_container(cid, force=True)
+            logging.info(f"{YELLOW}[Policy] Container {cid} removed successfully.")
+        except Exception as e:
+            logging.warning(f"{RED}[Policy] Failed to remove container {cid}: {e}")
+
+    by_trivy = all(v["type"] == "vulnerabilities" for v in blocking)
+    alert = {
+        "source": "daemon",
+        "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "rule": "image_blocked_by_trivy" if by_trivy else "container_blocked_by_policy",
+        "summary": f"{'Blocked container creation' if enforce else 'Admitted before scan finished'}: "
+                   f"{image_ref} (digest {image_id}): {'; '.join(v['description'] for v in blocking)}",
+        "severity": max((v["severity"] for v in blocking), key=lambda s: _SEVERITY_ORDER.get(s, 0),
+                        default="high"),
+        "container": {"id": cid, "image": image_ref},
+        "trivy": trivy_summary,
+        "policy": decision,
+        "status": "blocked" if enforce else "open",
+    }
+    persist_alert(alert, "/app/alerts/alerts.jsonl")
+
+
+def _pause_container(client, cid):
+    """Pause now if running, otherwise as soon as the container starts."""
+    with _PAUSE_LOCK:
+        _PAUSE_PENDING.add(cid)
+    try:
+        if (client.api.inspect_container(cid).get("State") or {}).get("Running"):
+            client.api.pause(cid)
+            logging.info(f"{YELLOW}[Gate] Paused container {cid} until its scan finishes")
+    except Exception as e:
+        logging.warning(f"[Gate] Could not pause container {cid}: {e}")
+
+
+def pause_if_pending(client, cid):
+    """Called on `start`: a container waiting on a deferred scan must not run unpaused."""
+    with _PAUSE_LOCK:
+        if cid not in _PAUSE_PENDING:
+            return
+    try:
+        client.api.pause(cid)
+        logging.info(f"{YELLOW}[Gate] Paused container {cid} on start until its scan finishes")
+    except Exception as e:
+        logging.warning(f"[Gate] Could not pause container {cid}: {e}")
+
+
+def _release_container(client, cid, resume):
+    with _PAUSE_LOCK:
+        _PAUSE_PENDING.discard(cid)
+    if not resume:
+        return
+    try:
+        if (client.api.inspect_container(cid).get("State") or {}).get("Paused"):
+            client.api.unpause(cid)
+            logging.info(f"{GREEN}[Gate] Resumed container {cid}: scan passed")
+    except Exception as e:
+        logging.warning(f"[Gate] Could not resume container {cid}: {e}")
+
+
+class GateTicket:
+    """
+    One enforce-mode admission racing its gate scan against the scan budget.
+    Whichever finishes first decides: the scan applies the policy as usual; the
+    budget applies gate.on_budget_exceeded (pause the container until the scan
+    finishes, admit it, or block it). A scan that finishes after the budget then
+    resumes or removes a paused container, or only reports on an admitted one.
+    """
+
+    def __init__(self, client, cfg, cid, metadata, image_ref, image_id, action):
+        self.client = client
+        self.cfg = cfg
+        self.cid = cid
+        self.metadata = metadata
+        self.image_ref = image_ref
+        self.image_id = image_id
+        self.action = action
+        self.gate = gate_settings(cfg)
+        self._lock = threading.Lock()
+        self._state = "waiting"   # waiting -> decided | deferred -> decided
+        self._timer = None
+
+    def start(self, fut):
+        budget = float(self.gate["scan_budget_seconds"] or 0)
+        if budget > 0 and not fut.done():
+            self._timer = threading.Timer(budget, self._on_budget)
+            self._timer.daemon = True
+            self._timer.start()
+        fut.add_done_callback(self._on_scan)
+
+    def _on_budget(self):
+        with self._lock:
+            if self._state != "waiting":
+                return
+            self._state = "deferred"
+        mode = self.gate["on_budget_exceeded"]
+        budget = self.gate["scan_budget_seconds"]
+        add_event("Admission Deferred", f"Scan of {self.image_ref} exceeded its {budget}s budget ({mode})",
+                  container=self.cid)
+        if mode == "pause":
+            _pause_container(self.client, self.cid)
+        elif mode == "fail_closed":
+            decision = {"blocked": True, "violations": [
+                _gate_violation("scan-budget", f"Scan did not finish within {budget}s.")]}
+            _block_container(self.client, self.cfg, self.cid, self.image_ref, self.image_id, decision)
+        else:
+            logging.info(f"{YELLOW}[Gate] Admitting {self.cid} before its scan finished (fail_open)")
+
+    def _on_scan(self, fut):
+        if self._timer is not None:
+            self._timer.cancel()
+        with self._lock:
+            state, self._state = self._state, "decided"
+        if state == "waiting":
+            _apply_gate(fut, self.client, self.cfg, self.cid, self.metadata, self.image_ref, self.image_id, self.action)
+            return
+        mode = self.gate["on_budget_exceeded"]
+        if mode == "fail_closed":
+            return   # already blocked when the budget ran out
+        decision = _apply_gate(fut, self.client, self.cfg, self.cid, self.metadata, self.image_ref, self.image_id,
+                               self.action, enforce=(mode == "pause"))
+        if mode == "pause":
+            _release_container(self.client, self.cid, resume=decision is not None and not decision["blocked"])
+
+
 def docker_event_listener():
     try:
         client = docker.from_env()
@@ -157,13 +384,25 @@ def docker_event_listener():
     for event in client.api.events(decode=True):
         try:
             if event.get("Type") != "container":
-                if event.get("Type") == "image" and event.get("Action") == "pull":
-                    repo = (event.get("Actor", {}) or {}).get("Attributes", {}).get("name", "")
-                    if repo:
-                        trivy_scan_image(repo, image_id=None)
+                if event.get("Type") == "image" and event.get("Action") in ("pull", "tag"):
+                    actor = event.get("Actor", {}) or {}
+                    repo = (actor.get("Attributes", {}) or {}).get("name", "")
+                    if event.get("Action") == "pull":
+                        # Pre-scan so the admission gate on `create` is a cache lookup
+                        ref = actor.get("ID") or repo
+                        if ref:
+                            prescan_image(ref)
+                    elif repo:
+                        # New tag for an image id: reuse that digest's result (or scan it once)
+                        prescan_image(repo, digest=actor.get("ID"))
                 continue
 
             action = event.get("Action") or ""
+            get_container_inventory().apply_event(event)
+            if action == "start":
+                get_stats_sampler().track(event.get("id") or "")
+            elif action in ("die", "destroy"):
+                get_stats_sampler().untrack(event.get("id") or "")
             if action not in ("create", "start", "restart"):
                 continue
 
@@ -186,58 +425,33 @@ def docker_event_listener():
             if action == "create":
                 mode = ((cfg.get("gate") or {}).get("mode") or "monitor").lower()
                 trivy_enabled = cfg.get("trivy", {}).get("enabled", True)
-                container_blocked = False
+                gated = False
 
-                if trivy_enabled and mode == "enforce":
+                if mode == "enforce":
                     key = image_id or image_ref
                     appr = approvals_get(key)
                     if not (appr and appr.get("approved") is True):
-                        trivy_summary = trivy_scan_image(image_ref or "", image_id=image_id)
-
-                        if policy_should_block(trivy_summary or {}, cfg):
-                            logging.info(f"{RED}[Trivy] Blocking container {cid} due to high/critical vulnerabilities.")
-
-                            if cfg.get("gate", {}).get("auto_remove_blocked_container", True):
-                                try:
-                                    client.api.remove_container(cid, force=True)
-                                    logging.info(f"{YELLOW}[Trivy] Container {cid} removed successfully.")
-                                except Exception as e:
-                                    logging.warning(f"{RED}[Trivy] Failed to remove container {cid}: {e}")
-
-                            alert = {
-                                "source": "daemon",
-                                "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
-                                "rule": "image_blocked_by_trivy",
-                                "summary": f"Blocked container creation: {image_ref} (digest {image_id})",
-                                "severity": "high",
-                                "container": {"id": cid, "image": image_ref},
-                                "trivy": trivy_summary,
-                                "status": "blocked",
-                            }
-                            persist_alert(alert, "/app/alerts/alerts.jsonl")
-                            container_blocked = True
-
-                # Collect risk summary only if container was allowed
-                if not container_blocked:
+                        gated = True
+                        gate = functools.partial(_apply_gate, client=client, cfg=cfg, cid=cid, metadata=metadata,
+                                                 image_ref=image_ref, image_id=image_id, action=action)
+                        if trivy_enabled and get_policy().needs_scan:
+                            # Gate scans jump the scan queue; the verdict is applied when the scan
+                            # finishes (or gate.scan_budget_seconds runs out) so the event loop
+                            # can move on to the next event
+                            GateTicket(client, cfg, cid, metadata, image_ref, image_id, action).start(
+                                scan_image_async(image_ref or "", image_id=image_id, lane="gate"))
+                        else:
+                            gate(None)
+
+                # Collect risk summary right away if the container isn't waiting on the gate
+                if not gated:
                     try:
-                        risks_mapping = retrieve_all_risks(cid, metadata, image_ref, action)
-
-                        print(f"Result from the inspect on container {cid} \n {json.dumps(risks_mapping['metadata'], indent=2)} \n")
-                       
-                        if risks_mapping["risks"]:
-                            print(f"[!] Risks found for container {cid}:")
-                            for r in risks_mapping["risks"]:
-                                print(f"{RED} - {r['rule']} ({r['severity']}){RESET}: {r['description']}")
-                                
-                        if image_ref:
-                            trivy_summary = trivy_scan_image(image_ref, image_id=image_id)
-                            risks_mapping["trivy"] = trivy_summary or {"count": 0}
-
-                        persist_alert(risks_mapping, "/app/alerts/alerts.jsonl")
+                        risks_mapping = _record_container_risks(cid, metadata, image_ref, image_id, action)
                     except Exception as e:
                         logging.warning(f"[Daemon] Failed to persist risk mapping for {cid}: {e}")
 
             if action == "start":
+                pause_if_pending(client, cid)
                 add_event("Container Started", f"Container {container_name} started successfully", container=container_name, details=f"Image: {image_ref}")
             elif action == "restart":
                 add_event("Container Restarted", f"Container {container_name} restarted", container=container_name, details=f"Image: {image_ref}")
@@ -0,0 +1,394 @@
+"""
+Bounded work queue for Falco alerts.
+
+`/api/falco-alert` used to start one thread per POST. Events now go into a
+fixed-size queue drained by a fixed pool of worker threads. When the queue
+is full the `overflow` policy decides what happens to a new event:
+
+  drop_oldest  discard the oldest queued event to make room (default)
+  reject       refuse the event; the route answers 429 so Falco retries
+  spill        append the event to a JSONL spill file; workers read it back
+               once the queue has drained
+
+In front of the queue, FalcoCoalescer folds bursts of events for the same
+(container, rule) into a single alert with an occurrence count.
+"""
+import os
+import json
+import time
+import logging
+import uuid
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from latency import LATENCY_SAMPLES, latency_summary
+
+log = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_oldest", "reject", "spill")
+
+DEFAULT_SETTINGS = {
+    "workers": 4,
+    "max_size": 1000,
+    "overflow": "drop_oldest",
+    "spill_file": None,        # default: falco-spill.jsonl next to the alerts file
+}
+
+DEFAULT_COALESCE_SETTINGS = {
+    "enabled": True,
+    "window_seconds": 2.0,     # repeats of a (container, rule) pair within this window join the first alert
+}
+
+# How long a window waits for its first event to be persisted before it is given up
+# (the event may have been dropped by the queue's overflow policy)
+ORPHAN_SECONDS = 300
+
+
+class FalcoQueue:
+    """Fixed pool of workers calling `handler(payload)` for queued events."""
+
+    def __init__(self, handler: Callable[[Dict], None], workers: int = 4, max_size: int = 1000,
+                 overflow: str = "drop_oldest", spill_file: Optional[str] = None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy {overflow!r} (expected one of {', '.join(OVERFLOW_POLICIES)})")
+        if overflow == "spill" and not spill_file:
+            raise ValueError("overflow policy 'spill' needs a spill_file")
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_size = max(1, int(max_size))
+        self.overflow = overflow
+        self.spill_file = spill_file
+        # Called (lock held) with each queued payload discarded by the overflow policy
+        self.on_drop: Optional[Callable[[Dict], None]] = None
+
+        self._items: Deque[Tuple[float, Dict]] = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._busy = 0
+        self._spill_pos = 0        # bytes of the spill file already re-queued
+        self._counters = {"enqueued": 0, "processed": 0, "failed": 0, "dropped": 0, "rejected": 0, "spilled": 0}
+        self._wait_ms: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._process_ms: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    # ---- producer side ----
+
+    def submit(self, payload: Dict) -> bool:
+        """Queue one event. Returns False only when the event was rejected."""
+        with self._cond:
+            if len(self._items) >= self.max_size or (self.overflow == "spill" and self._spill_pending()):
+                if self.overflow == "reject":
+                    self._counters["rejected"] += 1
+                    return False
+                if self.overflow == "spill":
+                    # Once anything is spilled, keep spilling so events stay in arrival order
+                    self._spill(payload)
+                    self._cond.notify()
+                    return True
+                _, dropped = self._items.popleft()
+                self._counters["dropped"] += 1
+                self._dropped(dropped)
+            self._items.append((time.monotonic(), payload))
+            self._counters["enqueued"] += 1
+            self._cond.notify()
+        return True
+
+    def _spill(self, payload: Dict) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.spill_file) or ".", exist_ok=True)
+            with open(self.spill_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload) + "\n")
+            self._counters["spilled"] += 1
+        except Exception as e:
+            # Disk trouble: fall back to dropping the event rather than blocking the request
+            self._counters["dropped"] += 1
+            log.error("[Falco] Could not spill event to %s: %s", self.spill_file, e)
+            self._dropped(payload)
+
+    def _dropped(self, payload: Dict) -> None:
+        if self.on_drop is not None:
+            try:
+                self.on_drop(payload)
+            except Exception:
+                log.exception("[Falco] on_drop callback failed")
+
+    def _spill_pending(self) -> bool:
+        try:
+            return os.path.getsize(self.spill_file) > self._spill_pos
+        except OSError:
+            return False
+
+    def _refill_from_spill(self) -> None:
+        """Move spilled events back into the queue while there is room (called with the lock held)."""
+        if not self.spill_file or not self._spill_pending():
+            return
+        try:
+            with open(self.spill_file, "rb") as f:
+                f.seek(self._spill_pos)
+                while len(self._items) < self.max_size:
+                    line = f.readline()
+                    if not line or not line.endswith(b"\n"):
+                        break
+                    self._spill_pos += len(line)
+                    try:
+                        payload = json.loads(line)
+                    except Exception:
+                        continue
+                    self._items.append((time.monotonic(), payload))
+                    self._counters["enqueued"] += 1
+            if not self._spill_pending():
+                # Fully drained: start the spill file over
+                os.remove(self.spill_file)
+                self._spill_pos = 0
+        except FileNotFoundError:
+            self._spill_pos = 0
+        except Exception as e:
+            log.error("[Falco] Could not read spill file %s: %s", self.spill_file, e)
+
+    # ---- workers ----
+
+    def _next(self) -> Optional[Tuple[float, Dict]]:
+        with self._cond:
+            while not self._items and not self._stopping:
+                self._refill_from_spill()
+                if self._items:
+                    break
+                self._cond.wait(timeout=1.0)
+            if not self._items:
+                return None
+            self._busy += 1
+            return self._items.popleft()
+
+    def _work(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            enqueued_at, payload = item
+            started = time.monotonic()
+            ok = True
+            try:
+                self.handler(payload)
+            except Exception:
+                ok = False
+                log.exception("[Falco] Alert processing failed")
+            finished = time.monotonic()
+            with self._cond:
+                self._busy -= 1
+                self._counters["processed" if ok else "failed"] += 1
+                self._wait_ms.append((started - enqueued_at) * 1000)
+                self._process_ms.append((finished - started) * 1000)
+
+    def start(self) -> "FalcoQueue":
+        with self._cond:
+            if self._threads:
+                return self
+            if self.spill_file and os.path.exists(self.spill_file):
+                log.info("[Falco] Resuming %s spilled bytes from %s", os.path.getsize(self.spill_file), self.spill_file)
+            for n in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"falco-worker-{n}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    # ---- metrics ----
+
+    def stats(self) -> Dict:
+        with self._cond:
+            depth = len(self._items)
+            busy = self._busy
+            counters = dict(self._counters)
+            wait_ms = list(self._wait_ms)
+            process_ms = list(self._process_ms)
+            spill_pending = 0
+            if self.spill_file:
+                try:
+                    spill_pending = max(0, os.path.getsize(self.spill_file) - self._spill_pos)
+                except OSError:
+                    pass
+        return {
+            "depth": depth,
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "busy_workers": busy,
+            "overflow": self.overflow,
+            "spill_pending_bytes": spill_pending,
+            **counters,
+            "queue_wait_ms": latency_summary(wait_ms),
+            "processing_ms": latency_summary(process_ms),
+        }
+
+
+def queue_settings(cfg: Optional[Dict], alerts_file: Optional[str] = None) -> Dict:
+    """`falco.queue` from config.yml merged over DEFAULT_SETTINGS."""
+    settings = dict(DEFAULT_SETTINGS)
+    for key, value in (((cfg or {}).get("falco") or {}).get("queue") or {}).items():
+        if key in settings and value is not None:
+            settings[key] = value
+    if settings["overflow"] not in OVERFLOW_POLICIES:
+        log.warning("Unknown falco.queue.overflow %r; using %s", settings["overflow"], DEFAULT_SETTINGS["overflow"])
+        settings["overflow"] = DEFAULT_SETTINGS["overflow"]
+    if not settings["spill_file"] and alerts_file:
+        settings["spill_file"] = os.path.join(os.path.dirname(alerts_file) or ".", "falco-spill.jsonl")
+    return settings
+
+
+class FalcoCoalescer:
+    """
+    Folds bursts of identical Falco events into one alert.
+
+    The first event for a key is queued straight away under a pre-assigned
+    alert id, so enrichment and auto-stop are not delayed. Repeats of the key
+    within `window_seconds` only bump the occurrence count and last-seen time.
+    Events whose key is None (e.g. rules with a response action, which must
+    run for every event) are never coalesced. If the queue drops a window's
+    first event, the window is closed so later repeats open a new alert.
+    The worker picks those up through `claim` when it persists the alert, and
+    anything that arrives later in the window is written back with
+    `on_flush(alert_id, fields)` once the window closes.
+    """
+
+    def __init__(self, queue: FalcoQueue, key_fn: Callable[[Dict], Hashable],
+                 on_flush: Callable[[str, Dict], bool], window_seconds: float = 2.0):
+        self.queue = queue
+        self.key_fn = key_fn
+        self.on_flush = on_flush
+        self.window = max(0.0, float(window_seconds))
+        # Re-entrant: queue.submit() may call back into _dropped() while add() holds it
+        self._lock = threading.RLock()
+        self._open: Dict[Hashable, Dict] = {}   # key -> newest window
+        self._windows: Dict[str, Dict] = {}     # alert id -> window, until written back
+        self._counters = {"events": 0, "queued": 0, "coalesced": 0, "rejected": 0, "flushed": 0, "orphaned": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        queue.on_drop = self._dropped
+
+    def _dropped(self, item: Dict) -> None:
+        """The queue discarded an event: close its window, which will never be persisted."""
+        alert_id = (item or {}).get("alert_id")
+        with self._lock:
+            if alert_id in self._windows:
+                self._discard(alert_id)
+                self._counters["orphaned"] += 1
+
+    @staticmethod
+    def _event_time(payload: Dict) -> str:
+        return str(payload.get("time") or datetime.now(timezone.utc).isoformat())
+
+    @staticmethod
+    def _fields(window: Dict) -> Dict:
+        return {
+            "occurrences": window["count"],
+            "first_seen": window["first_seen"],
+            "last_seen": window["last_seen"],
+        }
+
+    def add(self, payload: Dict) -> str:
+        """Returns "queued", "coalesced" or "rejected"."""
+        now = time.monotonic()
+        with self._lock:
+            self._counters["events"] += 1
+            key = self.key_fn(payload) if self.window else None
+            window = self._open.get(key) if key is not None else None
+            if window and now < window["expires"]:
+                window["count"] += 1
+                window["last_seen"] = self._event_time(payload)
+                self._counters["coalesced"] += 1
+                return "coalesced"
+            if key is None:
+                accepted = self.queue.submit({"event": payload})
+            else:
+                alert_id = str(uuid.uuid4())
+                accepted = self.queue.submit({"event": payload, "alert_id": alert_id})
+                if accepted:
+                    ts = self._event_time(payload)
+                    window = {
+                        "key": key, "alert_id": alert_id, "count": 1, "first_seen": ts, "last_seen": ts,
+                        "expires": now + self.window, "persisted": None,
+                    }
+                    self._open[key] = window
+                    self._windows[alert_id] = window
+            self._counters["queued" if accepted else "rejected"] += 1
+            return "queued" if accepted else "rejected"
+
+    def claim(self, alert_id: Optional[str]) -> Optional[Dict]:
+        """Occurrence fields for an alert about to be persisted (None if it was not coalesced)."""
+        with self._lock:
+            window = self._windows.get(alert_id) if alert_id else None
+            if window is None:
+                return None
+            window["persisted"] = window["count"]
+            return self._fields(window)
+
+    def flush(self, force: bool = False) -> None:
+        """Write back counts for closed windows whose alert has been persisted."""
+        now = time.monotonic()
+        updates = []
+        with self._lock:
+            for alert_id, window in list(self._windows.items()):
+                if now < window["expires"] and not force:
+                    continue
+                if window["persisted"] is None:
+                    if now - window["expires"] > ORPHAN_SECONDS:
+                        self._discard(alert_id)
+                    continue
+                if window["count"] > window["persisted"]:
+                    updates.append((alert_id, window["count"], self._fields(window)))
+                else:
+                    self._discard(alert_id)
+        for alert_id, count, fields in updates:
+            try:
+                ok = self.on_flush(alert_id, fields)
+            except Exception:
+                ok = False
+                log.exception("[Falco] Could not update occurrence count of %s", alert_id)
+            if ok:
+                with self._lock:
+                    window = self._windows.get(alert_id)
+                    if window is not None:
+                        window["persisted"] = count
+                        if window["count"] == count:
+                            self._discard(alert_id)
+                    self._counters["flushed"] += 1
+
+    def _discard(self, alert_id: str) -> None:
+        window = self._windows.pop(alert_id, None)
+        if window is not None and self._open.get(window["key"]) is window:
+            del self._open[window["key"]]
+
+    def _run(self) -> None:
+        interval = max(0.2, self.window / 2)
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception("[Falco] Coalescer flush failed")
+
+    def start(self) -> "FalcoCoalescer":
+        if self._thread is None and self.window:
+            self._thread = threading.Thread(target=self._run, name="falco-coalescer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"window_seconds": self.window, "open_windows": len(self._windows), **self._counters}
+
+
+def coalesce_settings(cfg: Optional[Dict]) -> Dict:
+    """`falco.coalesce` from config.yml merged over DEFAULT_COALESCE_SETTINGS."""
+    settings = dict(DEFAULT_COALESCE_SETTINGS)
+    for key, value in (((cfg or {}).get("falco") or {}).get("coalesce") or {}).items():
+        if key in settings and value is not None:
+            settings[key] = value
+    return settings
@@ -0,0 +1,210 @@
+"""
+Per-image vulnerability findings, kept in SQLite.
+
+Scan summaries only carry counts and a 5-finding sample; the full finding list of
+every scan lands here, written row by row while the Trivy report is being parsed.
+Findings are stored once per scanned filesystem ("findings key": the layer-stack
+ChainID, or the image digest when layers are unknown). Image IDs and tags link to
+a findings key, so images with identical layers share one set of rows. Only the
+most recent `max_images` scans are kept.
+"""
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from alerts_store import decode_cursor, encode_cursor
+from sqlite_store import connect
+from trivy_report import SEVERITY_RANK
+
+DEFAULT_SETTINGS = {
+    "db": "/app/alerts/trivy-findings.db",
+    "max_images": 500,
+}
+
+# Rows inserted per transaction while streaming a report in
+INSERT_BATCH = 1000
+
+# Findings of a scan still in progress (or interrupted by a restart)
+STAGING_PREFIX = "staging:"
+
+_FIELDS = ("id", "pkg", "ver", "fixed", "sev", "target", "layer", "title")
+
+
+class FindingsStore:
+    def __init__(self, db_path: str, max_images: int = 500):
+        self.db_path = db_path
+        self.max_images = max(1, int(max_images))
+        self._conn, self._lock = connect(db_path)
+        self._ensure_schema()
+
+    def _ensure_schema(self) -> None:
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS scans (
+                    findings_key TEXT PRIMARY KEY,
+                    image_ref TEXT,
+                    db_version TEXT,
+                    scanned_at REAL,
+                    count INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS images (
+                    image_key TEXT PRIMARY KEY,
+                    findings_key TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS findings (
+                    seq INTEGER PRIMARY KEY,
+                    findings_key TEXT NOT NULL,
+                    rank INTEGER NOT NULL,
+                    id TEXT, pkg TEXT COLLATE NOCASE, ver TEXT, fixed TEXT,
+                    sev TEXT, target TEXT, layer TEXT, title TEXT
+                );
+                CREATE INDEX IF NOT EXISTS findings_by_rank ON findings(findings_key, rank DESC, seq);
+                CREATE INDEX IF NOT EXISTS findings_by_pkg ON findings(findings_key, pkg);
+                CREATE INDEX IF NOT EXISTS images_by_findings ON images(findings_key);
+            """)
+            self._conn.execute("DELETE FROM findings WHERE findings_key LIKE ?", (STAGING_PREFIX + "%",))
+
+    def replace(self, findings_key: str, rows: Iterable[Dict], image_ref: Optional[str] = None,
+                db_version: Optional[str] = None) -> int:
+        """
+        Store the findings of one scan, consuming `rows` as they are produced. Rows are
+        staged under a private key in small transactions (so readers aren't blocked for the
+        length of a scan) and swapped in at the end; if `rows` raises, nothing changes.
+        """
+        staging = f"{STAGING_PREFIX}{uuid.uuid4().hex}"
+        sql = (f"INSERT INTO findings (findings_key, rank, {', '.join(_FIELDS)}) "
+               f"VALUES ({', '.join('?' * (len(_FIELDS) + 2))})")
+        count = 0
+        try:
+            batch = []
+            for row in rows:
+                batch.append((staging, SEVERITY_RANK.get(row.get("sev"), 0)) + tuple(row.get(f) for f in _FIELDS))
+                if len(batch) >= INSERT_BATCH:
+                    self._insert(sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._insert(sql, batch)
+                count += len(batch)
+        except BaseException:
+            with self._lock:
+                self._conn.execute("DELETE FROM findings WHERE findings_key = ?", (staging,))
+            raise
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM findings WHERE findings_key = ?", (findings_key,))
+                self._conn.execute("UPDATE findings SET findings_key = ? WHERE findings_key = ?",
+                                   (findings_key, staging))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO scans (findings_key, image_ref, db_version, scanned_at, count) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (findings_key, image_ref, db_version, time.time(), count),
+                )
+                self._prune()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def _insert(self, sql: str, batch: List[Tuple]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(sql, batch)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _prune(self) -> None:
+        stale = [r[0] for r in self._conn.execute(
+            "SELECT findings_key FROM scans ORDER BY scanned_at DESC LIMIT -1 OFFSET ?", (self.max_images,))]
+        for key in stale:
+            self._conn.execute("DELETE FROM findings WHERE findings_key = ?", (key,))
+            self._conn.execute("DELETE FROM images WHERE findings_key = ?", (key,))
+            self._conn.execute("DELETE FROM scans WHERE findings_key = ?", (key,))
+
+    def link(self, image_key: str, findings_key: str) -> None:
+        """Point an image ID or tag at a stored set of findings."""
+        if not image_key or not findings_key:
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO images (image_key, findings_key) VALUES (?, ?)",
+                               (image_key, findings_key))
+
+    def resolve(self, key: str) -> Optional[str]:
+        """Findings key for an image ID, tag or findings key; None if never scanned."""
+        with self._lock:
+            row = self._conn.execute("SELECT findings_key FROM images WHERE image_key = ?", (key,)).fetchone()
+            if row:
+                return row[0]
+            row = self._conn.execute("SELECT 1 FROM scans WHERE findings_key = ?", (key,)).fetchone()
+        return key if row else None
+
+    def scan_info(self, findings_key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT image_ref, db_version, scanned_at, count FROM scans WHERE findings_key = ?",
+                (findings_key,)).fetchone()
+        if not row:
+            return None
+        return {"findings_key": findings_key, "image_ref": row[0], "db_version": row[1],
+                "scanned_at": row[2], "count": row[3]}
+
+    def page(self, findings_key: str, severities: Optional[List[str]] = None, pkg: Optional[str] = None,
+             cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict], Optional[str], int]:
+        """
+        One page of findings, most severe first. `severities` limits to those levels,
+        `pkg` is a case-insensitive package-name prefix. Returns (items, next cursor, total matches).
+        Raises ValueError for a malformed cursor.
+        """
+        clauses, params = ["findings_key = ?"], [findings_key]
+        if severities:
+            clauses.append(f"sev IN ({', '.join('?' * len(severities))})")
+            params += [s.upper() for s in severities]
+        if pkg:
+            clauses.append("pkg LIKE ? ESCAPE '\\'")
+            params.append(pkg.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        where = " AND ".join(clauses)
+        position = decode_cursor(cursor)
+        keyset, keyset_params = "", []
+        if position is not None:
+            try:
+                rank, seq = int(position["r"]), int(position["s"])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("invalid cursor")
+            keyset = " AND (rank < ? OR (rank = ? AND seq > ?))"
+            keyset_params = [rank, rank, seq]
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM findings WHERE {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT seq, rank, {', '.join(_FIELDS)} FROM findings WHERE {where}{keyset} "
+                f"ORDER BY rank DESC, seq LIMIT ?",
+                params + keyset_params + [limit + 1]).fetchall()
+        items = [dict(zip(_FIELDS, row[2:])) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            seq, rank = rows[limit - 1][0], rows[limit - 1][1]
+            next_cursor = encode_cursor({"r": rank, "s": seq})
+        return items, next_cursor, total
+
+    def iter_findings(self, findings_key: str) -> Iterator[Dict]:
+        """Every finding of a scan, fetched in batches so the lock isn't held while the caller works."""
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT seq, {', '.join(_FIELDS)} FROM findings WHERE findings_key = ? AND seq > ? "
+                    f"ORDER BY seq LIMIT ?", (findings_key, last, INSERT_BATCH)).fetchall()
+            for row in rows:
+                last = row[0]
+                yield dict(zip(_FIELDS, row[1:]))
+            if len(rows) < INSERT_BATCH:
+                return
+
+    def stats(self) -> Dict:
+        with self._lock:
+            scans, findings = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM scans").fetchone()
+        return {"db": self.db_path, "scans": scans, "findings": findings, "max_images": self.max_images}
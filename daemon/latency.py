@@ -0,0 +1,26 @@
+"""
+Latency samples shared by the queue, scheduler, policy and stats metrics.
+
+Timings are kept in a `deque(maxlen=LATENCY_SAMPLES)` and summarised on demand.
+"""
+from typing import Dict
+
+# Latency samples kept for percentile metrics
+LATENCY_SAMPLES = 1000
+
+
+def latency_summary(samples) -> Dict:
+    """avg / p50 / p95 / max of a list of samples (in whatever unit they were taken)."""
+    values = sorted(samples)
+    if not values:
+        return {"avg": None, "p50": None, "p95": None, "max": None}
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+    return {
+        "avg": round(sum(values) / len(values), 2),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "max": round(values[-1], 2),
+    }
@@ -0,0 +1,113 @@
+"""
+Shared mount parsing and sensitive-path matching.
+
+Containers report mounts in two places: HostConfig.Binds ("src:dst[:opts]",
+where src is a host path or a named volume) and the top-level Mounts list
+(Type / Source / Destination / Name / RW). parse_mounts() merges both into
+Mount tuples. MountAnalyzer matches paths against a PathTrie of categorized
+prefixes, so each lookup costs one walk of the path however many prefixes are
+configured, and "/etc" matches "/etc/ssl" but not "/etcd".
+
+The categories come from the `mounts` section of config.yml; the policy's
+mount rules and enrich_with_inspect both use them, so they always agree.
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from path_trie import PathTrie
+
+DEFAULT_SETTINGS = {
+    "docker_socket": ["/var/run/docker.sock", "/run/docker.sock"],
+    # docker.sock is also a sensitive path, as it always was for alert risks
+    "sensitive_host": ["/var/run/docker.sock", "/etc", "/boot", "/dev", "/lib", "/proc", "/sys", "/usr"],
+}
+
+SIDES = ("host", "container", "any")
+
+
+class Mount(NamedTuple):
+    type: str             # bind | volume | tmpfs | ...
+    source: str           # host path (binds, local volumes' data dir) or ""
+    destination: str      # path inside the container
+    name: Optional[str]   # volume name
+    read_only: bool
+
+
+def parse_bind(spec: str) -> Optional[Mount]:
+    """Parse a HostConfig.Binds entry: "/host:/ctr[:ro,...]" or "volume:/ctr[:opts]"."""
+    parts = str(spec or "").split(":")
+    if not parts[0]:
+        return None
+    source = parts[0]
+    destination = parts[1] if len(parts) > 1 else source
+    opts = set(parts[2].split(",")) if len(parts) > 2 else set()
+    if source.startswith("/"):
+        return Mount("bind", source, destination, None, "ro" in opts)
+    return Mount("volume", "", destination, source, "ro" in opts)
+
+
+def parse_mounts(metadata: Dict) -> List[Mount]:
+    """All mounts of an inspected container, Binds and Mounts merged (one entry per destination)."""
+    found: Dict[str, Mount] = {}
+    for m in (metadata or {}).get("Mounts") or []:
+        dest = m.get("Destination") or ""
+        found[dest] = Mount(
+            (m.get("Type") or "bind").lower(),
+            m.get("Source") or "",
+            dest,
+            m.get("Name") or None,
+            not m.get("RW", True),
+        )
+    for spec in ((metadata or {}).get("HostConfig") or {}).get("Binds") or []:
+        mount = parse_bind(spec)
+        if mount is not None:
+            # Mounts already has the resolved form (e.g. a named volume's host directory)
+            found.setdefault(mount.destination, mount)
+    return list(found.values())
+
+
+def mount_settings(cfg: Dict) -> Dict[str, List[str]]:
+    """Category -> path prefixes, from config.yml `mounts` over the defaults."""
+    settings = {k: list(v) for k, v in DEFAULT_SETTINGS.items()}
+    for category, paths in ((cfg or {}).get("mounts") or {}).items():
+        if paths is not None:
+            settings[category] = list(paths)
+    return settings
+
+
+class MountAnalyzer:
+    def __init__(self, categories: Dict[str, Iterable[str]]):
+        self.categories = {name: list(paths or []) for name, paths in categories.items()}
+        self.trie = PathTrie()
+        for name, paths in self.categories.items():
+            for path in paths:
+                self.trie.add(path, name)
+
+    def analyze(self, mounts: Iterable[Mount], side: str = "any") -> List[Dict]:
+        """
+        One hit per (mount, category): the most specific configured prefix of the
+        mount's host path (side="host"), container path ("container") or either ("any").
+        Named volumes have no host path the user chose, so only their destination can match.
+        """
+        if side not in SIDES:
+            raise ValueError(f"mount side must be one of {', '.join(SIDES)}")
+        hits = []
+        for mount in mounts:
+            paths = []
+            if side in ("host", "any") and mount.type == "bind" and mount.source:
+                paths.append(mount.source)
+            if side in ("container", "any") and mount.destination:
+                paths.append(mount.destination)
+            seen = {}
+            for path in paths:
+                for prefix, category in self.trie.match(path):
+                    seen[category] = prefix
+            for category, prefix in seen.items():
+                hits.append({
+                    "category": category,
+                    "path": prefix,
+                    "type": mount.type,
+                    "source": mount.source or mount.name,
+                    "destination": mount.destination,
+                    "read_only": mount.read_only,
+                })
+        return hits
@@ -0,0 +1,46 @@
+import posixpath
+from typing import Any, Dict, List, Tuple
+
+# Node key holding the values stored at a path (path components are never None)
+_VALUES = None
+
+
+def path_parts(path: str) -> List[str]:
+    """Components of an absolute path: "/var//run/" -> ["var", "run"]; "/" -> []."""
+    norm = posixpath.normpath("/" + str(path or "").strip())
+    return [p for p in norm.split("/") if p]
+
+
+class PathTrie:
+    """
+    Path-prefix index keyed by path components, so "/etc" matches "/etc/ssl"
+    but not "/etcd". A lookup walks the path once and returns every stored
+    prefix it passes, however many prefixes are stored.
+    """
+
+    def __init__(self):
+        self._root: Dict = {}
+        self.size = 0
+
+    def add(self, path: str, value: Any) -> None:
+        node = self._root
+        for part in path_parts(path):
+            node = node.setdefault(part, {})
+        node.setdefault(_VALUES, []).append(value)
+        self.size += 1
+
+    def match(self, path: str) -> List[Tuple[str, Any]]:
+        """(stored prefix, value) for every stored path that is `path` or one of its parents, shortest first."""
+        found = []
+        node = self._root
+        prefix = ""
+        for value in node.get(_VALUES, ()):
+            found.append(("/", value))
+        for part in path_parts(path):
+            node = node.get(part)
+            if node is None:
+                break
+            prefix += "/" + part
+            for value in node.get(_VALUES, ()):
+                found.append((prefix, value))
+        return found
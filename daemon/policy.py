@@ -0,0 +1,373 @@
+"""
+Admission policy: declarative rules from the `policy` section of config.yml,
+compiled once into a PolicyEvaluator.
+
+Rule types (every rule also takes name, severity and action: block | warn):
+
+  privileged       container runs with --privileged
+  capabilities     capabilities: [SYS_ADMIN, ...] (or [ALL]) added with --cap-add
+  mounts           paths: [/etc, ...] or category: <key of the `mounts` section>; side: any (default) | host | container
+  user             users: ["", "0", "root"] and/or pattern: regex on Config.User
+  seccomp          seccomp=unconfined (or `no_default: true`: any custom profile)
+  vulnerabilities  severities / ids (globs) / fixed_only / min_count on the Trivy findings
+
+and optionally a `title` (shown as the risk name) and `description`,
+plus `images.allow` / `images.deny` glob lists on the image reference.
+capabilities and mounts rules with `per_match: true` report one violation per
+capability / path, titled "<title> SYS_ADMIN" / "<title> (/etc)" like the
+risks of container alerts always were.
+
+Compilation turns capability lists into frozensets, mount paths into a
+MountAnalyzer (path-component trie), image globs and CVE ID globs into one precompiled regex each.
+evaluate() extracts the container facts once, runs every rule against them
+(one pass over the findings, only if a rule needs per-finding detail) and
+returns the verdict with per-rule timings; stats() aggregates those timings.
+"""
+import re
+import time
+import fnmatch
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from latency import LATENCY_SAMPLES, latency_summary
+from mount_analyzer import MountAnalyzer, mount_settings, parse_mounts
+from trivy_report import SEVERITIES
+
+ACTIONS = ("block", "warn")
+RULE_TYPES = ("privileged", "capabilities", "mounts", "user", "seccomp", "vulnerabilities")
+
+# The checks retrieve_all_risks has always reported, plus the old
+# trivy.block_if_high_or_critical threshold as the only blocking rule
+DEFAULT_RULES = [
+    {"name": "privileged", "type": "privileged", "title": "Privileged mode enabled",
+     "severity": "high", "action": "warn"},
+    {"name": "dangerous-capabilities", "type": "capabilities", "title": "Dangerous capability",
+     "capabilities": ["SYS_ADMIN", "SYS_PTRACE", "NET_ADMIN"], "per_match": True, "severity": "high",
+     "action": "warn"},
+    {"name": "docker-socket", "type": "mounts", "title": "Docker socket mount",
+     "description": "Mounting docker.sock exposes full host control.",
+     "category": "docker_socket", "severity": "critical", "action": "warn"},
+    {"name": "sensitive-host-mounts", "type": "mounts", "title": "Sensitive host path mount",
+     "category": "sensitive_host", "per_match": True, "severity": "medium", "action": "warn"},
+    {"name": "root-user", "type": "user", "title": "Runs as root",
+     "users": ["", "0", "root"], "severity": "medium", "action": "warn"},
+    {"name": "seccomp-unconfined", "type": "seccomp", "title": "Unconfined seccomp profile",
+     "severity": "medium", "action": "warn"},
+    {"name": "high-critical-vulnerabilities", "type": "vulnerabilities", "title": "High/critical vulnerabilities",
+     "severities": ["HIGH", "CRITICAL"], "min_count": 1, "severity": "high", "action": "block"},
+]
+
+
+def _glob_regex(patterns: Iterable[str]) -> Optional["re.Pattern"]:
+    patterns = [str(p) for p in patterns or [] if str(p)]
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+
+def _normalize_cap(cap: str) -> str:
+    cap = str(cap or "").strip().upper()
+    return cap[4:] if cap.startswith("CAP_") else cap
+
+
+def container_facts(metadata: Dict, image_ref: Optional[str] = None) -> Dict:
+    """The parts of `docker inspect` the rules look at, extracted once per evaluation."""
+    hostcfg = (metadata or {}).get("HostConfig") or {}
+    cfg = (metadata or {}).get("Config") or {}
+    return {
+        "image": image_ref or cfg.get("Image") or "",
+        "privileged": bool(hostcfg.get("Privileged", False)),
+        "caps": {_normalize_cap(c) for c in hostcfg.get("CapAdd") or []},
+        "mounts": parse_mounts(metadata),
+        "user": (cfg.get("User") or "").strip(),
+        "security_opt": [str(s) for s in hostcfg.get("SecurityOpt") or []],
+    }
+
+
+class _Rule:
+    def __init__(self, spec: Dict):
+        self.name = str(spec.get("name") or spec.get("type"))
+        self.type = spec.get("type")
+        if self.type not in RULE_TYPES:
+            raise ValueError(f"policy rule {self.name!r}: unknown type {self.type!r} "
+                             f"(expected one of {', '.join(RULE_TYPES)})")
+        self.action = str(spec.get("action") or "warn").lower()
+        if self.action not in ACTIONS:
+            raise ValueError(f"policy rule {self.name!r}: action must be one of {', '.join(ACTIONS)}")
+        self.severity = str(spec.get("severity") or "medium").lower()
+        self.title = spec.get("title") or self.name
+        self.description = spec.get("description")
+        self.per_match = bool(spec.get("per_match", False))
+
+    def violation(self, message: str, title: Optional[str] = None, **detail) -> Dict:
+        return {
+            "rule": self.name,
+            "title": title or self.title,
+            "type": self.type,
+            "severity": self.severity,
+            "action": self.action,
+            "description": self.description or message,
+            **({"detail": detail} if detail else {}),
+        }
+
+
+class _Privileged(_Rule):
+    def check(self, facts: Dict, _vulns) -> Optional[Dict]:
+        if facts["privileged"]:
+            return self.violation("Container runs with --privileged flag.")
+        return None
+
+
+class _Capabilities(_Rule):
+    def __init__(self, spec: Dict):
+        super().__init__(spec)
+        self.caps = frozenset(_normalize_cap(c) for c in spec.get("capabilities") or [])
+
+    def check(self, facts: Dict, _vulns) -> Union[None, Dict, List[Dict]]:
+        caps = facts["caps"]
+        hit = caps if "ALL" in self.caps else (self.caps & caps) | (caps & {"ALL"})
+        if hit and self.per_match:
+            return [self.violation(f"Capability {cap} may allow host/kernel manipulation.",
+                                   title=f"{self.title} {cap}", capabilities=[cap]) for cap in sorted(hit)]
+        if hit:
+            return self.violation(f"Capabilities {', '.join(sorted(hit))} may allow host/kernel manipulation.",
+                                  capabilities=sorted(hit))
+        return None
+
+
+class _Mounts(_Rule):
+    def __init__(self, spec: Dict):
+        super().__init__(spec)
+        self.analyzer = MountAnalyzer({self.name: spec.get("paths") or []})
+        self.side = str(spec.get("side") or "any").lower()
+        self.analyzer.analyze([], self.side)   # validates side
+
+    def check(self, facts: Dict, _vulns) -> Union[None, Dict, List[Dict]]:
+        hits = self.analyzer.analyze(facts["mounts"], self.side)
+        if hits and self.per_match:
+            by_path: Dict[str, List[str]] = {}
+            for h in hits:
+                by_path.setdefault(h["path"], []).append(f"{h['source']}:{h['destination']}")
+            return [self.violation(f"Container mounts sensitive host path {path}.",
+                                   title=f"{self.title} ({path})", mounts=mounts)
+                    for path, mounts in by_path.items()]
+        if hits:
+            paths = ", ".join(dict.fromkeys(h["path"] for h in hits))
+            return self.violation(f"Container mounts sensitive host path {paths}.",
+                                  mounts=[f"{h['source']}:{h['destination']}" for h in hits])
+        return None
+
+
+class _User(_Rule):
+    def __init__(self, spec: Dict):
+        super().__init__(spec)
+        self.users = frozenset(str(u) for u in spec.get("users") or [])
+        self.pattern = re.compile(spec["pattern"]) if spec.get("pattern") else None
+
+    def check(self, facts: Dict, _vulns) -> Optional[Dict]:
+        user = facts["user"]
+        name = user.split(":", 1)[0]
+        if name in self.users or (self.pattern is not None and self.pattern.fullmatch(user)):
+            return self.violation("No non-root user configured in container." if name in ("", "0", "root")
+                                  else f"Container runs as user {user!r}.", user=user)
+        return None
+
+
+class _Seccomp(_Rule):
+    def __init__(self, spec: Dict):
+        super().__init__(spec)
+        self.no_default = bool(spec.get("no_default", False))
+
+    def check(self, facts: Dict, _vulns) -> Optional[Dict]:
+        for opt in facts["security_opt"]:
+            if not opt.startswith("seccomp"):
+                continue
+            if "unconfined" in opt or self.no_default:
+                return self.violation("Container running with unconfined seccomp profile.", security_opt=opt)
+        return None
+
+
+class _Vulnerabilities(_Rule):
+    def __init__(self, spec: Dict):
+        super().__init__(spec)
+        severities = [str(s).upper() for s in spec.get("severities") or []]
+        unknown = [s for s in severities if s not in SEVERITIES]
+        if unknown:
+            raise ValueError(f"policy rule {self.name!r}: unknown severities {', '.join(unknown)}")
+        self.severities = frozenset(severities)
+        self.ids = _glob_regex(spec.get("ids") or [])
+        self.fixed_only = bool(spec.get("fixed_only", False))
+        self.min_count = int(spec.get("min_count", 1))
+        # Severity-only rules can be answered from the summary's counts
+        self.needs_findings = self.ids is not None or self.fixed_only
+
+    def matches(self, row: Dict) -> bool:
+        if self.severities and row.get("sev") not in self.severities:
+            return False
+        if self.fixed_only and not row.get("fixed"):
+            return False
+        return self.ids is None or bool(self.ids.fullmatch(str(row.get("id") or "")))
+
+    def from_summary(self, summary: Dict) -> Optional[int]:
+        by_severity = summary.get("by_severity")
+        if by_severity is not None:
+            return sum(n for sev, n in by_severity.items() if not self.severities or sev in self.severities)
+        if self.severities == {"HIGH", "CRITICAL"}:
+            return int(summary.get("high_or_critical", 0))
+        if not self.severities:
+            return int(summary.get("count", 0))
+        return None
+
+    def check(self, facts: Dict, vulns: Dict) -> Optional[Dict]:
+        count = vulns.get(self.name)
+        if count is None or count < self.min_count:
+            return None
+        label = "/".join(s for s in SEVERITIES if s in self.severities) or "any"
+        return self.violation(f"{count} {label} vulnerabilities" + (" with a fix available" if self.fixed_only else "")
+                              + " in image.", count=count)
+
+
+_RULE_CLASSES = {
+    "privileged": _Privileged,
+    "capabilities": _Capabilities,
+    "mounts": _Mounts,
+    "user": _User,
+    "seccomp": _Seccomp,
+    "vulnerabilities": _Vulnerabilities,
+}
+
+
+class PolicyEvaluator:
+    def __init__(self, rules: List[Dict], allow: Iterable[str] = (), deny: Iterable[str] = (),
+                 mount_categories: Optional[Dict[str, List[str]]] = None):
+        specs = []
+        for spec in rules:
+            if spec.get("type") == "mounts" and spec.get("category"):
+                # Shared with enrich_with_inspect through the `mounts` section of config.yml
+                category = spec["category"]
+                if category not in (mount_categories or {}):
+                    raise ValueError(f"policy rule {spec.get('name')!r}: unknown mount category {category!r}")
+                spec = {**spec, "paths": list(spec.get("paths") or []) + mount_categories[category]}
+            specs.append(spec)
+        self.rules = [_RULE_CLASSES.get(spec.get("type"), _Rule)(spec) for spec in specs]
+        names = [r.name for r in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("policy rule names must be unique")
+        self.allow = _glob_regex(allow)
+        self.deny = _glob_regex(deny)
+        self.vuln_rules = [r for r in self.rules if r.type == "vulnerabilities"]
+        self._lock = threading.Lock()
+        self._stats = {name: {"evaluations": 0, "matches": 0, "us": deque(maxlen=LATENCY_SAMPLES)}
+                       for name in ["images", "vulnerability-scan"] + names}
+        self._decisions = {"allowed": 0, "blocked": 0}
+
+    @property
+    def needs_scan(self) -> bool:
+        return bool(self.vuln_rules)
+
+    def _count_vulnerabilities(self, summary: Optional[Dict], findings: Optional[Callable[[], Iterable[Dict]]],
+                               timings: Dict) -> Dict[str, int]:
+        """Per-rule finding counts; rules that need per-finding detail share one pass over the findings."""
+        counts: Dict[str, int] = {}
+        if not summary:
+            return counts
+        pending = []
+        for rule in self.vuln_rules:
+            count = None if rule.needs_findings else rule.from_summary(summary)
+            if count is None:
+                pending.append(rule)
+            else:
+                counts[rule.name] = count
+        if pending and findings is not None:
+            started = time.perf_counter()
+            for rule in pending:
+                counts[rule.name] = 0
+            for row in findings():
+                for rule in pending:
+                    if rule.matches(row):
+                        counts[rule.name] += 1
+            timings["vulnerability-scan"] = (time.perf_counter() - started) * 1e6
+        return counts
+
+    def evaluate(self, metadata: Dict, image_ref: Optional[str] = None, summary: Optional[Dict] = None,
+                 findings: Optional[Callable[[], Iterable[Dict]]] = None, record: bool = True) -> Dict:
+        """
+        Decide one container. `summary` is the Trivy scan summary (None when not
+        scanned) and `findings` a callable returning the image's full findings,
+        only called if a rule needs per-finding detail. `record=False` leaves the
+        decision and timing stats alone (risk reports that aren't admission decisions).
+        """
+        started = time.perf_counter()
+        facts = container_facts(metadata, image_ref)
+        timings: Dict[str, float] = {}
+        violations = []
+
+        t0 = time.perf_counter()
+        image = facts["image"]
+        if self.deny is not None and self.deny.fullmatch(image):
+            violations.append({"rule": "images.deny", "title": "Denied image", "type": "image", "severity": "high",
+                               "action": "block", "description": f"Image {image} matches the deny list."})
+        elif self.allow is not None and not self.allow.fullmatch(image):
+            violations.append({"rule": "images.allow", "title": "Image not allowed", "type": "image",
+                               "severity": "high", "action": "block",
+                               "description": f"Image {image} is not on the allow list."})
+        timings["images"] = (time.perf_counter() - t0) * 1e6
+
+        vulns = self._count_vulnerabilities(summary, findings, timings) if self.vuln_rules else {}
+
+        for rule in self.rules:
+            t0 = time.perf_counter()
+            hit = rule.check(facts, vulns)
+            timings[rule.name] = (time.perf_counter() - t0) * 1e6
+            if isinstance(hit, list):
+                violations.extend(hit)   # per_match rules
+            elif hit is not None:
+                violations.append(hit)
+
+        blocked = any(v["action"] == "block" for v in violations)
+        if record:
+            self._record(timings, {v["rule"] for v in violations}, blocked)
+        return {
+            "blocked": blocked,
+            "violations": violations,
+            "scanned": summary is not None,
+            "timings_us": {k: round(v, 1) for k, v in timings.items()},
+            "total_us": round((time.perf_counter() - started) * 1e6, 1),
+        }
+
+    def _record(self, timings: Dict[str, float], matched: set, blocked: bool) -> None:
+        with self._lock:
+            for name, us in timings.items():
+                stats = self._stats[name]
+                stats["evaluations"] += 1
+                stats["us"].append(us)
+                if name in matched or (name == "images" and matched & {"images.allow", "images.deny"}):
+                    stats["matches"] += 1
+            self._decisions["blocked" if blocked else "allowed"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rules = {}
+            for name, s in self._stats.items():
+                # latency_summary reports whatever unit it is fed; timings are kept in microseconds
+                rules[name] = {"evaluations": s["evaluations"], "matches": s["matches"],
+                               "latency_us": latency_summary(list(s["us"]))}
+            return {"decisions": dict(self._decisions), "rules": rules}
+
+
+def compile_policy(cfg: Dict) -> PolicyEvaluator:
+    """
+    Build the evaluator from config.yml. Without a `policy.rules` list the
+    default rules apply, with trivy.block_if_high_or_critical as the CVE threshold.
+    """
+    policy_cfg = (cfg or {}).get("policy") or {}
+    rules = policy_cfg.get("rules")
+    if rules is None:
+        rules = [dict(r) for r in DEFAULT_RULES]
+        threshold = ((cfg or {}).get("trivy") or {}).get("block_if_high_or_critical")
+        if threshold is not None:
+            rules[-1]["min_count"] = int(threshold)
+    images = policy_cfg.get("images") or {}
+    return PolicyEvaluator(rules, allow=images.get("allow") or (), deny=images.get("deny") or (),
+                           mount_categories=mount_settings(cfg))
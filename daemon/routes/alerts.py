@@ -3,23 +3,24 @@ import os
 import json
 import logging
 import threading
+import functools
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime, timezone
 
-import docker
 from events import add_event
 from utils import (
     persist_alert_line,
     enrich_with_inspect,
-    trivy_scan_image,
+    scan_image_async,
     approvals_get,
     approvals_set,
     load_config,
     generate_unique_id,
     ensure_alert_has_id,
-    deduplicate_alerts,
-    find_alert_by_id_or_base,
+    get_docker_client,
 )
-from alerts_store import read_alerts, write_alerts, append_alert
+from falco_queue import FalcoQueue, FalcoCoalescer, queue_settings, coalesce_settings
+from alerts_store import FILTER_FIELDS, append_alert, get_store, page_alerts, parse_timestamp
 
 RED = "\033[91m"
 GREEN = "\033[92m"
@@ -36,20 +37,72 @@ def health():
     return "OK", 200
 
 
+def _alert_filters(args) -> dict:
+    """Build store filters from query params; since/until must be ISO-8601 timestamps."""
+    filters = {name: args.get(name) for name in FILTER_FIELDS if args.get(name)}
+    for key in ("since", "until"):
+        if args.get(key):
+            ts = parse_timestamp(args.get(key))
+            if ts is None:
+                raise ValueError(f"invalid '{key}' timestamp")
+            filters[key] = ts
+    return filters
+
+
 @alerts_bp.route("/api/alerts", methods=["GET"])
 def list_alerts():
+    """
+    Newest-first alerts, filtered server-side by severity, status, source, rule,
+    container_id (prefix), image, since and until.
+
+    Pass `cursor` (empty for the first page) to get {"items": [...], "next_cursor": ...};
+    without it the response stays a plain list, with the next cursor in X-Next-Cursor.
+    """
     ALERTS_FILE = current_app.config.get("ALERTS_FILE")
-    limit = max(1, min(1000, int(request.args.get("limit", "100"))))
-    if not ALERTS_FILE or not os.path.exists(ALERTS_FILE):
-        return jsonify([]), 200
     try:
-        rows = read_alerts(ALERTS_FILE)
-        rows = list(reversed(rows))
-        rows = deduplicate_alerts(rows)[:limit]
-        return jsonify(rows), 200
+        limit = max(1, min(1000, int(request.args.get("limit", "100"))))
+        filters = _alert_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    paged = "cursor" in request.args
+    if not ALERTS_FILE:
+        return jsonify({"items": [], "next_cursor": None} if paged else []), 200
+    try:
+        # Filters run while the store is streamed newest-first; reading stops after `limit` matches
+        items, next_cursor = page_alerts(ALERTS_FILE, filters, request.args.get("cursor"), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         log.exception("reading alerts failed")
         return jsonify({"error": str(e)}), 500
+    items = [ensure_alert_has_id(a) for a in items]
+    if paged:
+        return jsonify({"items": items, "next_cursor": next_cursor}), 200
+    resp = jsonify(items)
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp, 200
+
+
+@alerts_bp.route("/api/alerts/stats", methods=["GET"])
+def alert_stats():
+    """
+    Alert counts by severity, status, source and rule.
+    Optional query params (severity, status, source, rule) narrow the "matching" count.
+    """
+    ALERTS_FILE = current_app.config.get("ALERTS_FILE")
+    if not ALERTS_FILE:
+        return jsonify({"error": "alerts file not configured"}), 500
+    try:
+        store = get_store(ALERTS_FILE)
+        stats = store.summary()
+        filters = {k: request.args.get(k) for k in ("severity", "status", "source", "rule") if request.args.get(k)}
+        if filters:
+            stats["matching"] = store.counters.count(**filters)
+        return jsonify(stats), 200
+    except Exception as e:
+        log.exception("computing alert stats failed")
+        return jsonify({"error": str(e)}), 500
 
 
 AUDIT_FILE = os.environ.get("AUDIT_FILE", "/app/alerts/audits.jsonl")
@@ -65,21 +118,12 @@ def acknowledge_alert(alert_id):
         return jsonify({"error": "alerts file not configured"}), 500
 
     try:
-        if not os.path.exists(ALERTS_FILE):
-            return jsonify({"error": "Alerts file not found"}), 404
-
-        alerts = read_alerts(ALERTS_FILE)
-        alert, alert_index = find_alert_by_id_or_base(alerts, alert_id)
+        # Appends a status delta; the alerts file is never rewritten here
+        alert = get_store(ALERTS_FILE).update(alert_id, {"status": "acknowledged"})
         if alert is None:
-            log.warning("Alert %s not found in alerts.jsonl", alert_id)
+            log.warning("Alert %s not found in the alert store", alert_id)
             return jsonify({"error": f"Alert {alert_id} not found"}), 404
 
-        alert["status"] = "acknowledged"
-        alerts[alert_index] = alert
-
-        # Write back updated alerts via store
-        write_alerts(alerts, ALERTS_FILE)
-
         # Append audit line
         audit_entry = {
             "alert_id": alert_id,
@@ -88,7 +132,7 @@ def acknowledge_alert(alert_id):
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "source": "api",
         }
-        append_alert(audit_entry, AUDIT_FILE)
+        append_alert(audit_entry, AUDIT_FILE, wait=False)
 
         log.info("Alert %s acknowledged (original_id: %s)", alert_id, alert.get("id"))
         return jsonify({"status": "acknowledged", "alert_id": alert_id}), 200
@@ -107,20 +151,11 @@ def resolve_alert(alert_id):
         return jsonify({"error": "alerts file not configured"}), 500
 
     try:
-        if not os.path.exists(ALERTS_FILE):
-            return jsonify({"error": "Alerts file not found"}), 404
-
-        alerts = read_alerts(ALERTS_FILE)
-        alert, alert_index = find_alert_by_id_or_base(alerts, alert_id)
+        alert = get_store(ALERTS_FILE).update(alert_id, {"status": "resolved"})
         if alert is None:
-            log.warning("Alert %s not found in alerts.jsonl", alert_id)
+            log.warning("Alert %s not found in the alert store", alert_id)
             return jsonify({"error": f"Alert {alert_id} not found"}), 404
 
-        alert["status"] = "resolved"
-        alerts[alert_index] = alert
-
-        write_alerts(alerts, ALERTS_FILE)
-
         audit_entry = {
             "alert_id": alert_id,
             "original_id": alert.get("id"),
@@ -128,7 +163,7 @@ def resolve_alert(alert_id):
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "source": "api",
         }
-        append_alert(audit_entry, AUDIT_FILE)
+        append_alert(audit_entry, AUDIT_FILE, wait=False)
 
         log.info("Alert %s resolved (original_id: %s)", alert_id, alert.get("id"))
         return jsonify({"status": "resolved", "alert_id": alert_id}), 200
@@ -152,25 +187,17 @@ def update_alert_status(alert_id):
         if new_status not in ("acknowledged", "resolved", "open"):
             return jsonify({"error": "invalid status", "detail": new_status}), 400
 
-        if not os.path.exists(ALERTS_FILE):
-            return jsonify({"error": "Alerts file not found"}), 404
-
-        alerts = read_alerts(ALERTS_FILE)
-        alert, idx = find_alert_by_id_or_base(alerts, alert_id)
+        alert = get_store(ALERTS_FILE).update(alert_id, {"status": new_status})
         if alert is None:
             return jsonify({"error": f"Alert {alert_id} not found"}), 404
 
-        alert["status"] = new_status
-        alerts[idx] = alert
-        write_alerts(alerts, ALERTS_FILE)
-
         append_alert({
             "alert_id": alert_id,
             "original_id": alert.get("id"),
             "action": f"status:{new_status}",
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "source": "api",
-        }, AUDIT_FILE)
+        }, AUDIT_FILE, wait=False)
 
         return jsonify({"status": new_status, "alert_id": alert_id}), 200
     except Exception as e:
@@ -178,12 +205,32 @@ def update_alert_status(alert_id):
         return jsonify({"error": str(e)}), 500
 
 
-def _process_falco_alert(payload, alerts_file):
+def _falco_container_id(payload):
+    fields = (payload or {}).get("output_fields") or {}
+    return (
+        fields.get("container.id")
+        or fields.get("containerId")
+        or ((payload or {}).get("container") or {}).get("id")
+        or ((payload or {}).get("context", {}) or {}).get("container_id")
+        or ""
+    )
+
+
+def _falco_coalesce_key(payload):
+    """(container, rule); None for auto-stop rules, whose response must run for every event."""
+    rule = (payload or {}).get("rule")
+    if rule in ((load_config().get("falco") or {}).get("auto_stop_on_rules") or []):
+        return None
+    return (_falco_container_id(payload), rule)
+
+
+def _process_falco_alert(payload, alerts_file, alert_id=None):
     """
     Falco alert processing logic:
     - Logs alerts from Falco
     - If rule matches one in config.yml -> kills shell (sh/bash/zsh) inside the same container
     - Does NOT kill container itself
+    `alert_id` is pre-assigned when the event opened a coalescing window.
     """
     try:
         rule = (payload or {}).get("rule")
@@ -191,13 +238,7 @@ def _process_falco_alert(payload, alerts_file):
         priority = ((payload or {}).get("priority") or "warning").lower()
         fields = (payload or {}).get("output_fields") or {}
 
-        container_id = (
-            fields.get("container.id")
-            or fields.get("containerId")
-            or ((payload or {}).get("container") or {}).get("id")
-            or ((payload or {}).get("context", {}) or {}).get("container_id")
-            or ""
-        )
+        container_id = _falco_container_id(payload)
         proc_name = fields.get("proc.name")
         user_name = fields.get("user.name")
 
@@ -216,9 +257,23 @@ def _process_falco_alert(payload, alerts_file):
         image_ref = enrichment.get("image")
         image_id = enrichment.get("image_id")
 
+        cfg = load_config()
         trivy_summary = None
+        pending_scan = None
         if image_ref:
-            trivy_summary = trivy_scan_image(image_ref, image_id=image_id)
+            # Cache hits return at once; misses queue behind gate scans. A worker waits only
+            # briefly, so an unscanned image can't tie up the pool; a late result is attached
+            # to the persisted alert when the scan finishes.
+            wait = float((cfg.get("falco") or {}).get("enrichment_wait_seconds", 5))
+            try:
+                fut = scan_image_async(image_ref, image_id=image_id, lane="enrichment")
+                try:
+                    trivy_summary = fut.result(timeout=wait)
+                except FutureTimeout:
+                    pending_scan = fut
+                    trivy_summary = {"pending": True}
+            except Exception as e:
+                log.warning("[Falco] Trivy enrichment failed for %s: %s", image_ref, e)
 
         # Build structured alert record
         alert_record = {
@@ -243,6 +298,11 @@ def _process_falco_alert(payload, alerts_file):
             "raw": payload,
         }
 
+        # Occurrence count / first-last seen of repeats folded into this alert so far
+        if alert_id:
+            alert_record["id"] = alert_id
+            alert_record.update(get_falco_coalescer(alerts_file).claim(alert_id) or {})
+
         # Persist alert (use the alerts_file parameter passed into this function)
         try:
             persist_alert_line(alert_record, alerts_file)
@@ -250,15 +310,18 @@ def _process_falco_alert(payload, alerts_file):
         except Exception as e:
             log.exception("Failed to persist falco alert to %s: %s", alerts_file, e)
 
+        if pending_scan is not None:
+            pending_scan.add_done_callback(
+                functools.partial(_attach_trivy, alerts_file=alerts_file, alert_id=alert_record["id"]))
+
         # === Auto-stop or shell-kill logic ===
-        cfg = load_config()
         auto_rules = (cfg.get("falco", {}) or {}).get("auto_stop_on_rules", []) or []
         stop_grace = int((cfg.get("falco") or {}).get("stop_grace_seconds", 5))
         dry = os.environ.get("DRY_RUN", "false").lower() in ("1", "true", "yes")
 
         if rule in auto_rules and container_id:
             try:
-                client = docker.from_env()
+                client = get_docker_client()
                 c = client.containers.get(container_id)
 
                 proc_name = (payload or {}).get("output_fields", {}).get("proc.name", "")
@@ -310,25 +373,104 @@ def _process_falco_alert(payload, alerts_file):
         log.exception("[Falco] Async processing failed: %s", e)
 
 
+def _attach_trivy(fut, alerts_file, alert_id):
+    """Late enrichment: write the finished scan into an alert persisted without it."""
+    try:
+        summary = fut.result()
+    except Exception as e:
+        log.warning("[Falco] Trivy enrichment failed for alert %s: %s", alert_id, e)
+        summary = None
+    try:
+        get_store(alerts_file).update(alert_id, {"trivy": summary})
+    except Exception:
+        log.exception("[Falco] Could not attach Trivy results to alert %s", alert_id)
+
+
+def _handle_falco_item(item, alerts_file):
+    # Items spilled by older versions are bare Falco payloads
+    event = item["event"] if "event" in item else item
+    _process_falco_alert(event, alerts_file, alert_id=item.get("alert_id"))
+
+
+_FALCO_COALESCER = None
+_FALCO_LOCK = threading.Lock()
+
+
+def get_falco_coalescer(alerts_file):
+    """
+    Falco ingestion pipeline, started on first use: a coalescer (`falco.coalesce`)
+    in front of the worker pool (`falco.queue`).
+    """
+    global _FALCO_COALESCER
+    with _FALCO_LOCK:
+        if _FALCO_COALESCER is None:
+            cfg = load_config()
+            queue = FalcoQueue(lambda item: _handle_falco_item(item, alerts_file), **queue_settings(cfg, alerts_file))
+            coalesce = coalesce_settings(cfg)
+            _FALCO_COALESCER = FalcoCoalescer(
+                queue,
+                _falco_coalesce_key,
+                lambda aid, fields: get_store(alerts_file).update(aid, fields) is not None,
+                window_seconds=coalesce["window_seconds"] if coalesce["enabled"] else 0,
+            )
+            queue.start()
+            _FALCO_COALESCER.start()
+            log.info("[Falco] %d workers, queue size %d, overflow=%s, coalesce window %ss",
+                     queue.workers, queue.max_size, queue.overflow, _FALCO_COALESCER.window)
+        return _FALCO_COALESCER
+
+
+def _parse_falco_events(raw: bytes):
+    """A single JSON event, a JSON array of events, or NDJSON (one event per line)."""
+    text = raw.decode("utf-8").strip()
+    if not text:
+        raise ValueError("empty body")
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list) or not all(isinstance(e, dict) for e in data):
+        raise ValueError("expected a JSON object, a JSON array of objects or NDJSON")
+    return data
+
+
 @alerts_bp.route("/api/falco-alert", methods=["POST"])
 def falco_alert():
     ALERTS_FILE = current_app.config.get("ALERTS_FILE")
     try:
-        payload = request.get_json(force=True, silent=False)
+        events = _parse_falco_events(request.get_data())
     except Exception as e:
         return jsonify({"error": f"invalid json: {e}"}), 400
 
     if not ALERTS_FILE:
         return jsonify({"error": "alerts file not configured"}), 500
 
+    counts = {"queued": 0, "coalesced": 0, "rejected": 0}
     try:
-        t = threading.Thread(target=_process_falco_alert, args=(payload, ALERTS_FILE), daemon=True)
-        t.start()
+        coalescer = get_falco_coalescer(ALERTS_FILE)
+        for event in events:
+            counts[coalescer.add(event)] += 1
     except Exception as e:
-        log.exception("Failed to start falco alert thread: %s", e)
-        return jsonify({"error": "failed to start background processor"}), 500
+        log.exception("Failed to queue falco alert: %s", e)
+        return jsonify({"error": "failed to queue alert for processing"}), 500
+
+    if counts["rejected"] == len(events):
+        resp = jsonify({"error": "falco alert queue is full", "events": len(events), **counts})
+        resp.headers["Retry-After"] = "1"
+        return resp, 429
+    return jsonify({"status": "received", "events": len(events), **counts}), 200
+
 
-    return jsonify({"status": "received"}), 200
+@alerts_bp.route("/api/falco-alert/queue", methods=["GET"])
+def falco_queue_stats():
+    """Queue depth, drop/reject/spill counters, latency percentiles and coalescing counters."""
+    ALERTS_FILE = current_app.config.get("ALERTS_FILE")
+    if not ALERTS_FILE:
+        return jsonify({"error": "alerts file not configured"}), 500
+    coalescer = get_falco_coalescer(ALERTS_FILE)
+    return jsonify({**coalescer.queue.stats(), "coalescing": coalescer.stats()}), 200
 
 
 @alerts_bp.route("/api/approvals/<path:image_key>", methods=["GET"])
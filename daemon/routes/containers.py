@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
 import logging
 import docker
 import json
@@ -6,9 +6,18 @@ import os
 import time
 from datetime import datetime, timezone
 
+from alerts_store import append_alert, iter_alerts_newest
+from container_inventory import AmbiguousContainer
+from container_actions import ACTIONS, action_settings, new_batch_id, run_actions, select_containers, summarize
+from utils import (
+    collect_container_stats, get_container_inventory, get_stats_collector, get_stats_sampler, load_config,
+)
+
 containers_bp = Blueprint("containers", __name__)
 log = logging.getLogger(__name__)
 
+AUDIT_FILE = os.environ.get("AUDIT_FILE", "/app/alerts/audits.jsonl")
+
 
 def _get_docker_client():
     client = current_app.config.get("DOCKER_CLIENT")
@@ -20,6 +29,14 @@ def _get_docker_client():
         return None
 
 
+def _ambiguous(err):
+    """409 for an ID prefix that matches several containers, with the candidates."""
+    return jsonify({
+        "error": str(err),
+        "matches": [{"id": c.short_id, "name": c.name, "status": c.status} for c in err.matches],
+    }), 409
+
+
 @containers_bp.route("/api/containers", methods=["GET"])
 def list_container_inspections():
     """
@@ -39,15 +56,7 @@ def list_container_inspections():
         return jsonify([]), 200
     out = []
     try:
-        with open(ALERTS_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-        for line in reversed(lines):
-            try:
-                rec = json.loads(line)
-            except Exception:
-                continue
-
+        for rec in iter_alerts_newest(ALERTS_FILE):
             if rec.get("source") == "falco":
                 continue
             if "metadata" not in rec or "risks" not in rec:
@@ -87,27 +96,22 @@ def list_running_containers():
         if not client:
             return jsonify({"error": "Docker client not available"}), 503
 
-        containers_list = client.containers.list(all=include_all)
+        containers_list = get_container_inventory().containers(include_all=include_all)
+        # Stats of all running containers (sampler memory, or one bounded concurrent fetch)
+        all_stats = collect_container_stats([c.id for c in containers_list if c.running])
         result = []
         for container in containers_list:
             try:
                 cpu_percent = 0.0
                 memory_usage = 0.0
                 memory_limit = 0.0
-                if container.status == "running":
-                    try:
-                        stats = container.stats(stream=False)
-                        if "cpu_stats" in stats and "system_cpu_usage" in stats["cpu_stats"]:
-                            cpu_delta = stats["cpu_stats"]["cpu_usage"]["total_usage"] - stats["precpu_stats"]["cpu_usage"]["total_usage"]
-                            system_delta = stats["cpu_stats"]["system_cpu_usage"] - stats["precpu_stats"]["system_cpu_usage"]
-                            cpu_percent = (cpu_delta / system_delta) * 100.0 if system_delta > 0 else 0.0
-                        if "memory_stats" in stats:
-                            memory_usage = stats["memory_stats"].get("usage", 0) / (1024 ** 3)
-                            memory_limit = stats["memory_stats"].get("limit", 0) / (1024 ** 3)
-                    except Exception as stats_err:
-                        logging.debug(f"Could not get stats for {container.name}: {stats_err}")
-
-                start_time_str = container.attrs.get("State", {}).get("StartedAt", "")
+                stats = all_stats.get(container.id)
+                if stats:
+                    cpu_percent = stats["cpu_percent"]
+                    memory_usage = stats["memory_bytes"] / (1024 ** 3)
+                    memory_limit = (stats["memory_limit_bytes"] or 0) / (1024 ** 3)
+
+                start_time_str = container.started_at if container.running else ""
                 uptime_str = "N/A"
                 if start_time_str:
                     try:
@@ -123,31 +127,32 @@ def list_running_containers():
                         uptime_str = "N/A"
 
                 result.append({
-                    "id": container.id[:12],
+                    "id": container.short_id,
                     "name": container.name,
-                    "image": container.image.tags[0] if container.image.tags else "unknown",
+                    "image": container.image,
                     "status": container.status,
                     "uptime": uptime_str,
                     "cpu": round(cpu_percent, 1),
                     "memory": round(memory_usage, 2),
                     "memory_limit": round(memory_limit, 2),
-                    "created": container.attrs.get("Created", ""),
-                    "last_event": container.attrs.get("State", {}).get("Status", "unknown"),
+                    "created": container.created,
+                    "last_event": container.status,
                     "full_id": container.id,
+                    "stale": bool(stats and stats["stale"]),
                 })
             except Exception as e:
                 logging.warning(f"Error processing container {container.name}: {e}")
                 try:
                     result.append({
-                        "id": container.id[:12],
+                        "id": container.short_id,
                         "name": container.name,
-                        "image": container.image.tags[0] if container.image.tags else "unknown",
+                        "image": container.image,
                         "status": container.status,
                         "uptime": "N/A",
                         "cpu": 0.0,
                         "memory": 0.0,
                         "memory_limit": 0.0,
-                        "created": container.attrs.get("Created", ""),
+                        "created": container.created,
                         "last_event": "stats unavailable",
                         "full_id": container.id,
                     })
@@ -160,6 +165,40 @@ def list_running_containers():
         return jsonify({"error": str(e)}), 500
 
 
+@containers_bp.route("/api/containers/stats", methods=["GET"])
+def container_stats_collector():
+    """Inventory, background sampler and on-demand collector state (`containers` in config.yml)."""
+    return jsonify({"inventory": get_container_inventory().stats(), "sampler": get_stats_sampler().stats(),
+                    "collector": get_stats_collector().stats()}), 200
+
+
+@containers_bp.route("/api/containers/<container_id>/metrics", methods=["GET"])
+def container_metrics(container_id):
+    """
+    CPU / memory / network history of a running container from the background sampler.
+    Optional query params:
+      - since: epoch seconds; only points newer than this
+    """
+    sampler = get_stats_sampler()
+    if not sampler.enabled:
+        return jsonify({"error": "Stats sampler disabled (containers.sampler.enabled)"}), 503
+    try:
+        since = float(request.args["since"]) if request.args.get("since") else None
+    except ValueError:
+        return jsonify({"error": "since must be epoch seconds"}), 400
+    try:
+        container = get_container_inventory().resolve(container_id)
+    except AmbiguousContainer as e:
+        return _ambiguous(e)
+    history = sampler.history(container.id, since=since) if container else None
+    if history is None and container and sampler.unsampled([container.id]):
+        return jsonify({"error": "No history for this container: the sampler is at "
+                                 "containers.sampler.max_streams"}), 404
+    if history is None:
+        return jsonify({"error": f"No running container with ID or name {container_id}"}), 404
+    return jsonify(history), 200
+
+
 @containers_bp.route("/api/containers/<container_id>/stop", methods=["POST", "OPTIONS"])
 def stop_container(container_id):
     if request.method == "OPTIONS":
@@ -169,24 +208,22 @@ def stop_container(container_id):
         client = _get_docker_client()
         if not client:
             return jsonify({"error": "Docker client not available"}), 503
-        container = None
-        for c in client.containers.list(all=True):
-            if c.id.startswith(container_id):
-                container = c
-                break
+        container = get_container_inventory().resolve(container_id)
 
         if not container:
-            return jsonify({"error": f"No container found with ID starting {container_id}"}), 404
+            return jsonify({"error": f"No container found with ID or name {container_id}"}), 404
 
-        container.stop(timeout=5)
+        client.api.stop(container.id, timeout=5)
         return jsonify({
             "status": "stopped",
             "id": container.short_id,
             "name": container.name,
-            "image": container.image.tags[0] if container.image.tags else "unknown",
+            "image": container.image,
             "message": f"Container {container.short_id} stopped successfully.",
         }), 200
 
+    except AmbiguousContainer as e:
+        return _ambiguous(e)
     except docker.errors.APIError as e:
         return jsonify({"error": f"Docker API error: {e.explanation}"}), 500
     except Exception as e:
@@ -202,24 +239,22 @@ def start_container(container_id):
         client = _get_docker_client()
         if not client:
             return jsonify({"error": "Docker client not available"}), 503
-        container = None
-        for c in client.containers.list(all=True):
-            if c.id.startswith(container_id):
-                container = c
-                break
+        container = get_container_inventory().resolve(container_id)
 
         if not container:
-            return jsonify({"error": f"No container found with ID starting {container_id}"}), 404
+            return jsonify({"error": f"No container found with ID or name {container_id}"}), 404
 
-        container.start()
+        client.api.start(container.id)
         return jsonify({
             "status": "started",
             "id": container.short_id,
             "name": container.name,
-            "image": container.image.tags[0] if container.image.tags else "unknown",
+            "image": container.image,
             "message": f"Container {container.short_id} started successfully.",
         }), 200
 
+    except AmbiguousContainer as e:
+        return _ambiguous(e)
     except docker.errors.APIError as e:
         return jsonify({"error": f"Docker API error: {e.explanation}"}), 500
     except Exception as e:
@@ -235,30 +270,110 @@ def restart_container(container_id):
         client = _get_docker_client()
         if not client:
             return jsonify({"error": "Docker client not available"}), 503
-        container = None
-        for c in client.containers.list(all=True):
-            if c.id.startswith(container_id):
-                container = c
-                break
+        container = get_container_inventory().resolve(container_id)
 
         if not container:
-            return jsonify({"error": f"No container found with ID starting {container_id}"}), 404
+            return jsonify({"error": f"No container found with ID or name {container_id}"}), 404
 
-        container.restart(timeout=5)
+        client.api.restart(container.id, timeout=5)
         return jsonify({
             "status": "restarted",
             "id": container.short_id,
             "name": container.name,
-            "image": container.image.tags[0] if container.image.tags else "unknown",
+            "image": container.image,
             "message": f"Container {container.short_id} restarted successfully.",
         }), 200
 
+    except AmbiguousContainer as e:
+        return _ambiguous(e)
     except docker.errors.APIError as e:
         return jsonify({"error": f"Docker API error: {e.explanation}"}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@containers_bp.route("/api/containers/actions", methods=["POST", "OPTIONS"])
+def bulk_container_action():
+    """
+    Apply one action to many containers.
+    JSON body:
+      - action: stop | start | restart | pause | unpause | kill
+      - ids: container IDs, names or ID prefixes; or else a selector:
+      - label: "key" or "key=value"
+      - image: image reference glob, e.g. "registry/app:*"
+      - concurrency, timeout_seconds: optional, capped by `containers.actions` in config.yml
+    With ?stream=true the response is NDJSON: one line per container as it finishes,
+    then {"summary": ...}. Otherwise {"results": [...], "summary": {...}}.
+    Every container acted on gets one audit record.
+    """
+    if request.method == "OPTIONS":
+        return "", 204
+
+    body = request.get_json(silent=True) or {}
+    action = str(body.get("action") or "").strip().lower()
+    if action not in ACTIONS:
+        return jsonify({"error": f"action must be one of {', '.join(ACTIONS)}"}), 400
+    ids = body.get("ids")
+    if ids is not None and not isinstance(ids, list):
+        return jsonify({"error": "ids must be a list"}), 400
+    label = (body.get("label") or "").strip()
+    image = (body.get("image") or "").strip()
+    if not ids and not label and not image:
+        return jsonify({"error": "give ids, label or image; refusing to act on every container"}), 400
+    try:
+        concurrency = int(body["concurrency"]) if body.get("concurrency") else None
+        timeout = float(body["timeout_seconds"]) if body.get("timeout_seconds") else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "concurrency and timeout_seconds must be numbers"}), 400
+
+    settings = action_settings(load_config())
+    try:
+        targets, unresolved = select_containers(get_container_inventory(), ids=ids, label=label, image=image)
+    except Exception as e:
+        log.exception("Selecting containers failed")
+        return jsonify({"error": str(e)}), 503
+    if len(targets) > settings["max_targets"]:
+        return jsonify({"error": f"{len(targets)} containers selected; the limit is {settings['max_targets']} "
+                                 f"(containers.actions.max_targets)"}), 400
+
+    batch_id = new_batch_id()
+    started = time.monotonic()
+    log.info("Bulk %s %s: %d container(s)", action, batch_id, len(targets))
+
+    def audit(result):
+        append_alert({
+            "action": f"container_{action}",
+            "container_id": result.get("full_id"),
+            "container_name": result.get("name"),
+            "result": result["status"],
+            "error": result.get("error"),
+            "batch_id": batch_id,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "source": "api",
+        }, AUDIT_FILE, wait=False)
+
+    def results():
+        yield from unresolved
+        yield from run_actions(action, targets, settings, concurrency=concurrency, timeout=timeout,
+                               on_result=audit)
+
+    if request.args.get("stream", "false").lower() in ("1", "true", "yes"):
+        def ndjson():
+            done = []
+            for result in results():
+                done.append(result)
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"summary": summarize(action, batch_id, done, started)}) + "\n"
+        return Response(stream_with_context(ndjson()), mimetype="application/x-ndjson")
+
+    try:
+        done = list(results())
+    except Exception as e:
+        log.exception("Bulk %s %s failed", action, batch_id)
+        return jsonify({"error": str(e), "batch_id": batch_id}), 503
+    return jsonify({"results": done, "summary": summarize(action, batch_id, done, started)}), 200
+
+
 @containers_bp.route("/api/containers/images/list", methods=["GET", "OPTIONS"])
 def list_container_images():
     """
@@ -275,12 +390,16 @@ def list_container_images():
         if not client:
             return jsonify({"error": "Docker client not available"}), 503
 
-        containers_list = client.containers.list(all=True)
+        containers_list = get_container_inventory().containers(include_all=True)
         images = {}  # Use dict to deduplicate by image tag
         
         for container in containers_list:
             try:
-                image_tags = container.image.tags if container.image.tags else [f"sha256:{container.image.id.split(':')[1][:12]}"]
+                # Containers created from a bare image id are listed by its short digest
+                ref = container.image
+                if ref in ("", "unknown") or ref.startswith("sha256:") or container.image_id.split(":")[-1].startswith(ref):
+                    ref = f"sha256:{container.image_id.split(':')[1][:12]}"
+                image_tags = [ref]
                 for tag in image_tags:
                     if tag not in images:
                         # Get approval status from utils
@@ -2,18 +2,25 @@ from flask import Blueprint, jsonify, request, current_app
 import docker
 import logging
 import platform
-import os
-import json
 import time
+from itertools import islice
 from datetime import datetime, timezone
 
 from utils import (
     ensure_alert_has_id,
-    deduplicate_alerts,
+    iter_unique_alerts,
     generate_unique_id,
     trivy_scan_image,
+    trivy_scan_stats,
+    get_findings_store,
+    resolve_image_digest,
+    get_policy,
+    collect_container_stats,
+    get_container_inventory,
 )
+from trivy_report import SEVERITIES
 from events import get_events
+from alerts_store import iter_alerts_newest, get_store
 def _get_docker_client():
     try:
         client = docker.from_env()
@@ -38,6 +45,68 @@ def list_events():
         return jsonify({"error": str(e)}), 500
 
 
+@system_bp.route("/api/scans/stats", methods=["GET"])
+def scan_stats():
+    """Trivy cache hit/miss counters and in-flight / shared scan counts."""
+    try:
+        return jsonify(trivy_scan_stats()), 200
+    except Exception as e:
+        log.exception("reading scan stats failed")
+        return jsonify({"error": str(e)}), 500
+
+
+@system_bp.route("/api/policy/stats", methods=["GET"])
+def policy_stats():
+    """Admission decisions and per-rule evaluation counts, matches and latency (microseconds)."""
+    try:
+        return jsonify(get_policy().stats()), 200
+    except Exception as e:
+        log.exception("reading policy stats failed")
+        return jsonify({"error": str(e)}), 500
+
+
+@system_bp.route("/api/images/<path:image_key>/vulnerabilities", methods=["GET"])
+def image_vulnerabilities(image_key):
+    """
+    Full findings of an image's latest scan, most severe first.
+    Query params:
+      - severity: comma-separated levels (e.g. HIGH,CRITICAL)
+      - pkg: package-name prefix (case-insensitive)
+      - limit: page size (default 100, max 1000)
+      - cursor: next_cursor from the previous page
+    """
+    try:
+        limit = max(1, min(1000, int(request.args.get("limit", "100"))))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    severities = [s.strip().upper() for s in (request.args.get("severity") or "").split(",") if s.strip()]
+    unknown = [s for s in severities if s not in SEVERITIES]
+    if unknown:
+        return jsonify({"error": f"unknown severity: {', '.join(unknown)}", "allowed": list(SEVERITIES)}), 400
+    try:
+        store = get_findings_store()
+        findings_key = store.resolve(image_key)
+        if findings_key is None:
+            digest = resolve_image_digest(image_key)
+            findings_key = store.resolve(digest) if digest else None
+        if findings_key is None:
+            return jsonify({"error": "no scan results for image", "image": image_key}), 404
+        items, next_cursor, total = store.page(findings_key, severities=severities, pkg=request.args.get("pkg"),
+                                               cursor=request.args.get("cursor"), limit=limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception("reading vulnerabilities for %s failed", image_key)
+        return jsonify({"error": str(e)}), 500
+    return jsonify({
+        "image": image_key,
+        "scan": store.scan_info(findings_key),
+        "total": total,
+        "items": items,
+        "next_cursor": next_cursor,
+    }), 200
+
+
 @system_bp.route("/api/daemon-status", methods=["GET"])
 def daemon_status():
     start_time = current_app.config.get("START_TIME")
@@ -59,9 +128,7 @@ def daemon_status():
         docker_info = {"error": str(e)}
 
     try:
-        if os.path.exists(ALERTS_FILE):
-            with open(ALERTS_FILE, "r", encoding="utf-8") as f:
-                alerts_count = sum(1 for _ in f)
+        alerts_count = get_store(ALERTS_FILE).count()
     except Exception as e:
         alerts_count = f"error: {e}"
 
@@ -202,14 +269,17 @@ def get_dashboard():
         docker_ok = False
         docker_info = {}
         containers_list = []
-        alerts_list = []
+        recent_alerts = []
+        critical_alerts = 0
+        high_alerts = 0
+        unresolved_alerts = 0
 
         try:
             client_instance = _get_docker_client()
             if client_instance:
                 docker_info = client_instance.version()
                 docker_ok = True
-                containers_list = client_instance.containers.list(all=True)
+                containers_list = get_container_inventory().containers(include_all=True)
             else:
                 docker_info = {"error": "Docker client unavailable"}
         except Exception as e:
@@ -217,15 +287,13 @@ def get_dashboard():
             docker_info = {"error": str(e)}
 
         try:
-            if os.path.exists(ALERTS_FILE):
-                with open(ALERTS_FILE, "r", encoding="utf-8") as f:
-                    for line in f:
-                        try:
-                            alerts_list.append(json.loads(line))
-                        except Exception:
-                            continue
-            alerts_list = list(reversed(alerts_list))
-            alerts_list = deduplicate_alerts(alerts_list)
+            # Recent alerts only need the tail of the newest segment
+            recent_alerts = list(islice(iter_unique_alerts(iter_alerts_newest(ALERTS_FILE)), 10))
+            # Summary counts come from the store's incrementally maintained counters
+            counts = get_store(ALERTS_FILE).summary()
+            critical_alerts = counts["critical"]
+            high_alerts = counts["high"]
+            unresolved_alerts = counts["unresolved"]
         except Exception as e:
             logging.warning(f"Failed to read alerts: {e}")
 
@@ -236,10 +304,11 @@ def get_dashboard():
         running_count = 0
         stopped_count = 0
 
+        # Stats of all running containers (sampler memory, or one bounded concurrent fetch)
+        all_stats = collect_container_stats([c.id for c in containers_list if c.running])
         for container in containers_list:
             try:
-                state = container.attrs.get("State", {})
-                status = "running" if state.get("Running") else "stopped"
+                status = "running" if container.running else "stopped"
                 if status == "running":
                     running_count += 1
                 else:
@@ -248,42 +317,34 @@ def get_dashboard():
                 cpu_percent = 0
                 memory_mb = 0
                 memory_limit_mb = 256
-                if state.get("Running"):
-                    try:
-                        stats = container.stats(stream=False)
-                        cpu_delta = stats["cpu_stats"]["cpu_usage"]["total_usage"] - stats["precpu_stats"].get("cpu_usage", {}).get("total_usage", 0)
-                        system_delta = stats["cpu_stats"]["system_cpu_usage"] - stats["precpu_stats"].get("system_cpu_usage", 0)
-                        cpu_percent = (cpu_delta / system_delta * 100) if system_delta > 0 else 0
-                        memory_mb = stats["memory_stats"].get("usage", 0) / (1024 * 1024)
-                        memory_limit_mb = stats["memory_stats"].get("limit", 256 * 1024 * 1024) / (1024 * 1024)
-                    except Exception as e:
-                        logging.debug(f"Could not get stats for {container.name}: {e}")
+                stats = all_stats.get(container.id)
+                if stats:
+                    cpu_percent = stats["cpu_percent"]
+                    memory_mb = stats["memory_bytes"] / (1024 * 1024)
+                    memory_limit_mb = (stats["memory_limit_bytes"] or 256 * 1024 * 1024) / (1024 * 1024)
 
                 cpu_total += cpu_percent
                 memory_total += memory_mb
                 memory_limit_total += memory_limit_mb
 
                 container_stats.append({
-                    "id": container.id[:12],
+                    "id": container.short_id,
                     "name": container.name,
                     "status": status,
-                    "image": container.image.tags[0] if container.image.tags else "unknown",
+                    "image": container.image,
                     "cpu": round(cpu_percent, 2),
                     "memory": round(memory_mb, 2),
                     "memoryLimit": round(memory_limit_mb, 2),
                     "uptime": uptime,
-                    "network": {"rx": 0, "tx": 0},
+                    "network": {"rx": stats["rx_bytes"] if stats else 0, "tx": stats["tx_bytes"] if stats else 0},
+                    "stale": bool(stats and stats["stale"]),
                 })
             except Exception as e:
                 logging.debug(f"Error processing container: {e}")
                 continue
 
-        critical_alerts = sum(1 for a in alerts_list if a.get("severity") == "critical")
-        high_alerts = sum(1 for a in alerts_list if a.get("severity") == "high")
-        unresolved_alerts = sum(1 for a in alerts_list if a.get("status") != "resolved")
-
         normalized_alerts = []
-        for alert in alerts_list[:10]:
+        for alert in recent_alerts:
             alert = dict(alert)
             alert["timestamp"] = alert.get("timestamp") or alert.get("log_time") or ""
             alert = ensure_alert_has_id(alert)
@@ -335,8 +396,7 @@ def restart_daemon():
         ALERTS_FILE = current_app.config.get("ALERTS_FILE")
         if ALERTS_FILE:
             try:
-                with open(ALERTS_FILE, "a", encoding="utf-8") as f:
-                    f.write(json.dumps(audit_entry) + "\n")
+                get_store(ALERTS_FILE).append(audit_entry)
             except Exception as e:
                 logging.warning(f"Could not write audit entry for daemon restart: {e}")
         
@@ -382,8 +442,7 @@ def stop_daemon():
         ALERTS_FILE = current_app.config.get("ALERTS_FILE")
         if ALERTS_FILE:
             try:
-                with open(ALERTS_FILE, "a", encoding="utf-8") as f:
-                    f.write(json.dumps(audit_entry) + "\n")
+                get_store(ALERTS_FILE).append(audit_entry)
             except Exception as e:
                 logging.warning(f"Could not write audit entry for daemon stop: {e}")
         
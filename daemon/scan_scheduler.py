@@ -0,0 +1,155 @@
+"""
+Asynchronous image-scan scheduler with priority lanes.
+
+Scans are queued instead of run on the caller's thread (the Docker event
+loop used to block on every Trivy run). Workers always take the next job
+from the highest-priority non-empty lane:
+
+  gate        admission checks for `create` in enforce mode
+  enrichment  post-start / alert enrichment scans
+  background  pre-scans and rescans (e.g. on image pull)
+
+A request for an image that is already queued returns the queued job's
+future; if it comes from a higher-priority lane the job is promoted.
+
+Lanes are ordered, not preemptive: a running scan is never interrupted. So
+that a gate scan never waits behind long enrichment or background scans, those
+two lanes together occupy at most `shared_workers` workers (default
+workers - 1); the rest are kept for the gate lane.
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Optional
+
+from latency import LATENCY_SAMPLES, latency_summary
+
+log = logging.getLogger(__name__)
+
+# Highest priority first
+LANES = ("gate", "enrichment", "background")
+
+
+class ScanJob:
+    __slots__ = ("key", "image_ref", "image_id", "lane", "future", "enqueued_at")
+
+    def __init__(self, key: str, image_ref: str, image_id: Optional[str], lane: str):
+        self.key = key
+        self.image_ref = image_ref
+        self.image_id = image_id
+        self.lane = lane
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class ScanScheduler:
+    """Worker pool running `scan_fn(image_ref, image_id)` for queued jobs, lane by lane."""
+
+    def __init__(self, scan_fn: Callable[[str, Optional[str]], Optional[Dict]], workers: int = 2,
+                 shared_workers: Optional[int] = None):
+        self.scan_fn = scan_fn
+        self.workers = max(1, int(workers))
+        # With a single worker nothing can be reserved; the gate lane still goes first
+        if shared_workers is None:
+            shared_workers = self.workers - 1
+        self.shared_workers = max(1, min(int(shared_workers), self.workers))
+        self._cond = threading.Condition()
+        self._lanes: Dict[str, Deque[ScanJob]] = {lane: deque() for lane in LANES}
+        self._pending: Dict[str, ScanJob] = {}
+        self._busy = 0
+        self._busy_shared = 0      # workers running enrichment / background jobs
+        self._threads = []
+        self._metrics = {
+            lane: {
+                "submitted": 0, "deduplicated": 0, "promoted": 0, "completed": 0, "failed": 0,
+                "wait_ms": deque(maxlen=LATENCY_SAMPLES), "run_ms": deque(maxlen=LATENCY_SAMPLES),
+            }
+            for lane in LANES
+        }
+
+    def submit(self, image_ref: str, image_id: Optional[str] = None, lane: str = "background") -> Future:
+        """Queue a scan; the future resolves to the scan summary (None if the scan failed)."""
+        if lane not in LANES:
+            raise ValueError(f"unknown scan lane {lane!r}")
+        key = image_id or image_ref
+        with self._cond:
+            metrics = self._metrics[lane]
+            metrics["submitted"] += 1
+            job = self._pending.get(key)
+            if job is not None:
+                metrics["deduplicated"] += 1
+                if LANES.index(lane) < LANES.index(job.lane):
+                    self._lanes[job.lane].remove(job)
+                    job.lane = lane
+                    self._lanes[lane].append(job)
+                    metrics["promoted"] += 1
+                return job.future
+            job = ScanJob(key, image_ref, image_id, lane)
+            self._pending[key] = job
+            self._lanes[lane].append(job)
+            self._cond.notify()
+            return job.future
+
+    def _next(self) -> ScanJob:
+        with self._cond:
+            while True:
+                for lane in LANES:
+                    if not self._lanes[lane]:
+                        continue
+                    shared = lane != "gate"
+                    if shared and self._busy_shared >= self.shared_workers:
+                        break   # lower lanes share the same cap
+                    job = self._lanes[lane].popleft()
+                    self._pending.pop(job.key, None)
+                    self._busy += 1
+                    self._busy_shared += shared
+                    return job
+                self._cond.wait()
+
+    def _work(self) -> None:
+        while True:
+            job = self._next()
+            started = time.monotonic()
+            ok = True
+            try:
+                job.future.set_result(self.scan_fn(job.image_ref, job.image_id))
+            except Exception as e:
+                ok = False
+                log.exception("Scan of %s failed", job.image_ref)
+                job.future.set_exception(e)
+            finished = time.monotonic()
+            with self._cond:
+                self._busy -= 1
+                if job.lane != "gate":
+                    self._busy_shared -= 1
+                    # A worker idling at the shared cap may take the next queued job now
+                    self._cond.notify()
+                metrics = self._metrics[job.lane]
+                metrics["completed" if ok else "failed"] += 1
+                metrics["wait_ms"].append((started - job.enqueued_at) * 1000)
+                metrics["run_ms"].append((finished - started) * 1000)
+
+    def start(self) -> "ScanScheduler":
+        with self._cond:
+            if not self._threads:
+                for n in range(self.workers):
+                    t = threading.Thread(target=self._work, name=f"scan-worker-{n}", daemon=True)
+                    t.start()
+                    self._threads.append(t)
+        return self
+
+    def stats(self) -> Dict:
+        with self._cond:
+            lanes = {}
+            for lane in LANES:
+                m = self._metrics[lane]
+                lanes[lane] = {
+                    "depth": len(self._lanes[lane]),
+                    **{k: v for k, v in m.items() if not k.endswith("_ms")},
+                    "wait_ms": latency_summary(list(m["wait_ms"])),
+                    "run_ms": latency_summary(list(m["run_ms"])),
+                }
+            return {"workers": self.workers, "shared_workers": self.shared_workers, "busy_workers": self._busy,
+                    "lanes": lanes}
@@ -0,0 +1,378 @@
+"""
+SQLite backend for the alert and audit logs (ALERTS_BACKEND=sqlite).
+
+SqliteAlertStore exposes the same methods as alerts_store.AlertStore, so
+alerts_store.get_store() can hand out either one. Filtering, counting and
+paging become indexed SQL queries instead of loops over JSON lines.
+
+Run this module directly to import existing alerts.jsonl / audits.jsonl:
+
+    python sqlite_store.py --alerts /app/alerts/alerts.jsonl --audits /app/alerts/audits.jsonl
+"""
+import os
+import re
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Optional, Iterator, Tuple
+
+import alerts_store
+from alerts_store import FILTER_FIELDS, alert_field, decode_cursor, take_page, parse_timestamp, submit_append, _SUFFIXED_ID_RE
+from alert_counters import AlertCounters
+
+log = logging.getLogger(__name__)
+
+# Defaults to daemon.db next to the alerts file
+ALERTS_DB = os.environ.get("ALERTS_DB")
+
+# Rows fetched per round trip when streaming results
+FETCH_BATCH = 500
+
+_COLUMNS = ("id", "timestamp") + FILTER_FIELDS
+
+_CONNECTIONS: Dict[str, Tuple[sqlite3.Connection, threading.RLock]] = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
+
+def default_db_path(file_path: str) -> str:
+    return ALERTS_DB or os.path.join(os.path.dirname(file_path) or ".", "daemon.db")
+
+
+def connect(db_path: str) -> Tuple[sqlite3.Connection, threading.RLock]:
+    """One WAL-mode connection per database file, shared by every store that uses it."""
+    key = os.path.abspath(db_path)
+    with _CONNECTIONS_LOCK:
+        if key not in _CONNECTIONS:
+            os.makedirs(os.path.dirname(key), exist_ok=True)
+            conn = sqlite3.connect(key, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _CONNECTIONS[key] = (conn, threading.RLock())
+        return _CONNECTIONS[key]
+
+
+def _normalize_ts(value: Optional[str]) -> Optional[str]:
+    ts = parse_timestamp(value)
+    return ts.astimezone(timezone.utc).isoformat() if ts else None
+
+
+class SqliteAlertStore:
+    """
+    Alert store backed by one table per log file (alerts.jsonl -> "alerts",
+    audits.jsonl -> "audits") in a shared SQLite database. Rows keep the full
+    JSON body plus indexed columns for id, timestamp, severity, status, source,
+    rule, container id and image. Re-appending an existing id replaces the row,
+    mirroring how the JSONL store keeps only the newest record per id.
+    """
+
+    def __init__(self, file_path: str, db_path: Optional[str] = None, settings: Optional[Dict] = None):
+        self.file_path = file_path
+        self.db_path = db_path or default_db_path(file_path)
+        self.table = re.sub(r"\W", "_", os.path.splitext(os.path.basename(file_path))[0]) or "alerts"
+        self.settings = dict(settings or {})
+        self._conn, self._lock = connect(self.db_path)
+        self.counters = AlertCounters()
+        self._counters_loaded = False
+        self._writer = None
+        self._ensure_schema()
+
+    def _ensure_schema(self) -> None:
+        t = self.table
+        with self._lock:
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS "{t}" (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT UNIQUE,
+                    timestamp TEXT,
+                    severity TEXT COLLATE NOCASE,
+                    status TEXT COLLATE NOCASE,
+                    source TEXT COLLATE NOCASE,
+                    rule TEXT COLLATE NOCASE,
+                    container_id TEXT COLLATE NOCASE,
+                    image TEXT COLLATE NOCASE,
+                    body TEXT NOT NULL
+                )""")
+            for col in ("timestamp",) + FILTER_FIELDS:
+                self._conn.execute(f'CREATE INDEX IF NOT EXISTS "{t}_{col}" ON "{t}"({col})')
+
+    def _row(self, rec: Dict) -> Tuple:
+        values = [rec.get("id") or None, _normalize_ts(alert_field(rec, "timestamp"))]
+        values += [alert_field(rec, name) for name in FILTER_FIELDS]
+        return tuple(values) + (json.dumps(rec),)
+
+    def _where(self, filters: Optional[Dict]) -> Tuple[str, List]:
+        clauses, params = [], []
+        for name in FILTER_FIELDS:
+            wanted = (filters or {}).get(name)
+            if not wanted:
+                continue
+            if name == "container_id":
+                clauses.append("container_id LIKE ? ESCAPE '\\'")
+                params.append(re.sub(r"([%_\\])", r"\\\1", str(wanted)) + "%")
+            else:
+                clauses.append(f"{name} = ?")
+                params.append(str(wanted))
+        for key, op in (("since", ">="), ("until", "<=")):
+            value = (filters or {}).get(key)
+            if value:
+                clauses.append(f"timestamp {op} ?")
+                params.append(value.astimezone(timezone.utc).isoformat())
+        return (" AND ".join(clauses) or "1=1"), params
+
+    def _insert(self, rec: Dict) -> None:
+        placeholders = ", ".join("?" * (len(_COLUMNS) + 1))
+        self._conn.execute(
+            f'INSERT OR REPLACE INTO "{self.table}" ({", ".join(_COLUMNS)}, body) VALUES ({placeholders})',
+            self._row(rec),
+        )
+
+    def _load_counters(self) -> None:
+        """Rebuild the in-memory counters from the indexed columns (no JSON parsing)."""
+        self.counters.reset()
+        rows = self._conn.execute(
+            f'SELECT id, severity, status, source, rule FROM "{self.table}" WHERE id IS NOT NULL'
+        ).fetchall()
+        for aid, severity, status, source, rule in rows:
+            self.counters.observe({"id": aid, "severity": severity, "status": status, "source": source, "rule": rule})
+        self._counters_loaded = True
+
+    def _iter(self, filters: Optional[Dict], newest_first: bool) -> Iterator[Dict]:
+        for _seq, rec in self._iter_rows(filters, newest_first):
+            yield rec
+
+    def _iter_rows(self, filters: Optional[Dict], newest_first: bool, last: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+        """Stream (seq, record) pairs in keyset-paged batches, starting after seq `last`."""
+        where, params = self._where(filters)
+        order, cmp = ("DESC", "<") if newest_first else ("ASC", ">")
+        while True:
+            sql = f'SELECT seq, body FROM "{self.table}" WHERE {where}'
+            args = list(params)
+            if last is not None:
+                sql += f" AND seq {cmp} ?"
+                args.append(last)
+            sql += f" ORDER BY seq {order} LIMIT {FETCH_BATCH}"
+            # Fetch a batch under the lock, then yield without holding it
+            with self._lock:
+                rows = self._conn.execute(sql, args).fetchall()
+            for seq, body in rows:
+                last = seq
+                try:
+                    yield seq, json.loads(body)
+                except Exception:
+                    continue
+            if len(rows) < FETCH_BATCH:
+                return
+
+    # ---- AlertStore-compatible API ----
+
+    def resolve_id(self, alert_id: str) -> Optional[str]:
+        """Map an exact ID, or a frontend-suffixed ID like "<id>-1", to a stored alert ID."""
+        candidates = [alert_id]
+        match = _SUFFIXED_ID_RE.match(alert_id or "")
+        if match:
+            candidates.append(match.group(1))
+        with self._lock:
+            for cand in candidates:
+                if self._conn.execute(f'SELECT 1 FROM "{self.table}" WHERE id = ?', (cand,)).fetchone():
+                    return cand
+        return None
+
+    def get(self, alert_id: str) -> Optional[Dict]:
+        with self._lock:
+            aid = self.resolve_id(alert_id)
+            if aid is None:
+                return None
+            row = self._conn.execute(f'SELECT body FROM "{self.table}" WHERE id = ?', (aid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def append(self, alert: Dict) -> None:
+        self.append_async(alert).result()
+
+    def append_async(self, alert: Dict) -> Future:
+        return submit_append(self, alert)
+
+    def _write_batch(self, records: List[Dict]) -> List[Optional[BaseException]]:
+        """Insert a group-commit batch in one transaction; returns one error (or None) per record."""
+        errors: List[Optional[BaseException]] = [None] * len(records)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for i, rec in enumerate(records):
+                    try:
+                        self._insert(rec)
+                    except (TypeError, ValueError, sqlite3.IntegrityError) as e:
+                        errors[i] = e
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if self._counters_loaded:
+                for rec, error in zip(records, errors):
+                    if error is None:
+                        self.counters.observe(rec)
+        return errors
+
+    def update(self, alert_id: str, fields: Dict) -> Optional[Dict]:
+        """Merge `fields` into an alert in place. Returns the updated alert, or None if unknown."""
+        with self._lock:
+            aid = self.resolve_id(alert_id)
+            if aid is None:
+                return None
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(f'SELECT body FROM "{self.table}" WHERE id = ?', (aid,)).fetchone()
+                if row is None:
+                    self._conn.execute("ROLLBACK")
+                    return None
+                rec = json.loads(row[0])
+                rec.update(fields)
+                values = self._row(rec)
+                assignments = ", ".join(f"{c} = ?" for c in _COLUMNS[1:]) + ", body = ?"
+                self._conn.execute(
+                    f'UPDATE "{self.table}" SET {assignments} WHERE id = ?',
+                    values[1:] + (aid,),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if self._counters_loaded:
+                self.counters.apply(aid, fields)
+            return rec
+
+    def iter_newest(self, filters: Optional[Dict] = None) -> Iterator[Dict]:
+        return self._iter(filters, newest_first=True)
+
+    def iter_newest_positioned(self, filters: Optional[Dict] = None, position: Optional[Dict] = None) -> Iterator[Tuple[Dict, Dict]]:
+        last = None
+        if position:
+            last = position.get("q")
+            if not isinstance(last, int):
+                raise ValueError("invalid cursor")
+        for seq, rec in self._iter_rows(filters, newest_first=True, last=last):
+            yield {"q": seq}, rec
+
+    def page(self, filters: Optional[Dict] = None, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        return take_page(self.iter_newest_positioned(filters, decode_cursor(cursor)), limit)
+
+    def iter_oldest(self) -> Iterator[Dict]:
+        return self._iter(None, newest_first=False)
+
+    def read_all(self) -> List[Dict]:
+        return list(self.iter_oldest())
+
+    def write_all(self, alerts: List[Dict]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(f'DELETE FROM "{self.table}"')
+                for rec in alerts:
+                    self._insert(rec)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._counters_loaded = False
+
+    def append_many(self, alerts) -> int:
+        """Insert records in one transaction; used by the migrator."""
+        n = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for rec in alerts:
+                    self._insert(rec)
+                    n += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._counters_loaded = False
+        return n
+
+    def count(self, filters: Optional[Dict] = None) -> int:
+        where, params = self._where(filters)
+        if not filters:
+            # Like AlertStore.count: alerts only, not audit lines kept in the same table
+            where = "id IS NOT NULL"
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM "{self.table}" WHERE {where}', params).fetchone()[0]
+
+    def rows(self) -> int:
+        """Every row in the table, audit lines included."""
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM "{self.table}"').fetchone()[0]
+
+    def summary(self) -> Dict:
+        """Alert counts by severity/status/source/rule, kept in memory after the first call."""
+        with self._lock:
+            if not self._counters_loaded:
+                self._load_counters()
+            return self.counters.summary()
+
+    def stats(self) -> Dict:
+        rows = self.rows()
+        try:
+            size = os.path.getsize(self.db_path)
+        except OSError:
+            size = 0
+        return {"lines": rows, "live": rows, "dead": 0, "size_bytes": size, "growth_bytes": 0, "segments": 1}
+
+    def should_compact(self, *_args, **_kwargs) -> bool:
+        # Rows are updated in place; SQLite reclaims space on its own
+        return False
+
+    def compact(self) -> bool:
+        return False
+
+    def apply_retention(self, now: Optional[datetime] = None) -> None:
+        """Delete rows older than `delete_after_days` (compression does not apply to SQLite)."""
+        delete_days = float(self.settings.get("delete_after_days") or 0)
+        if not delete_days:
+            return
+        cutoff = ((now or datetime.now(timezone.utc)) - timedelta(days=delete_days)).isoformat()
+        with self._lock:
+            cur = self._conn.execute(f'DELETE FROM "{self.table}" WHERE timestamp < ?', (cutoff,))
+            if cur.rowcount:
+                self._counters_loaded = False
+        if cur.rowcount:
+            log.info("Deleted %d expired rows from %s", cur.rowcount, self.table)
+
+
+def migrate_jsonl(paths: List[str], db_path: Optional[str] = None, force: bool = False) -> Dict[str, int]:
+    """
+    One-shot import of JSONL logs (including rotated segments and status
+    deltas) into SQLite. Tables that already contain rows are skipped unless
+    `force` is set. Returns the number of rows imported per file.
+    """
+    imported = {}
+    for path in paths:
+        if not os.path.exists(path) and not os.path.isdir(f"{os.path.splitext(path)[0]}.segments"):
+            log.info("Nothing to import from %s", path)
+            imported[path] = 0
+            continue
+        target = SqliteAlertStore(path, db_path=db_path)
+        if target.rows() and not force:
+            log.warning("Table %s already has rows; skipping %s (use --force to import anyway)", target.table, path)
+            imported[path] = 0
+            continue
+        source = alerts_store.AlertStore(path, read_only=True)
+        imported[path] = target.append_many(source.iter_oldest())
+        log.info("Imported %d records from %s into %s:%s", imported[path], path, target.db_path, target.table)
+    return imported
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Import alerts.jsonl / audits.jsonl into the SQLite alert backend")
+    parser.add_argument("--alerts", default=os.environ.get("ALERTS_FILE", "/app/alerts/alerts.jsonl"))
+    parser.add_argument("--audits", default=os.environ.get("AUDIT_FILE", "/app/alerts/audits.jsonl"))
+    parser.add_argument("--db", default=None, help="database path (default: ALERTS_DB or daemon.db next to the alerts file)")
+    parser.add_argument("--force", action="store_true", help="import even if the target tables are not empty")
+    args = parser.parse_args()
+    db = args.db or default_db_path(args.alerts)
+    migrate_jsonl([args.alerts, args.audits], db_path=db, force=args.force)
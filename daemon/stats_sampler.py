@@ -0,0 +1,214 @@
+"""
+Background container stats sampler.
+
+Each running container gets one thread reading `stats(stream=True)`; Docker
+pushes a sample about once a second over the open connection, so the cost on
+dockerd no longer grows with the number of API clients polling the container
+list or dashboard. The latest sample of every container is kept in memory,
+plus a fixed-size ring buffer of one sample per `interval_seconds` covering
+`history_seconds`, stored in typed arrays (a few KB per container).
+
+Containers are tracked from the Docker event stream (start / die / destroy)
+and from the running set at startup; sync() drops or adds containers to match
+an authoritative list.
+
+At most `max_streams` containers are streamed at once (each stream is a thread
+and an open dockerd connection). Containers beyond the cap are listed by
+unsampled(); callers fetch their stats through the pooled StatsCollector
+instead. They take over a stream slot, oldest first, as streamed containers
+go away.
+"""
+import time
+import logging
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from container_stats import EMPTY_SAMPLE, parse_stats
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "interval_seconds": 5,     # spacing of points in the history ring
+    "history_seconds": 900,    # history kept per container (15 min)
+    "max_streams": 100,        # containers streamed at once (0 = no limit); the rest use the collector
+}
+
+SERIES = ("cpu_percent", "memory_bytes", "rx_bytes", "tx_bytes")
+
+
+class Ring:
+    """Fixed-capacity history of one container: a timestamp array plus one array per series."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self.head = 0   # next slot to write
+        self.ts = array("d", bytes(8 * capacity))
+        self.series = {name: array("d", bytes(8 * capacity)) for name in SERIES}
+
+    def push(self, ts: float, sample: Dict) -> None:
+        self.ts[self.head] = ts
+        for name, values in self.series.items():
+            values[self.head] = sample.get(name) or 0
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def points(self, since: Optional[float] = None) -> Dict[str, List[float]]:
+        """Oldest first; only points newer than `since` if given."""
+        start = (self.head - self.size) % self.capacity
+        order = [(start + i) % self.capacity for i in range(self.size)]
+        if since is not None:
+            order = [i for i in order if self.ts[i] > since]
+        out = {"t": [self.ts[i] for i in order]}
+        for name, values in self.series.items():
+            out[name] = [values[i] for i in order]
+        return out
+
+
+class _Tracked:
+    __slots__ = ("cid", "ring", "latest", "last_push", "thread", "stopped")
+
+    def __init__(self, cid: str, capacity: int):
+        self.cid = cid
+        self.ring = Ring(capacity)
+        self.latest: Optional[Dict] = None
+        self.last_push = 0.0
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = False
+
+
+class StatsSampler:
+    def __init__(self, client_factory, enabled: bool = True, interval_seconds: float = 5,
+                 history_seconds: float = 900, max_streams: int = 100):
+        self.client_factory = client_factory
+        self.enabled = bool(enabled)
+        self.interval = max(1.0, float(interval_seconds))
+        self.capacity = max(1, int(float(history_seconds) // self.interval))
+        self.max_streams = max(0, int(max_streams))
+        self._lock = threading.Lock()
+        self._tracked: Dict[str, _Tracked] = {}
+        self._overflow: Dict[str, None] = {}   # running containers past max_streams, oldest first
+        self._counters = {"samples": 0, "streams_started": 0, "stream_errors": 0}
+        self._running = False
+
+    def start(self) -> None:
+        """Track every running container; later changes arrive through track() / untrack()."""
+        if not self.enabled:
+            return
+        self._running = True
+        try:
+            running = self.client_factory().api.containers(quiet=True)
+        except Exception as e:
+            log.warning("Stats sampler could not list containers: %s", e)
+            return
+        for c in running:
+            self.track(c["Id"])
+
+    def track(self, cid: str) -> None:
+        if not self._running or not cid:
+            return
+        with self._lock:
+            entry = self._tracked.get(cid)
+            if entry is None:
+                if self.max_streams and len(self._tracked) >= self.max_streams:
+                    self._overflow[cid] = None
+                    return
+                self._overflow.pop(cid, None)
+                entry = self._tracked[cid] = _Tracked(cid, self.capacity)
+            elif entry.thread is not None and entry.thread.is_alive():
+                return
+            entry.stopped = False
+            entry.thread = threading.Thread(target=self._stream, args=(entry,),
+                                            name=f"stats-{cid[:12]}", daemon=True)
+            self._counters["streams_started"] += 1
+        entry.thread.start()
+
+    def untrack(self, cid: str) -> None:
+        """Stop sampling a container and drop its history (its stream ends with the container)."""
+        with self._lock:
+            entry = self._tracked.pop(cid, None)
+            self._overflow.pop(cid, None)
+            promote = next(iter(self._overflow), None) if entry is not None else None
+        if entry is not None:
+            entry.stopped = True
+        if promote is not None:
+            # The freed slot goes to the container waiting longest
+            self.track(promote)
+
+    def sync(self, running_ids: Iterable[str]) -> None:
+        """Make the tracked set match the running containers (catches missed events)."""
+        running = set(running_ids)
+        with self._lock:
+            gone = [cid for cid in list(self._tracked) + list(self._overflow) if cid not in running]
+            dead = [cid for cid in running if cid not in self._overflow and (cid not in self._tracked
+                    or not (self._tracked[cid].thread and self._tracked[cid].thread.is_alive()))]
+        for cid in gone:
+            self.untrack(cid)
+        for cid in dead:
+            self.track(cid)
+
+    def _stream(self, entry: _Tracked) -> None:
+        try:
+            for raw in self.client_factory().api.stats(entry.cid, stream=True, decode=True):
+                if entry.stopped:
+                    return
+                if not raw.get("read") or raw.get("read", "").startswith("0001-"):
+                    continue   # final sample of a stopped container
+                now = time.time()
+                sample = dict(parse_stats(raw), sampled_at=now)
+                with self._lock:
+                    entry.latest = sample
+                    self._counters["samples"] += 1
+                    if now - entry.last_push >= self.interval:
+                        entry.ring.push(now, sample)
+                        entry.last_push = now
+        except Exception as e:
+            if not entry.stopped:
+                log.debug("Stats stream for %s ended: %s", entry.cid[:12], e)
+                with self._lock:
+                    self._counters["stream_errors"] += 1
+
+    def unsampled(self, cids: Iterable[str]) -> List[str]:
+        """Those of `cids` left without a stream by max_streams."""
+        with self._lock:
+            return [cid for cid in cids if cid in self._overflow]
+
+    def latest(self, cids: Iterable[str]) -> Dict[str, Dict]:
+        """Last sample by container id, "stale": True when none arrived within two intervals."""
+        now = time.time()
+        out = {}
+        with self._lock:
+            for cid in cids:
+                entry = self._tracked.get(cid)
+                sample = entry.latest if entry else None
+                stale = sample is None or now - sample["sampled_at"] > 2 * self.interval
+                out[cid] = dict(sample or EMPTY_SAMPLE, stale=stale)
+        return out
+
+    def history(self, cid: str, since: Optional[float] = None) -> Optional[Dict]:
+        with self._lock:
+            entry = self._tracked.get(cid)
+            if entry is None:
+                return None
+            return {
+                "id": cid,
+                "interval_seconds": self.interval,
+                "history_seconds": self.interval * self.capacity,
+                "latest": entry.latest,
+                "points": entry.ring.points(since),
+            }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "containers": len(self._tracked),
+                "streams": sum(1 for e in self._tracked.values() if e.thread and e.thread.is_alive()),
+                "max_streams": self.max_streams,
+                "unsampled": len(self._overflow),
+                "interval_seconds": self.interval,
+                "history_points": self.capacity,
+                **self._counters,
+            }
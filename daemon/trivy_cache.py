@@ -0,0 +1,224 @@
+"""
+Persistent Trivy result cache.
+
+Scan summaries are keyed by image digest and Trivy vulnerability-DB version,
+so a result stays valid across daemon restarts and is retired automatically
+when the DB updates. They are also stored under the ChainID of the image's
+layer stack, so an image that differs only in its config (new labels, build
+timestamp, entrypoint) reuses the result of one with identical layers. Reuse
+is all-or-nothing per layer stack: an image with any new layer is scanned in
+full. Each entry is one small JSON file under the cache directory; the file mtime doubles as the LRU timestamp, so recency survives
+restarts too. Entries expire after `ttl_seconds` and the least recently used
+ones are evicted once the cache exceeds `max_entries` or `max_bytes`.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import Dict, Optional
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "dir": "/app/alerts/trivy-cache",
+    "max_entries": 500,
+    "max_mb": 64,
+}
+
+# How often the Trivy DB version is re-read (the DB itself updates every few hours)
+DB_VERSION_TTL_SECONDS = 600
+
+_DB_VERSION: Dict = {"value": None, "checked": 0.0}
+_DB_VERSION_LOCK = threading.Lock()
+
+
+def chain_id(diff_ids) -> Optional[str]:
+    """
+    OCI ChainID of a layer stack (RootFS.Layers, bottom first): identifies the
+    assembled filesystem independently of the image config.
+    """
+    chain = None
+    for diff_id in diff_ids or []:
+        chain = diff_id if chain is None else "sha256:" + hashlib.sha256(f"{chain} {diff_id}".encode("utf-8")).hexdigest()
+    return chain
+
+
+def trivy_db_version(timeout_sec: int = 15, cache_dir: Optional[str] = None) -> str:
+    """UpdatedAt of the local Trivy vulnerability DB ("unknown" if Trivy can't tell)."""
+    with _DB_VERSION_LOCK:
+        now = time.monotonic()
+        if _DB_VERSION["value"] is not None and now - _DB_VERSION["checked"] < DB_VERSION_TTL_SECONDS:
+            return _DB_VERSION["value"]
+        version = "unknown"
+        try:
+            cmd = ["trivy", "version", "--format", "json"] + (["--cache-dir", cache_dir] if cache_dir else [])
+            out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL, timeout=timeout_sec)
+            db = (json.loads(out) or {}).get("VulnerabilityDB") or {}
+            version = str(db.get("UpdatedAt") or db.get("Version") or "unknown")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning("Could not read Trivy DB version: %s", e)
+        _DB_VERSION.update(value=version, checked=now)
+        return version
+
+
+class TrivyCache:
+    """Digest + DB-version keyed scan summaries, persisted as one JSON file per entry."""
+
+    def __init__(self, directory: str, max_entries: int = 500, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 3600):
+        self.directory = directory
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl_seconds = float(ttl_seconds)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()   # key -> entry, least recently used first
+        self._bytes = 0
+        self._loaded = False
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def key(digest: str, db_version: str) -> str:
+        return f"{digest}@{db_version}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _expired(self, entry: Dict, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - float(entry.get("scanned_at") or 0) > self.ttl_seconds
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry["size"]
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning("Could not remove Trivy cache file for %s: %s", key, e)
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._drop(key)
+            self._counters["evictions"] += 1
+
+    def load(self) -> int:
+        """Warm the in-memory index from disk (oldest use first); returns the number of live entries."""
+        with self._lock:
+            if self._loaded:
+                return len(self._entries)
+            found = []
+            try:
+                names = os.listdir(self.directory)
+            except FileNotFoundError:
+                names = []
+            now = time.time()
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                    with open(path, "r", encoding="utf-8") as f:
+                        entry = json.load(f)
+                    entry["size"] = st.st_size
+                    found.append((st.st_mtime, entry))
+                except Exception as e:
+                    log.warning("Dropping unreadable Trivy cache file %s: %s", path, e)
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            for _mtime, entry in sorted(found, key=lambda item: item[0]):
+                key = entry.get("key")
+                if not key:
+                    continue
+                self._entries[key] = entry
+                self._bytes += entry["size"]
+                if self._expired(entry, now):
+                    self._drop(key)
+                    self._counters["expired"] += 1
+            self._evict()
+            self._loaded = True
+            log.info("Trivy cache warmed with %d entries (%d bytes) from %s",
+                     len(self._entries), self._bytes, self.directory)
+            return len(self._entries)
+
+    def get(self, digest: str, db_version: str) -> Optional[Dict]:
+        self.load()
+        key = self.key(digest, db_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if self._expired(entry, time.time()):
+                self._drop(key)
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+        try:
+            # Persist recency for the next warm start
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return entry.get("summary")
+
+    def peek(self, digest: str, db_version: str) -> Optional[Dict]:
+        """Like get, but without touching hit/miss counters or recency."""
+        self.load()
+        with self._lock:
+            entry = self._entries.get(self.key(digest, db_version))
+            if entry is None or self._expired(entry, time.time()):
+                return None
+            return entry.get("summary")
+
+    def put(self, digest: str, db_version: str, summary: Dict, image_ref: Optional[str] = None) -> None:
+        self.load()
+        key = self.key(digest, db_version)
+        entry = {
+            "key": key,
+            "digest": digest,
+            "db_version": db_version,
+            "image_ref": image_ref,
+            "scanned_at": time.time(),
+            "summary": summary,
+        }
+        data = json.dumps(entry).encode("utf-8")
+        path = self._path(key)
+        with self._lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                log.warning("Could not persist Trivy cache entry for %s: %s", key, e)
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)["size"]
+            entry["size"] = len(data)
+            self._entries[key] = entry
+            self._bytes += entry["size"]
+            self._evict()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                **self._counters,
+            }
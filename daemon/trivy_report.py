@@ -0,0 +1,148 @@
+"""
+Incremental reader for `trivy image --format json` reports.
+
+Large images produce tens of MB of JSON, most of it in the Results[].Vulnerabilities
+arrays. Instead of json.loads() on the whole report, the stream is read in chunks:
+the text between vulnerability arrays is only searched for the next "Target" and
+"Vulnerabilities" keys, and each vulnerability object is decoded on its own with
+JSONDecoder.raw_decode. Memory stays bounded by the chunk size plus one finding.
+"""
+import re
+import json
+from typing import Dict, Iterator, Optional, Set, TextIO, Tuple
+
+CHUNK_SIZE = 64 * 1024
+
+SEVERITIES = ("CRITICAL", "HIGH", "MEDIUM", "LOW", "UNKNOWN")
+SEVERITY_RANK = {name: len(SEVERITIES) - i for i, name in enumerate(SEVERITIES)}   # CRITICAL=5 ... UNKNOWN=1
+
+SAMPLE_SIZE = 5
+
+_TARGET_RE = re.compile(r'"Target"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_VULNS_RE = re.compile(r'"Vulnerabilities"\s*:\s*\[')
+_MARKER_RE = re.compile(r'"(SchemaVersion|ArtifactName|Results)"\s*:')
+# Longest key prefix that may be split across two chunks
+_CARRY = 4096
+_WS = " \t\r\n,"
+
+
+def is_report(seen: Set[str]) -> bool:
+    """
+    Whether the report keys found by iter_vulnerabilities() make a real Trivy report:
+    it has Results, or it is a well-formed report with nothing to list. Empty output
+    and error objects are not reports, and must not be taken for a clean scan.
+    """
+    return "Results" in seen or {"SchemaVersion", "ArtifactName"} <= seen
+
+
+def iter_vulnerabilities(stream: TextIO, chunk_size: int = CHUNK_SIZE,
+                         seen: Optional[Set[str]] = None) -> Iterator[Tuple[Optional[str], Dict]]:
+    """
+    Yield (result target, vulnerability object) pairs from a Trivy JSON report stream.
+    Top-level report keys met along the way are added to `seen` (see is_report).
+    """
+    if seen is None:
+        seen = set()
+    decoder = json.JSONDecoder()
+    buf = ""
+    eof = False
+    target = None
+
+    def more() -> bool:
+        nonlocal buf, eof
+        if eof:
+            return False
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf += chunk
+        return True
+
+    while True:
+        # Outside a Vulnerabilities array: look for the next one (and the Target before it)
+        match = _VULNS_RE.search(buf)
+        if match is None:
+            for t in _TARGET_RE.finditer(buf):
+                target = json.loads(f'"{t.group(1)}"')
+            seen.update(m.group(1) for m in _MARKER_RE.finditer(buf))
+            if not more():
+                return
+            if len(buf) > _CARRY + chunk_size:
+                buf = buf[-(_CARRY + chunk_size):]
+            continue
+        for t in _TARGET_RE.finditer(buf, 0, match.start()):
+            target = json.loads(f'"{t.group(1)}"')
+        seen.update(m.group(1) for m in _MARKER_RE.finditer(buf, 0, match.start()))
+        pos = match.end()
+        # Inside the array: decode one object at a time
+        while True:
+            while True:
+                while pos < len(buf) and buf[pos] in _WS:
+                    pos += 1
+                if pos < len(buf) or not more():
+                    break
+            if pos >= len(buf):
+                raise ValueError("truncated Trivy report")
+            if buf[pos] == "]":
+                buf = buf[pos + 1:]
+                break
+            try:
+                vuln, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if more():
+                    continue
+                raise ValueError("truncated Trivy report")
+            yield target, vuln
+            pos = end
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+
+
+def finding_row(target: Optional[str], vuln: Dict) -> Dict:
+    """Compact finding kept in the per-image store."""
+    severity = str(vuln.get("Severity") or "UNKNOWN").upper()
+    return {
+        "id": vuln.get("VulnerabilityID"),
+        "pkg": vuln.get("PkgName"),
+        "ver": vuln.get("InstalledVersion"),
+        "fixed": vuln.get("FixedVersion"),
+        "sev": severity,
+        "target": target,
+        "layer": (vuln.get("Layer") or {}).get("DiffID"),
+        "title": vuln.get("Title"),
+    }
+
+
+class SummaryBuilder:
+    """Accumulates the scan summary (counts, severity and layer breakdown, sample) one finding at a time."""
+
+    def __init__(self):
+        self.count = 0
+        self.high_or_critical = 0
+        self.by_severity = {name: 0 for name in SEVERITIES}
+        self.by_layer: Dict[str, Dict] = {}
+        self.sample = []
+
+    def add(self, row: Dict) -> Dict:
+        self.count += 1
+        severity = row["sev"] if row["sev"] in self.by_severity else "UNKNOWN"
+        self.by_severity[severity] += 1
+        severe = severity in ("HIGH", "CRITICAL")
+        self.high_or_critical += severe
+        # Findings per layer diff ID, to tell base-image vulnerabilities from the app's own
+        layer = self.by_layer.setdefault(row.get("layer") or "unknown", {"count": 0, "high_or_critical": 0})
+        layer["count"] += 1
+        layer["high_or_critical"] += severe
+        if len(self.sample) < SAMPLE_SIZE:
+            self.sample.append({k: row[k] for k in ("id", "pkg", "ver", "sev")})
+        return row
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "high_or_critical": self.high_or_critical,
+            "by_severity": self.by_severity,
+            "sample": self.sample,
+            "by_layer": self.by_layer,
+        }
@@ -0,0 +1,193 @@
+"""
+Supervised local Trivy server.
+
+Every standalone `trivy image` run is a cold start: it opens the
+vulnerability DB and analyzes every layer, even ones another image already
+had analyzed. In server mode the daemon keeps one long-lived `trivy server`
+on loopback and scans go through `trivy image --server`, so the DB is
+loaded once and layer analysis is shared through the server's cache
+directory across images with common base layers.
+
+The supervisor restarts the server with exponential backoff if it exits.
+While it is down, scans fall back to standalone mode against the same
+cache directory. With `offline` set, neither side touches the network:
+the DB in the cache directory must be pre-seeded (e.g. with
+`trivy image --download-db-only --cache-dir <dir>` on a connected host).
+"""
+import time
+import logging
+import threading
+import subprocess
+import urllib.request
+from typing import Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "listen": "127.0.0.1:4954",
+    "cache_dir": None,              # shared DB + layer cache (Trivy's default when unset)
+    "offline": False,               # never download the DB or query online sources
+    "token": None,
+    "startup_timeout_seconds": 60,
+    "restart_backoff_seconds": 5,
+    "max_backoff_seconds": 300,
+}
+
+# A server that stayed up this long resets the restart backoff
+STABLE_SECONDS = 60
+
+OFFLINE_FLAGS = ["--skip-db-update", "--skip-java-db-update", "--offline-scan"]
+
+
+class TrivyServer:
+    """Runs and restarts `trivy server`, and builds the matching `trivy image` command lines."""
+
+    def __init__(self, enabled: bool = False, listen: str = "127.0.0.1:4954", cache_dir: Optional[str] = None,
+                 offline: bool = False, token: Optional[str] = None, startup_timeout: float = 60,
+                 backoff: float = 5, max_backoff: float = 300):
+        self.enabled = bool(enabled)
+        self.listen = listen
+        self.cache_dir = cache_dir
+        self.offline = bool(offline)
+        self.token = token
+        self.startup_timeout = float(startup_timeout)
+        self.backoff = max(0.1, float(backoff))
+        self.max_backoff = max(self.backoff, float(max_backoff))
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._down = threading.Event()      # set while waiting to restart a server that exited
+        self._proc: Optional[subprocess.Popen] = None
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {"starts": 0, "restarts": 0, "server_scans": 0, "standalone_scans": 0}
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.listen}"
+
+    def _common_flags(self) -> List[str]:
+        return ["--cache-dir", self.cache_dir] if self.cache_dir else []
+
+    def server_command(self) -> List[str]:
+        cmd = ["trivy", "server", "--listen", self.listen, *self._common_flags()]
+        if self.offline:
+            cmd.append("--skip-db-update")
+        if self.token:
+            cmd += ["--token", self.token]
+        return cmd
+
+    def image_command(self, image_ref: str) -> List[str]:
+        """`trivy image` argv for one scan: client mode when the server is up, standalone otherwise."""
+        cmd = ["trivy", "image", "--quiet", "--format", "json", *self._common_flags()]
+        if self._starting():
+            # Still loading its DB; a standalone run would block on the same cache files
+            self._ready.wait(self.startup_timeout)
+        use_server = self.enabled and self._ready.is_set()
+        if use_server:
+            cmd += ["--server", self.url]
+            if self.token:
+                cmd += ["--token", self.token]
+        if self.offline:
+            cmd += OFFLINE_FLAGS
+        with self._lock:
+            self._counters["server_scans" if use_server else "standalone_scans"] += 1
+        return cmd + [image_ref]
+
+    def _starting(self) -> bool:
+        with self._lock:
+            alive = self._thread is not None and self._thread.is_alive()
+        return alive and not self._ready.is_set() and not self._down.is_set()
+
+    def _healthy(self) -> bool:
+        try:
+            with urllib.request.urlopen(f"{self.url}/healthz", timeout=1) as resp:
+                return resp.status == 200
+        except Exception:
+            return False
+
+    def _wait_healthy(self, proc: subprocess.Popen) -> bool:
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline and not self._stop.is_set():
+            if proc.poll() is not None:
+                return False
+            if self._healthy():
+                return True
+            time.sleep(0.5)
+        return False
+
+    def _supervise(self) -> None:
+        delay = self.backoff
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                proc = subprocess.Popen(self.server_command(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except FileNotFoundError:
+                log.warning("Trivy binary not found; server mode disabled, scans run standalone")
+                return
+            except Exception as e:
+                log.warning("Could not start trivy server: %s", e)
+                proc = None
+            if proc is not None:
+                with self._lock:
+                    self._proc = proc
+                    self._counters["starts"] += 1
+                if self._wait_healthy(proc):
+                    self._ready.set()
+                    log.info("Trivy server ready on %s", self.url)
+                else:
+                    log.warning("Trivy server on %s did not become healthy within %ss",
+                                self.listen, self.startup_timeout)
+                    proc.terminate()
+                proc.wait()
+                self._ready.clear()
+                with self._lock:
+                    self._proc = None
+                if self._stop.is_set():
+                    return
+                if time.monotonic() - started >= STABLE_SECONDS:
+                    delay = self.backoff
+                log.warning("Trivy server exited (code %s); restarting in %.1fs", proc.returncode, delay)
+            with self._lock:
+                self._counters["restarts"] += 1
+            self._down.set()
+            if self._stop.wait(delay):
+                return
+            self._down.clear()
+            delay = min(delay * 2, self.max_backoff)
+
+    def start(self) -> "TrivyServer":
+        with self._lock:
+            if not self.enabled or self._thread is not None:
+                return self
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._supervise, name="trivy-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        with self._lock:
+            proc = self._proc
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pid = self._proc.pid if self._proc is not None and self._proc.poll() is None else None
+            return {
+                "enabled": self.enabled,
+                "listen": self.listen,
+                "cache_dir": self.cache_dir,
+                "offline": self.offline,
+                "ready": self._ready.is_set(),
+                "pid": pid,
+                **self._counters,
+            }
@@ -8,12 +8,35 @@ import yaml
 from datetime import datetime, timedelta
 import uuid
 import alerts_store
+import sqlite3
+import tempfile
 import threading
+import subprocess
+from concurrent.futures import Future
+from trivy_cache import TrivyCache, trivy_db_version, chain_id, DEFAULT_SETTINGS as TRIVY_CACHE_DEFAULTS
+from single_flight import SingleFlight
+from scan_scheduler import ScanScheduler
+from trivy_server import TrivyServer, DEFAULT_SETTINGS as TRIVY_SERVER_DEFAULTS
+from trivy_report import SummaryBuilder, finding_row, is_report, iter_vulnerabilities
+from findings_store import FindingsStore, DEFAULT_SETTINGS as FINDINGS_DEFAULTS
+from policy import PolicyEvaluator, compile_policy
+from mount_analyzer import MountAnalyzer, mount_settings, parse_mounts
+from container_stats import StatsCollector, DEFAULT_SETTINGS as STATS_DEFAULTS
+from stats_sampler import StatsSampler, DEFAULT_SETTINGS as SAMPLER_DEFAULTS
+from container_inventory import ContainerInventory, DEFAULT_SETTINGS as INVENTORY_DEFAULTS
 
 _CONFIG = None
 _APPROVALS = {}    
-_TRIVY_CACHE = {}  # key -> {"ts": datetime, "summary": dict}
-_TRIVY_TTL_SECONDS = int(os.environ.get("TRIVY_CACHE_TTL", "3600"))
+_TRIVY_CACHE = None  # TrivyCache, created on first use (see get_trivy_cache)
+_TRIVY_CACHE_LOCK = threading.Lock()
+_TRIVY_FLIGHT = SingleFlight()  # one scan per (digest, DB version) at a time; other callers share its result
+_TRIVY_SLOTS = None  # BoundedSemaphore capping concurrent trivy processes (trivy.max_concurrent_scans)
+_SCAN_SCHEDULER = None
+_TRIVY_SERVER = None
+_FINDINGS_STORE = None
+_TAG_DIGESTS = {}  # image tag -> local image id, learned from pull / tag events
+_PRESCAN = {"requested": 0, "reused": 0, "queued": 0}
+_LAYER_REUSE = {"hits": 0, "misses": 0}
 _APPROVALS_LOCK = threading.Lock()
 
 APPROVALS_FILE = os.environ.get("APPROVALS_FILE", "/app/alerts/approvals.jsonl")
@@ -49,24 +72,29 @@ def deduplicate_alerts(alerts: list) -> list:
     This prevents duplicate alerts from being returned to the frontend.
     Also filters out non-alert entries (like audit logs) that may have been mixed in.
     """
+    return list(iter_unique_alerts(alerts))
+
+def iter_unique_alerts(alerts):
+    """Streaming form of deduplicate_alerts: yields each alert the first time its ID is seen."""
     seen = set()
-    unique_alerts = []
     for alert in alerts:
         # Skip entries that are audit logs (have alert_id but not id, or have "action" field)
         if "alert_id" in alert or ("action" in alert and "id" not in alert):
             continue
+        # Skip status delta records written by the alert store
+        if alerts_store.is_delta(alert):
+            continue
             
         alert_id = alert.get("id")
         if alert_id and alert_id not in seen:
             seen.add(alert_id)
-            unique_alerts.append(alert)
+            yield alert
         elif not alert_id:
             # If no ID, ensure it gets one and add it
             alert = ensure_alert_has_id(alert)
             if alert["id"] not in seen:
                 seen.add(alert["id"])
-                unique_alerts.append(alert)
-    return unique_alerts
+                yield alert
 
 def find_alert_by_id_or_base(alerts: list, alert_id: str) -> tuple:
     """
@@ -148,11 +176,24 @@ def approvals_set(image_key: str, approved: bool):
         }
         _save_approvals_to_file()
 
-def policy_should_block(trivy_summary: dict, cfg: dict):
-    if not trivy_summary:
-        return False
-    threshold = int(((cfg.get("trivy") or {}).get("block_if_high_or_critical", 0)))
-    return trivy_summary.get("high_or_critical", 0) >= threshold
+_POLICY = None
+_POLICY_LOCK = threading.Lock()
+
+def get_policy() -> PolicyEvaluator:
+    """Admission policy compiled once from the `policy` section of config.yml."""
+    global _POLICY
+    with _POLICY_LOCK:
+        if _POLICY is None:
+            _POLICY = compile_policy(load_config())
+        return _POLICY
+
+def evaluate_admission(metadata: dict, image_ref: str, image_id: str | None = None, trivy_summary: dict | None = None):
+    """Policy verdict for a created container; full findings are read only if a rule needs them."""
+    def findings():
+        store = get_findings_store()
+        key = (image_id and store.resolve(image_id)) or (image_ref and store.resolve(image_ref))
+        return store.iter_findings(key) if key else iter(())
+    return get_policy().evaluate(metadata, image_ref, trivy_summary, findings)
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -161,16 +202,16 @@ ALERTS_FILE = os.environ.get("ALERTS_FILE", "/app/alerts/alerts.jsonl")
 os.makedirs(os.path.dirname(ALERTS_FILE), exist_ok=True)
 
 DANGEROUS_CAPS = {"SYS_ADMIN", "SYS_PTRACE", "NET_ADMIN"}
-SENSITIVE_PATH_HINTS = [
-    "/var/run/docker.sock",
-    "/etc",
-    "/boot",
-    "/dev",
-    "/lib",
-    "/proc",
-    "/sys",
-    "/usr",
-]
+
+_MOUNT_ANALYZER = None
+
+def get_mount_analyzer() -> MountAnalyzer:
+    """Sensitive-mount matcher for the `mounts` section of config.yml (the policy's mount categories)."""
+    global _MOUNT_ANALYZER
+    with _POLICY_LOCK:
+        if _MOUNT_ANALYZER is None:
+            _MOUNT_ANALYZER = MountAnalyzer(mount_settings(load_config()))
+        return _MOUNT_ANALYZER
 
 def retrieve_all_risks(cid, metadata, image, action):
     hostcfg = metadata.get("HostConfig", {}) or {}
@@ -183,52 +224,12 @@ def retrieve_all_risks(cid, metadata, image, action):
     networks = list((metadata.get("NetworkSettings") or {}).get("Networks") or [])
     env = cfg.get("Env") or []
 
-    risks = []
-
-    if privileged:
-        risks.append({
-            "rule": "Privileged mode enabled",
-            "severity": "high",
-            "description": "Container runs with --privileged flag."
-        })
-
-    for cap in caps:
-        if cap in DANGEROUS_CAPS:
-            risks.append({
-                "rule": f"Dangerous capability {cap}",
-                "severity": "high",
-                "description": f"Capability {cap} may allow host/kernel manipulation."
-            })
-
-    for m in mounts:
-        if "docker.sock" in m:
-            risks.append({
-                "rule": "Docker socket mount",
-                "severity": "critical",
-                "description": "Mounting docker.sock exposes full host control."
-            })
-        for hint in SENSITIVE_PATH_HINTS:
-            if f":{hint}" in m or m.startswith(hint):
-                risks.append({
-                    "rule": f"Sensitive host path mount ({hint})",
-                    "severity": "medium",
-                    "description": f"Container mounts sensitive host path {hint}."
-                })
-                break
-
-    if not user or user in ("0", "root"):
-        risks.append({
-            "rule": "Runs as root",
-            "severity": "medium",
-            "description": "No non-root user configured in container."
-        })
-
-    if secopt and any("seccomp=unconfined" in str(s) for s in secopt):
-        risks.append({
-            "rule": "Unconfined seccomp profile",
-            "severity": "medium",
-            "description": "Container running with unconfined seccomp profile."
-        })
+    # Configuration risks come from the policy's non-CVE rules (vulnerabilities need a scan)
+    decision = get_policy().evaluate(metadata, image, record=False)
+    risks = [
+        {"rule": v["title"], "severity": v["severity"], "description": v["description"]}
+        for v in decision["violations"]
+    ]
 
     container_json = {
         "id": cid,
@@ -282,25 +283,97 @@ def persist_alert(alert_json, file_path=ALERTS_FILE):
         # Ensure timestamp exists
         alert_json.setdefault("timestamp", datetime.utcnow().isoformat() + "Z")
 
-        # Append and compact
+        # Append only; compaction runs in the background (see alerts_store.start_compactor)
         alerts_store.append_alert(alert_json, file_path)
         cid = alert_json.get("container", {}).get("id") or alert_json.get("metadata", {}).get("id")
         log.info("Persisted alert%s to %s", f" for container {cid}" if cid else "", file_path)
-        try:
-            alerts_store.compact_alerts_file(file_path)
-        except Exception:
-            log.exception("Failed to compact alerts file after append")
     except Exception as e:
         log.exception("Failed to persist alert: %s", e)
 
 def persist_alert_line(obj: dict, path: str = ALERTS_FILE):
     persist_alert(obj, path)
 
+_DOCKER_CLIENT = None
+_DOCKER_CLIENT_LOCK = threading.Lock()
+
+def get_docker_client():
+    """Process-wide Docker client, created on first use and shared by background workers."""
+    global _DOCKER_CLIENT
+    with _DOCKER_CLIENT_LOCK:
+        if _DOCKER_CLIENT is None:
+            _DOCKER_CLIENT = docker.from_env()
+        return _DOCKER_CLIENT
+
+_STATS_COLLECTOR = None
+
+def get_stats_collector() -> StatsCollector:
+    """Process-wide container stats collector shared by the container list and dashboard (`containers.stats`)."""
+    global _STATS_COLLECTOR
+    with _DOCKER_CLIENT_LOCK:
+        if _STATS_COLLECTOR is None:
+            cfg = dict(STATS_DEFAULTS)
+            cfg.update({k: v for k, v in ((load_config().get("containers") or {}).get("stats") or {}).items()
+                        if v is not None})
+            _STATS_COLLECTOR = StatsCollector(get_docker_client, workers=cfg["workers"],
+                                              deadline_seconds=cfg["deadline_seconds"])
+        return _STATS_COLLECTOR
+
+_STATS_SAMPLER = None
+
+def get_stats_sampler() -> StatsSampler:
+    """Process-wide background stats sampler (`containers.sampler`); started by the app."""
+    global _STATS_SAMPLER
+    with _DOCKER_CLIENT_LOCK:
+        if _STATS_SAMPLER is None:
+            cfg = dict(SAMPLER_DEFAULTS)
+            cfg.update({k: v for k, v in ((load_config().get("containers") or {}).get("sampler") or {}).items()
+                        if v is not None})
+            _STATS_SAMPLER = StatsSampler(get_docker_client, enabled=cfg["enabled"],
+                                          interval_seconds=cfg["interval_seconds"],
+                                          history_seconds=cfg["history_seconds"],
+                                          max_streams=cfg["max_streams"])
+        return _STATS_SAMPLER
+
+def collect_container_stats(cids) -> dict:
+    """
+    Stats of running containers by id: from the background sampler's memory when it
+    is enabled, otherwise fetched on demand through the shared collector. Containers
+    past the sampler's max_streams also go through the collector.
+    """
+    sampler = get_stats_sampler()
+    if not sampler.enabled:
+        return get_stats_collector().collect(cids)
+    cids = list(cids)
+    unsampled = sampler.unsampled(cids)
+    if not unsampled:
+        return sampler.latest(cids)
+    skip = set(unsampled)
+    stats = sampler.latest([cid for cid in cids if cid not in skip])
+    stats.update(get_stats_collector().collect(unsampled))
+    return stats
+
+_CONTAINER_INVENTORY = None
+
+def get_container_inventory() -> ContainerInventory:
+    """
+    Process-wide container inventory (`containers.inventory`), kept current by the
+    Docker event listener; each reconciliation also resyncs the stats sampler.
+    """
+    global _CONTAINER_INVENTORY
+    with _DOCKER_CLIENT_LOCK:
+        if _CONTAINER_INVENTORY is None:
+            cfg = dict(INVENTORY_DEFAULTS)
+            cfg.update({k: v for k, v in ((load_config().get("containers") or {}).get("inventory") or {}).items()
+                        if v is not None})
+            _CONTAINER_INVENTORY = ContainerInventory(get_docker_client, reconcile_seconds=cfg["reconcile_seconds"],
+                                                      on_reconcile=lambda running: get_stats_sampler().sync(running))
+        return _CONTAINER_INVENTORY
+
 def enrich_with_inspect(container_id: str) -> dict:
     if not container_id:
         return {}
     try:
-        client = docker.from_env()
+        client = get_docker_client()
         c = client.containers.get(container_id)
         meta = client.api.inspect_container(container_id)
 
@@ -316,14 +389,15 @@ def enrich_with_inspect(container_id: str) -> dict:
         detected = []
         if privileged:
             detected.append("privileged")
-        if any("docker.sock" in str(m) for m in mounts):
+        mount_hits = {h["category"] for h in get_mount_analyzer().analyze(parse_mounts(meta))}
+        if "docker_socket" in mount_hits:
             detected.append("docker_sock_mount")
         if not user or user in ("0", "root"):
             detected.append("runs_as_root")
         for cap in caps:
             if cap in DANGEROUS_CAPS:
                 detected.append(f"cap_{cap}")
-        if any(any(h in str(m) for h in SENSITIVE_PATH_HINTS) for m in mounts):
+        if "sensitive_host" in mount_hits:
             detected.append("sensitive_host_mount")
 
         return {
@@ -341,52 +415,325 @@ def enrich_with_inspect(container_id: str) -> dict:
         log.warning("inspect failed for %s: %s", container_id, e)
         return {}
 
-_TRIVY_CACHE = {}  # key -> summary
+def get_trivy_cache() -> TrivyCache:
+    """
+    Process-wide persistent Trivy cache configured from `trivy.cache` and
+    `trivy.cache_ttl_minutes` in config.yml (TRIVY_CACHE_TTL seconds as fallback).
+    """
+    global _TRIVY_CACHE
+    with _TRIVY_CACHE_LOCK:
+        if _TRIVY_CACHE is None:
+            trivy_cfg = load_config().get("trivy") or {}
+            cache_cfg = dict(TRIVY_CACHE_DEFAULTS)
+            cache_cfg.update({k: v for k, v in (trivy_cfg.get("cache") or {}).items() if v is not None})
+            ttl_minutes = trivy_cfg.get("cache_ttl_minutes")
+            ttl = float(ttl_minutes) * 60 if ttl_minutes is not None else float(os.environ.get("TRIVY_CACHE_TTL", "3600"))
+            _TRIVY_CACHE = TrivyCache(
+                os.environ.get("TRIVY_CACHE_DIR", cache_cfg["dir"]),
+                max_entries=int(cache_cfg["max_entries"]),
+                max_bytes=int(float(cache_cfg["max_mb"]) * 1024 * 1024),
+                ttl_seconds=ttl,
+            )
+        return _TRIVY_CACHE
+
+def get_trivy_server() -> TrivyServer:
+    """
+    Process-wide `trivy server` supervisor configured from `trivy.server`. When
+    server mode is disabled it still supplies the standalone command line, so
+    cache_dir / offline apply to every scan.
+    """
+    global _TRIVY_SERVER
+    with _TRIVY_CACHE_LOCK:
+        if _TRIVY_SERVER is None:
+            cfg = dict(TRIVY_SERVER_DEFAULTS)
+            cfg.update({k: v for k, v in ((load_config().get("trivy") or {}).get("server") or {}).items()
+                        if v is not None})
+            _TRIVY_SERVER = TrivyServer(
+                enabled=cfg["enabled"],
+                listen=str(cfg["listen"]),
+                cache_dir=cfg["cache_dir"],
+                offline=cfg["offline"],
+                token=cfg["token"],
+                startup_timeout=float(cfg["startup_timeout_seconds"]),
+                backoff=float(cfg["restart_backoff_seconds"]),
+                max_backoff=float(cfg["max_backoff_seconds"]),
+            )
+        return _TRIVY_SERVER
+
+def get_findings_store() -> FindingsStore:
+    """Process-wide store of full per-image findings, configured from `trivy.findings`."""
+    global _FINDINGS_STORE
+    with _TRIVY_CACHE_LOCK:
+        if _FINDINGS_STORE is None:
+            cfg = dict(FINDINGS_DEFAULTS)
+            cfg.update({k: v for k, v in ((load_config().get("trivy") or {}).get("findings") or {}).items()
+                        if v is not None})
+            _FINDINGS_STORE = FindingsStore(cfg["db"], max_images=int(cfg["max_images"]))
+        return _FINDINGS_STORE
+
+def trivy_image_command(image_ref: str) -> list:
+    """argv for scanning one image (client mode against the local server when it is up)."""
+    return get_trivy_server().image_command(image_ref)
+
+def _db_version() -> str:
+    return trivy_db_version(cache_dir=get_trivy_server().cache_dir)
+
+def warm_trivy_cache() -> None:
+    """
+    Load the on-disk cache and the Trivy DB version so the first gate check is a
+    lookup, then, if trivy.prescan_local_images is set, pre-scan the most recent
+    local images the cache doesn't cover (at most trivy.prescan_local_limit).
+    """
+    try:
+        get_trivy_cache().load()
+        _db_version()
+        trivy_cfg = load_config().get("trivy") or {}
+        if trivy_cfg.get("enabled", True) and trivy_cfg.get("prescan_local_images", False):
+            prescan_local_images(int(trivy_cfg.get("prescan_local_limit", 20) or 0))
+    except Exception as e:
+        log.warning("Trivy cache warm-up failed: %s", e)
 
-def trivy_scan_image(image_ref: str, image_id: str | None = None, timeout_sec: int = 90):
-    
-    import subprocess, json, logging
-    log = logging.getLogger(__name__)
+def remember_image_tag(image_ref: str, digest: str) -> None:
+    if image_ref and digest:
+        with _TRIVY_CACHE_LOCK:
+            _TAG_DIGESTS[image_ref] = digest
+
+def image_layers(image_ref: str) -> list:
+    """Layer diff IDs (RootFS.Layers, bottom first) of a local image, or [] if unknown."""
+    try:
+        attrs = get_docker_client().images.get(image_ref).attrs or {}
+        return list((attrs.get("RootFS") or {}).get("Layers") or [])
+    except Exception:
+        return []
+
+def resolve_image_digest(image_ref: str, fresh: bool = False):
+    """
+    Local image ID (sha256:...) for a tag, or None if Docker doesn't know it.
+    Tags seen in pull/tag events are answered from memory unless `fresh` is set.
+    """
+    if not fresh:
+        with _TRIVY_CACHE_LOCK:
+            digest = _TAG_DIGESTS.get(image_ref)
+        if digest:
+            return digest
+    try:
+        return get_docker_client().images.get(image_ref).id
+    except Exception:
+        return None
+
+def prescan_image(image_ref: str, digest: str | None = None):
+    """
+    Fill the scan cache for a freshly pulled or tagged image on the background
+    lane, so a later admission check is a cache lookup. A new tag for a digest
+    that was already scanned reuses that result without running Trivy.
+    """
+    digest = digest or resolve_image_digest(image_ref, fresh=True)
+    remember_image_tag(image_ref, digest)
+    fut = scan_image_async(image_ref, image_id=digest, lane="background")
+    with _TRIVY_CACHE_LOCK:
+        _PRESCAN["requested"] += 1
+        _PRESCAN["reused" if fut.done() else "queued"] += 1
+    if fut.done():
+        log.info("Pre-scan of %s reuses cached result for %s", image_ref, digest)
+    return fut
+
+def prescan_local_images(limit: int = 20) -> int:
+    """
+    Queue pre-scans for the `limit` most recently created tagged local images
+    (pulled while the daemon was down; 0 = no limit); returns how many were queued.
+    """
+    queued = 0
+    try:
+        images = get_docker_client().images.list()
+    except Exception as e:
+        log.warning("Could not list local images for pre-scan: %s", e)
+        return 0
+    tagged = []
+    for image in images:
+        tags = image.tags or []
+        for tag in tags:
+            remember_image_tag(tag, image.id)
+        if tags:
+            tagged.append(image)
+    tagged.sort(key=lambda image: (image.attrs or {}).get("Created") or "", reverse=True)
+    if limit > 0:
+        tagged = tagged[:limit]
+    for image in tagged:
+        if not prescan_image(image.tags[0], digest=image.id).done():
+            queued += 1
+    log.info("Queued pre-scans for %d of %d local images", queued, len(images))
+    return queued
+
+def _trivy_slots() -> threading.BoundedSemaphore:
+    global _TRIVY_SLOTS
+    with _TRIVY_CACHE_LOCK:
+        if _TRIVY_SLOTS is None:
+            limit = int((load_config().get("trivy") or {}).get("max_concurrent_scans", 2) or 1)
+            _TRIVY_SLOTS = threading.BoundedSemaphore(max(1, limit))
+        return _TRIVY_SLOTS
+
+def trivy_scan_stats() -> dict:
+    stats = {"single_flight": _TRIVY_FLIGHT.stats(), "cache": get_trivy_cache().stats(),
+             "server": get_trivy_server().stats(), "findings": get_findings_store().stats()}
+    with _TRIVY_CACHE_LOCK:
+        stats["prescan"] = {**_PRESCAN, "known_tags": len(_TAG_DIGESTS)}
+        stats["layer_reuse"] = dict(_LAYER_REUSE)
+    if _SCAN_SCHEDULER is not None:
+        stats["scheduler"] = _SCAN_SCHEDULER.stats()
+    return stats
+
+def get_scan_scheduler() -> ScanScheduler:
+    """
+    Process-wide scan scheduler; workers default to trivy.max_concurrent_scans.
+    Enrichment and background scans get one Trivy slot less than the scheduler
+    could use, so a gate scan always finds a free worker and a free slot.
+    """
+    global _SCAN_SCHEDULER
+    with _TRIVY_CACHE_LOCK:
+        if _SCAN_SCHEDULER is None:
+            trivy_cfg = load_config().get("trivy") or {}
+            timeout = int(trivy_cfg.get("timeout", 90) or 90)
+            slots = max(1, int(trivy_cfg.get("max_concurrent_scans", 2) or 1))
+            workers = int(trivy_cfg.get("scan_workers") or slots)
+            _SCAN_SCHEDULER = ScanScheduler(
+                lambda ref, image_id: trivy_scan_image(ref, image_id=image_id, timeout_sec=timeout),
+                workers=workers,
+                shared_workers=min(workers, slots) - 1,
+            ).start()
+        return _SCAN_SCHEDULER
+
+def scan_image_async(image_ref: str, image_id: str | None = None, lane: str = "background"):
+    """
+    Queue a Trivy scan on the given lane ("gate", "enrichment", "background") and
+    return a Future. Cached results come back as an already-completed Future.
+    """
+    if image_ref:
+        digest = image_id or resolve_image_digest(image_ref) or image_ref
+        cached = get_trivy_cache().get(digest, _db_version())
+        if cached is not None:
+            fut = Future()
+            fut.set_result(cached)
+            return fut
+        image_id = image_id or (digest if digest != image_ref else None)
+    return get_scan_scheduler().submit(image_ref, image_id=image_id, lane=lane)
 
+def trivy_scan_image(image_ref: str, image_id: str | None = None, timeout_sec: int = 90):
+    """
+    Scan summary of an image, from the cache when possible. Reuse is per whole
+    layer stack: an image whose layers (ChainID) match one scanned before gets
+    its result without running Trivy. An image with any new layer, such as an app
+    rebuilt on a cached base, is scanned in full; Trivy's own layer cache only
+    skips re-analysing the shared layers. Findings are not composed from
+    per-layer results, because an upper layer can remove or upgrade packages of
+    the layers below it. `by_layer` in the summary holds counts only.
+    """
     if not image_ref:
         return None
 
-    cache_key = image_id or image_ref
-    if cache_key in _TRIVY_CACHE:
-        entry = _TRIVY_CACHE.get(cache_key) or {}
-        ts = entry.get("ts")
-        if ts and (datetime.utcnow() - ts).total_seconds() < _TRIVY_TTL_SECONDS:
-            return entry.get("summary")
+    # Results are keyed by image digest + DB version, so tags that move to a new
+    # image, and DB updates, both miss the cache
+    digest = image_id or resolve_image_digest(image_ref) or image_ref
+    db_version = _db_version()
+    cache = get_trivy_cache()
+    cached = cache.get(digest, db_version)
+    if cached is not None:
+        return cached
+
+    def scan():
+        # A scan that finished between our cache miss and joining the flight already filled the cache
+        summary = cache.peek(digest, db_version)
+        if summary is not None:
+            return summary
+        # Same layer stack as an image scanned before (only the config differs): reuse its findings
+        rootfs = chain_id(image_layers(digest))
+        rootfs = f"rootfs:{rootfs}" if rootfs else None
+        if rootfs:
+            summary = cache.get(rootfs, db_version)
+            with _TRIVY_CACHE_LOCK:
+                _LAYER_REUSE["hits" if summary is not None else "misses"] += 1
+            if summary is not None:
+                cache.put(digest, db_version, summary, image_ref=image_ref)
+                _link_findings(image_ref, digest, rootfs)
+                return summary
+        # A full scan; layers already analyzed for other images come from Trivy's own
+        # layer cache (shared through trivy.server.cache_dir), so only their analysis is skipped
+        findings_key = rootfs or digest
+        with _trivy_slots():
+            summary = _run_trivy_image(image_ref, timeout_sec, findings_key=findings_key, db_version=db_version)
+        if summary is not None:
+            cache.put(digest, db_version, summary, image_ref=image_ref)
+            if rootfs:
+                cache.put(rootfs, db_version, summary, image_ref=image_ref)
+            _link_findings(image_ref, digest, findings_key)
+        return summary
+
+    return _TRIVY_FLIGHT.do(cache.key(digest, db_version), scan)
 
+def _link_findings(image_ref: str, digest: str, findings_key: str) -> None:
     try:
-        out = subprocess.check_output(
-            ["trivy", "image", "--quiet", "--format", "json", image_ref],
-            stderr=subprocess.STDOUT, timeout=timeout_sec
-        )
-        data = json.loads(out)
-        vulns = []
-        for r in data.get("Results", []) or []:
-            for v in r.get("Vulnerabilities", []) or []:
-                vulns.append({
-                    "id": v.get("VulnerabilityID"),
-                    "pkg": v.get("PkgName"),
-                    "ver": v.get("InstalledVersion"),
-                    "sev": v.get("Severity"),
-                })
-        summary = {
-            "count": len(vulns),
-            "high_or_critical": sum(1 for x in vulns if x.get("sev") in ("HIGH","CRITICAL")),
-            "sample": vulns[:5],
-        }
-        _TRIVY_CACHE[cache_key] = {"ts": datetime.utcnow(), "summary": summary}
-        return summary
+        store = get_findings_store()
+        store.link(digest, findings_key)
+        if image_ref != digest:
+            store.link(image_ref, findings_key)
+    except sqlite3.Error as e:
+        log.warning("Could not link findings for %s: %s", image_ref, e)
+
+def _trivy_rows(proc, builder: SummaryBuilder):
+    """
+    Findings from a running `trivy image` as they are parsed; raises if Trivy fails
+    or its output is not a report (e.g. empty, or an error object on exit 0).
+    """
+    seen = set()
+    for target, vuln in iter_vulnerabilities(proc.stdout, seen=seen):
+        yield builder.add(finding_row(target, vuln))
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    if not is_report(seen):
+        raise ValueError("Trivy output is not a report")
+
+def _run_trivy_image(image_ref: str, timeout_sec: int = 90, findings_key: str | None = None,
+                     db_version: str | None = None):
+    """
+    Run Trivy and parse its report incrementally. The summary is built on the fly
+    and, with a findings_key, every finding is streamed into the findings store.
+    """
+    builder = SummaryBuilder()
+    try:
+        with tempfile.TemporaryFile() as err:
+            proc = subprocess.Popen(trivy_image_command(image_ref), stdout=subprocess.PIPE, stderr=err,
+                                    text=True, encoding="utf-8", errors="replace")
+            timed_out = threading.Event()
+            timer = threading.Timer(timeout_sec, lambda: (timed_out.set(), proc.kill()))
+            timer.start()
+            try:
+                rows = _trivy_rows(proc, builder)
+                if findings_key:
+                    try:
+                        get_findings_store().replace(findings_key, rows, image_ref=image_ref, db_version=db_version)
+                    except sqlite3.Error as e:
+                        # Keep the gate working without the detail store
+                        log.warning("Could not store findings for %s: %s", image_ref, e)
+                for _ in rows:
+                    pass
+            except (subprocess.CalledProcessError, ValueError) as e:
+                err.seek(0)
+                detail = err.read()[-2000:].decode("utf-8", "replace").strip()
+                if timed_out.is_set():
+                    log.warning("Trivy timed out after %ss for %s", timeout_sec, image_ref)
+                else:
+                    log.warning("Trivy failed for %s: %s %s", image_ref, e, detail)
+                return None
+            finally:
+                timer.cancel()
+                if proc.poll() is None:
+                    proc.kill()
+                proc.wait()
+                proc.stdout.close()
+        return builder.summary()
 
     except FileNotFoundError:
         log.warning("Trivy binary not found in container PATH; skipping scan.")
         return None
-    except subprocess.CalledProcessError as e:
-        log.warning("Trivy failed for %s: %s", image_ref, e)
-        return None
     except Exception as e:
         log.warning("Trivy error for %s: %s", image_ref, e)
         return None